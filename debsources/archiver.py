@@ -16,7 +16,7 @@ from __future__ import absolute_import
 import logging
 import os
 
-from sqlalchemy import sql
+from sqlalchemy import sql, not_
 
 from debsources import db_storage, statistics, updater
 from debsources.debmirror import SourcePackage
@@ -84,35 +84,47 @@ def add_suite(conf, session, suite, archive):
         logging.warn('sticky suite %s already exist, looking for new packages'
                      % suite)
 
+    packages = db_storage.PackageIndex(session)
+
     if updater.STAGE_EXTRACT in conf['stages']:
+        known_ids = []  # already known packages, that should become sticky
         for pkg in archive.ls(suite):
-            db_package = db_storage.lookup_package(session, pkg['package'],
-                                                   pkg['version'])
-            if db_package:  # avoid GC upon removal from a non-sticky suite
-                if not db_package.sticky and not conf['dry_run']:
-                    logging.debug('setting sticky bit on %s' % pkg)
-                    db_package.sticky = True
+            package_id = packages.lookup(pkg['package'], pkg['version'])
+            if package_id:  # avoid GC upon removal from a non-sticky suite
+                known_ids.append(package_id)
             else:
                 if not conf['single_transaction']:
                     with session.begin():
                         updater._add_package(pkg, conf, session, sticky=True)
                 else:
                     updater._add_package(pkg, conf, session, sticky=True)
+        if known_ids and not conf['dry_run']:
+            logging.debug('setting sticky bit on %d packages' % len(known_ids))
+            session.query(Package) \
+                   .filter(Package.id.in_(known_ids)) \
+                   .filter(not_(Package.sticky)) \
+                   .update({'sticky': True}, synchronize_session=False)
         session.flush()  # to fill Package.id-s
+        db_storage.bulk_flush(session)
+        updater.run_shell_batches(conf)
 
     if updater.STAGE_SUITES in conf['stages']:
         suitemap_q = sql.insert(Suite.__table__)
         suitemaps = []
+        mapped_ids = set(row[0] for row in
+                         session.query(Suite.package_id)
+                                .filter(Suite.suite == suite))
         for (pkg, version) in archive.suites[suite]:
-            db_package = db_storage.lookup_package(session, pkg, version)
-            if not db_package:
+            package_id = packages.lookup(pkg, version)
+            if not package_id:
                 logging.warn('package %s/%s not found in sticky suite'
                              ' %s, skipping'
                              % (pkg, version, suite))
                 continue
-            if not db_storage.lookup_suitemapping(session, db_package, suite):
-                suitemaps.append({'package_id': db_package.id,
+            if package_id not in mapped_ids:
+                suitemaps.append({'package_id': package_id,
                                   'suite': suite})
+                mapped_ids.add(package_id)
         if suitemaps and not conf['dry_run']:
             session.execute(suitemap_q, suitemaps)
 
@@ -162,6 +174,7 @@ def remove_suite(conf, session, suite):
             if suitemap and not conf['dry_run']:
                 session.delete(suitemap)
 
+        updater.run_shell_batches(conf)
         if not conf['dry_run']:
             session.delete(db_suite)
 
@@ -11,8 +11,11 @@
 
 from __future__ import absolute_import
 
+import hashlib
 import logging
+import multiprocessing
 import operator
+import os
 
 import matplotlib
 import six
@@ -200,3 +203,121 @@ def bottom_sum(items, n):
         for z, i in enumerate(item):
             b_sum[z] += i
     return b_sum
+
+
+# bump to re-render all charts, e.g. when changing how they are drawn
+CHARTS_STYLE = 1
+
+# index of rendered charts, mapping chart file names to input hashes
+CHARTS_INDEX = 'charts.hashes'
+
+
+def _canonical(obj):
+    """canonical representation of chart inputs: dictionaries are turned into
+    sorted lists of items, so that their representation does not depend on
+    insertion order
+
+    """
+    if isinstance(obj, dict):
+        return sorted((k, _canonical(v)) for (k, v) in six.iteritems(obj))
+    elif isinstance(obj, (list, tuple)):
+        return [_canonical(x) for x in obj]
+    return obj
+
+
+def chart_hash(plot, args, kwargs):
+    """hash of the inputs of a chart: plotting function, data and style"""
+    inputs = (CHARTS_STYLE, plot, _canonical(args), _canonical(kwargs))
+    return hashlib.sha1(repr(inputs)).hexdigest()
+
+
+def load_index(fname):
+    """load an index of rendered charts, as a dictionary mapping chart file
+    names to input hashes
+
+    """
+    index = {}
+    if os.path.exists(fname):
+        with open(fname) as f:
+            for line in f:
+                (digest, chart) = line.rstrip('\n').split('\t', 1)
+                index[chart] = digest
+    return index
+
+
+def save_index(index, fname):
+    """save an index of rendered charts, atomically"""
+    with open(fname + '.new', 'w') as out:
+        for (chart, digest) in sorted(six.iteritems(index)):
+            out.write('%s\t%s\n' % (digest, chart))
+    os.rename(fname + '.new', fname)
+
+
+def _render_chart(job):
+    """render a single chart, see `render_charts`
+
+    handles and logs exceptions; return a pair <fname, success>
+    """
+    (plot, args, kwargs) = job
+    try:
+        globals()[plot](*args, **kwargs)
+        return (kwargs['fname'], True)
+    except Exception:
+        logging.exception('failed to render chart %s' % kwargs['fname'])
+        plt.close('all')  # do not leak half-drawn figures into other charts
+        return (kwargs['fname'], False)
+
+
+def render_charts(jobs, stats_dir, workers=1):
+    """render the charts described by `jobs` in `stats_dir`
+
+    `jobs` is a list of <plot, args, kwargs> triples: the name of a plotting
+    function of this module and its arguments, with the chart file name passed
+    as the `fname` keyword argument
+
+    charts whose inputs did not change since they have been last rendered are
+    skipped; the others are rendered in parallel by `workers` processes, if
+    more than one. Charts that fail to render are logged and retried at the
+    next run
+
+    return the number of rendered charts
+
+    """
+    index_file = os.path.join(stats_dir, CHARTS_INDEX)
+    index = load_index(index_file)
+    todo = []
+    hashes = {}
+    for (plot, args, kwargs) in jobs:
+        chart = os.path.basename(kwargs['fname'])
+        digest = chart_hash(plot, args, kwargs)
+        if index.get(chart) == digest and os.path.exists(kwargs['fname']):
+            continue
+        hashes[kwargs['fname']] = digest
+        todo.append((plot, args, kwargs))
+    logging.info('render %d charts, %d unchanged'
+                 % (len(todo), len(jobs) - len(todo)))
+
+    pool = None
+    if workers > 1 and len(todo) > 1:
+        pool = multiprocessing.Pool(workers)
+        results = pool.imap_unordered(_render_chart, todo)
+    else:
+        results = (_render_chart(job) for job in todo)
+    rendered = 0
+    try:
+        for (fname, success) in results:
+            if success:
+                index[os.path.basename(fname)] = hashes[fname]
+                rendered += 1
+        if pool is not None:
+            pool.close()
+    except Exception:
+        if pool is not None:
+            pool.terminate()
+        raise
+    finally:
+        if pool is not None:
+            pool.join()
+        # charts rendered so far are up to date, whatever happens next
+        save_index(index, index_file)
+    return rendered
@@ -55,7 +55,10 @@ CTAGS_LANGUAGES = (
 # TODO uniform CTAGS_* language naming (possibly without blessing any of the
 # two, but using a 3rd, Debsources specific, canonical form)
 
-METRIC_TYPES = ("size",)
+# size: disk usage, in KiB, as reported by du(1); apparent_size (of files, in
+# bytes), file_count, dir_count (subdirectories), largest_file (in bytes)
+METRIC_TYPES = ("size", "apparent_size", "file_count", "dir_count",
+                "largest_file")
 
 
 # debian package areas
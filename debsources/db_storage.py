@@ -11,17 +11,67 @@
 
 from __future__ import absolute_import
 
+import contextlib
+import itertools
 import logging
+import time
+
+import six
+from six.moves import range
+from sqlalchemy import Column, MetaData, String, Table
+from sqlalchemy import and_, event, not_, sql
+from sqlalchemy.orm import contains_eager
 
 from debsources import fs_storage
+from debsources import instrumentation
 from debsources.models import File, Package, PackageName, SuiteInfo, Suite
+from debsources.models import PackageSummary
 from debsources.models import VCS_TYPES
 
+# maximum number of files added to the DB by a single (multi-row) INSERT
+BULK_FLUSH_THRESHOLD = 10000
+
+# maximum number of rows buffered by a BulkInserter before they are sent to
+# the DB
+BULK_INSERT_THRESHOLD = 50000
+
 
-def add_package(session, pkg, pkgdir, sticky=False):
+def _add_files(session, db_package, relpaths):
+    """add files `relpaths` of package `db_package` to the DB, in bulk
+
+    return the package file table, see `add_package`
+
+    """
+    files = File.__table__
+    file_table = {}
+    if session.get_bind().dialect.name == 'postgresql':
+        # multi-row INSERT ... RETURNING: one round trip per batch
+        for i in range(0, len(relpaths), BULK_FLUSH_THRESHOLD):
+            rows = [{'package_id': db_package.id, 'path': relpath}
+                    for relpath in relpaths[i:i + BULK_FLUSH_THRESHOLD]]
+            insert_q = files.insert() \
+                            .values(rows) \
+                            .returning(files.c.id, files.c.path)
+            for (file_id, relpath) in session.execute(insert_q):
+                file_table[relpath] = file_id
+    elif relpaths:
+        # fallback for DBs without multi-row INSERT ... RETURNING (e.g.,
+        # SQLite): bulk insert, then fetch all file IDs at once
+        session.execute(files.insert(),
+                        [{'package_id': db_package.id, 'path': relpath}
+                         for relpath in relpaths])
+        select_q = sql.select([files.c.path, files.c.id]) \
+                      .where(files.c.package_id == db_package.id)
+        file_table = dict(session.execute(select_q).fetchall())
+    return file_table
+
+
+def add_package(session, pkg, pkgdir, sticky=False, file_table=None):
     """Add `pkg` (a `debmirror.SourcePackage`) to the DB.
 
     If `sticky` is set, also set the corresponding bit in the versions table.
+    If `file_table` (a `fs_storage.FileTable`) is given, the package files
+    are taken from its scan, rather than by walking `pkgdir`.
 
     Return the package file table, which maps relative (file) path within the
     extracted package to file identifiers pointing into the `models.File`
@@ -58,18 +108,16 @@ def add_package(session, pkg, pkgdir, sticky=False):
         session.flush()  # to get a version.id, needed by File below
 
         # add individual source files to the File table
-        file_table = {}
-        for (relpath, _abspath) in fs_storage.walk_pkg_files(pkgdir):
-            file_ = File(db_package, relpath)
-            session.add(file_)
-            session.flush()
-            file_table[relpath] = file_.id
-
-        return file_table
+        relpaths = [relpath for (relpath, _abspath)
+                    in fs_storage.walk_pkg_files(pkgdir, file_table)]
+        return _add_files(session, db_package, relpaths)
 
 
 def rm_package(session, pkg, db_package):
     """Remove a package (= debmirror.SourcePackage) from the Debsources db
+
+    Rows referencing the package (files, checksums, ctags, etc.) are removed
+    by the DB itself, via ON DELETE CASCADE
     """
     logging.debug('remove from db %s...' % pkg)
     session.delete(db_package)
@@ -78,6 +126,19 @@ def rm_package(session, pkg, db_package):
         session.delete(db_package.name)
 
 
+def update_summary(session, package_id, **totals):
+    """set per-package `totals` (see `models.PackageSummary`) of package
+    `package_id`, creating its summary row if needed
+
+    """
+    updated = session.query(PackageSummary) \
+                     .filter_by(package_id=package_id) \
+                     .update(totals, synchronize_session=False)
+    if not updated and any(v is not None for v in six.itervalues(totals)):
+        totals['package_id'] = package_id
+        session.execute(PackageSummary.__table__.insert().values(**totals))
+
+
 def lookup_package(session, package, version):
     """Lookup a package in the Debsources db, using <package, version> as key
     """
@@ -88,6 +149,92 @@ def lookup_package(session, package, version):
                   .first()
 
 
+class PackageIndex(object):
+    """in-memory index of the packages known to the Debsources db, mapping
+    <package, version> pairs to package IDs
+
+    The index is loaded from the DB once, at creation time. Lookups of
+    packages missing from the index (e.g., packages added after index
+    creation) fall back to the DB, caching positive results.
+
+    """
+
+    def __init__(self, session):
+        logging.debug('load package index...')
+        self._session = session
+        q = session.query(PackageName.name, Package.version, Package.id) \
+                   .join(Package)
+        self._ids = dict(((name, version), id) for (name, version, id) in q)
+        self._new_ids = {}  # packages found in the DB after index loading
+
+    def __len__(self):
+        return len(self._ids) + len(self._new_ids)
+
+    def __iter__(self):
+        """iterate over indexed <package, version> pairs"""
+        return itertools.chain(self._ids, self._new_ids)
+
+    def lookup(self, package, version):
+        """return the ID of package <package, version>, or `None` if it is
+        not in the DB
+
+        """
+        pkg_id = (package, version)
+        package_id = self._ids.get(pkg_id) or self._new_ids.get(pkg_id)
+        if package_id is None:
+            db_package = lookup_package(self._session, package, version)
+            if not db_package:
+                return None
+            package_id = self._new_ids[pkg_id] = db_package.id
+        return package_id
+
+    def preloaded(self, package, version):
+        """whether package <package, version> was already in the DB when the
+        index was loaded
+
+        """
+        return (package, version) in self._ids
+
+    def discard(self, package, version):
+        """forget about package <package, version>, e.g. upon removal"""
+        self._ids.pop((package, version), None)
+        self._new_ids.pop((package, version), None)
+
+
+def gone_packages(session, pkg_ids):
+    """return the non-sticky packages of the Debsources db that are not listed
+    in `pkg_ids`, an iterable of <package, version> pairs (e.g., the packages
+    of a mirror), as `models.Package` instances
+
+    `pkg_ids` are loaded in bulk into a temporary table, and the result is
+    computed by the DB with a single anti-join
+
+    """
+    tmp = Table('tmp_pkg_ids', MetaData(),
+                Column('name', String), Column('version', String),
+                prefixes=['TEMPORARY'])
+    with session.begin(subtransactions=True):
+        # within a savepoint: upon failure, rolling it back also disposes of
+        # the temporary table, with no statement issued on an aborted
+        # transaction
+        with session.begin_nested():
+            tmp.create(session.connection())
+            bulk_insert(session, tmp, ('name', 'version'), list(pkg_ids))
+            if session.get_bind().dialect.name == 'postgresql':
+                session.execute('ANALYZE %s' % tmp.name)
+            q = session.query(Package) \
+                       .options(contains_eager(Package.name)) \
+                       .join(PackageName) \
+                       .outerjoin(tmp,
+                                  and_(tmp.c.name == PackageName.name,
+                                       tmp.c.version == Package.version)) \
+                       .filter(tmp.c.name.is_(None)) \
+                       .filter(not_(Package.sticky))
+            packages = q.all()
+            tmp.drop(session.connection())
+    return packages
+
+
 def lookup_db_suite(session, suite, sticky=False):
     return session.query(SuiteInfo) \
                   .filter_by(name=suite, sticky=sticky) \
@@ -129,3 +276,191 @@ def rm_file(session, package, relpath, file_table=None):
                        .filter_by(name=package, path=relpath) \
                        .first()
     session.delete(file_)
+
+
+def _copy_value(value):
+    """format `value` as a column value of PostgreSQL's COPY text format"""
+    if value is None:
+        return '\\N'
+    if isinstance(value, six.text_type):
+        value = value.encode('utf-8')
+    elif not isinstance(value, str):
+        return str(value)
+    return value.replace('\\', '\\\\').replace('\t', '\\t') \
+                .replace('\n', '\\n').replace('\r', '\\r')
+
+
+class _CopyStream(object):
+    """read-only file-like object streaming `rows` (tuples) in PostgreSQL's
+    COPY text format, as expected by psycopg2's copy_expert
+
+    """
+
+    def __init__(self, rows):
+        self._lines = ('\t'.join(_copy_value(v) for v in row) + '\n'
+                       for row in rows)
+
+    def read(self, size=8192):
+        chunk = []
+        length = 0
+        for line in self._lines:
+            chunk.append(line)
+            length += len(line)
+            if length >= size:
+                break
+        return ''.join(chunk)
+
+
+def bulk_insert(session, table, columns, rows):
+    """insert `rows` (a list of tuples matching `columns`) into `table` (a
+    `sqlalchemy.Table`) right away, using COPY on PostgreSQL and executemany()
+    INSERTs elsewhere
+
+    """
+    if session.get_bind().dialect.name == 'postgresql':
+        copy_q = 'COPY %s (%s) FROM STDIN' % (table.name, ', '.join(columns))
+        cursor = session.connection().connection.cursor()
+        try:
+            cursor.copy_expert(copy_q, _CopyStream(rows))
+        finally:
+            cursor.close()
+    elif rows:
+        session.execute(table.insert(),
+                        [dict(zip(columns, row)) for row in rows])
+
+
+class BulkInserter(object):
+    """bulk loader of rows into DB tables, shared by all DB writers of a
+    session, see `bulk_inserter`
+
+    Rows are buffered, and sent to the DB when BULK_INSERT_THRESHOLD rows are
+    pending, upon `flush`, at the end of `savepoint` blocks (e.g., one per
+    package), and right before the session transaction gets committed. Rows
+    are sent using COPY on PostgreSQL, and executemany() INSERTs elsewhere.
+
+    Note that, when rows are queued within savepoints, batching does not span
+    across them: each savepoint costs one round-trip per table it inserted
+    into. This is the price of failure isolation, see `savepoint`.
+
+    Pending rows are not visible to DB queries: readers of the involved
+    tables should `flush` first.
+
+    """
+
+    def __init__(self, session, threshold=BULK_INSERT_THRESHOLD):
+        self._session = session
+        self._threshold = threshold
+        self._pending = {}  # <table name, columns> -> <table, rows>
+        self._count = 0     # number of pending rows
+        self.rows = {}      # table name -> number of rows inserted so far
+        self.seconds = {}   # table name -> time spent inserting them
+
+    def __len__(self):
+        return self._count
+
+    def insert(self, table, columns, rows):
+        """queue `rows` (an iterable of tuples matching `columns`) for
+        insertion into `table` (a `sqlalchemy.Table`)
+
+        return the number of queued rows
+
+        """
+        key = (table.name, tuple(columns))
+        count = 0
+        for row in rows:
+            count += 1
+            if key not in self._pending:
+                self._pending[key] = (table, [])
+            self._pending[key][1].append(row)
+            self._count += 1
+            if self._count >= self._threshold:
+                self.flush()
+        return count
+
+    def flush(self):
+        """send all pending rows to the DB"""
+        pending = self._pending
+        self.discard()
+        for ((name, columns), (table, rows)) in six.iteritems(pending):
+            wall = time.time()
+            cpu = instrumentation._cpu_time()
+            bulk_insert(self._session, table, columns, rows)
+            wall = time.time() - wall
+            cpu = instrumentation._cpu_time() - cpu
+            self.rows[name] = self.rows.get(name, 0) + len(rows)
+            self.seconds[name] = self.seconds.get(name, 0.) + wall
+            instrumentation.get().record('db', 'bulk insert %s' % name,
+                                         wall, cpu, count=len(rows))
+            logging.debug('bulk inserted %d rows into %s in %.2fs'
+                          % (len(rows), name, wall))
+
+    def discard(self):
+        """forget about all pending rows"""
+        self._pending = {}
+        self._count = 0
+
+    @contextlib.contextmanager
+    def savepoint(self):
+        """wrap the enclosed block in a nested transaction (SAVEPOINT) of the
+        session. Rows queued within the block are sent to the DB before the
+        nested transaction is released, so that insertion errors only roll
+        back the block. If the block fails, rows queued within it are
+        discarded together with the nested transaction; rows queued before it
+        are kept
+
+        Flushing at the end of each block trades cross-block batching (e.g.,
+        a single COPY for the rows of many packages) for that isolation:
+        deferring the flush to the commit of the enclosing transaction would
+        let a single bad row abort all the work done since the last commit
+
+        """
+        outer = (self._pending, self._count)
+        self.discard()
+        try:
+            with self._session.begin_nested():
+                yield self
+                self.flush()
+        finally:
+            (self._pending, self._count) = outer
+
+    def rates(self):
+        """return insertion rates achieved so far, as a mapping from table
+        names to rows per second
+
+        """
+        return dict((name, self.rows[name] / self.seconds[name])
+                    for name in self.rows if self.seconds[name] > 0)
+
+
+def bulk_inserter(session):
+    """return the BulkInserter of `session`, creating it if needed
+
+    pending rows are flushed when the session transaction is committed, and
+    discarded when it is rolled back
+
+    """
+    inserter = session.info.get('bulk_inserter')
+    if inserter is None:
+        inserter = session.info['bulk_inserter'] = BulkInserter(session)
+
+        def before_commit(session):
+            if session.transaction.parent is None:  # top-level transaction
+                inserter.flush()
+
+        def after_soft_rollback(session, previous_transaction):
+            if previous_transaction.parent is None:  # top-level transaction
+                inserter.discard()
+
+        event.listen(session, 'before_commit', before_commit)
+        event.listen(session, 'after_soft_rollback', after_soft_rollback)
+    return inserter
+
+
+def bulk_flush(session):
+    """send all rows pending in the BulkInserter of `session` (if any) to the
+    DB
+
+    """
+    inserter = session.info.get('bulk_inserter')
+    if inserter is not None:
+        inserter.flush()
@@ -11,26 +11,67 @@
 
 from __future__ import absolute_import
 
+import contextlib
+import gzip
+import hashlib
 import logging
 import os
+import subprocess
 
 from debian import deb822
 from debian.debian_support import version_compare
+from six.moves import cPickle as pickle
+from six.moves import intern
 
 # supported compression formats for Sources files. Order does matter: formats
 # appearing early in the list will be preferred to those appearing later
 SOURCES_COMP_FMTS = ['gz', 'xz']
 
+# Sources fields retained when parsing Sources files; these are all the fields
+# Debsources needs (vcs-* fields are retained too)
+SOURCES_RECORD_FIELDS = ['package', 'version', 'directory', 'section']
+
+# Sources fields listing source package files, used to locate .dsc files
+SOURCES_FILES_FIELDS = ['files', 'checksums-sha256']
+
+# format version of the on-disk cache of parsed Sources files; bump it whenever
+# the format of cached records changes
+SOURCES_CACHE_FORMAT = 2
+
 
 class DebmirrorError(RuntimeError):
     """runtime error when using a local Debian mirror"""
     pass
 
 
-class SourcePackage(deb822.Sources):
+class SourcePackage(object):
     """Debian source package, as it appears in a source mirror
+
+    Lightweight record retaining only the Sources fields needed by Debsources;
+    field values can be accessed as in a (read-only) deb822 paragraph, e.g.
+    pkg['package'] or pkg['vcs-git'].
+
     """
 
+    __slots__ = ('package', 'version', 'directory', 'section', 'dsc', 'vcs',
+                 'mirror_root')
+
+    def __init__(self, package, version, directory=None, section=None,
+                 dsc=None, vcs=None, mirror_root=None):
+        """create a source package record
+
+        `dsc` is the name of the .dsc file of the package, `vcs` an (optional)
+        tuple of <vcs-* field, value> pairs
+
+        """
+        self.package = package
+        self.version = version
+        self.directory = directory
+        self.section = section
+        self.dsc = dsc
+        self.vcs = vcs
+        self.mirror_root = mirror_root
+
     @classmethod
     def from_db_model(cls, db_package):
         """build a (mock) SourcePackage object from a models.Package instance
@@ -41,14 +82,48 @@ class SourcePackage(deb822.Sources):
         enough for the purposes of Debsources' needs.
 
         """
-        meta = {}
-        meta['package'] = db_package.name.name
-        meta['version'] = db_package.version
-        meta['section'] = db_package.area
-        return cls(meta)
-
-    # override deb822's __eq__, as in source package land we can rely on
-    # <package, version> pair uniqueness
+        return cls(db_package.name.name, db_package.version,
+                   section=db_package.area)
+
+    def __reduce__(self):
+        return (SourcePackage, (self.package, self.version, self.directory,
+                                self.section, self.dsc, self.vcs,
+                                self.mirror_root))
+
+    def __getitem__(self, key):
+        """deb822-like access to package fields"""
+        if key.startswith('vcs-'):
+            value = dict(self.vcs or ()).get(key)
+        elif key == 'x-debsources-mirror-root':
+            value = self.mirror_root
+        elif key in SOURCES_RECORD_FIELDS:
+            value = getattr(self, key)
+        else:
+            value = None
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        keys = [k for k in SOURCES_RECORD_FIELDS
+                if getattr(self, k) is not None]
+        keys.extend(k for (k, _v) in self.vcs or ())
+        return keys
+
+    # in source package land we can rely on <package, version> pair uniqueness
     def __eq__(self, other):
         """equality based on <package, version> paris only
         """
@@ -58,6 +133,9 @@ class SourcePackage(deb822.Sources):
             return False
         return True
 
+    def __ne__(self, other):
+        return not self == other
+
     def __cmp__(self, other):
         """comparison based on <package, version> pairs only
         """
@@ -69,12 +147,12 @@ class SourcePackage(deb822.Sources):
     def __hash__(self):
         """compute hash based on <package, version> pair only
         """
-        return hash((self['package'], self['version']))
+        return hash((self.package, self.version))
 
     def __str__(self):
         """package/version representation of a package
         """
-        return "%s/%s" % (self['package'], self['version'])
+        return "%s/%s" % (self.package, self.version)
 
     __repr__ = __str__
     __unicode__ = __str__
@@ -87,29 +165,26 @@ class SourcePackage(deb822.Sources):
 
         """
         area = None
-        try:
-            sec = self['section']
+        sec = self.section
+        if sec is not None:
             if sec.startswith('contrib'):
                 area = 'contrib'
             elif sec.startswith('non-free'):
                 area = 'non-free'
             else:
                 area = 'main'
-        except KeyError:  # section not found, might happen in some old
-                # buggy packages; try an heuristic
-            try:
-                directory = self['directory']
-                steps = directory.split('/')
-                if 'non-free' in steps:
-                    area = 'non-free'
-                elif 'contrib' in steps:
-                    area = 'contrib'
-                else:
-                    area = 'main'
-                logging.warn('guessed archive area %s for package %s'
-                             % (area, self))
-            except KeyError:
-                area = None
+        elif self.directory is not None:
+            # section not found, might happen in some old buggy packages; try
+            # an heuristic
+            steps = self.directory.split('/')
+            if 'non-free' in steps:
+                area = 'non-free'
+            elif 'contrib' in steps:
+                area = 'contrib'
+            else:
+                area = 'main'
+            logging.warn('guessed archive area %s for package %s'
+                         % (area, self))
 
         return area
 
@@ -133,24 +208,28 @@ class SourcePackage(deb822.Sources):
         e.g.: 1st character of package name or "lib" + 1st char, depending on
         the package
         """
-        return self.pkg_prefix(self['package'])
+        return self.pkg_prefix(self.package)
 
     def dsc_path(self):
         """return (absolute) path to .dsc file for this package
         """
-        files_field = None
-        for field in ['checksums-sha256', 'files']:
-            if field in self:
-                files_field = field
-                break
-        if not files_field:
+        if not self.dsc:
             raise ValueError('cannot list components of source package: %s'
                              % self)
-
-        dsc = filter(lambda f: f['name'].endswith('.dsc'),
-                     self[files_field])[0]['name']
         return os.path.join(self['x-debsources-mirror-root'],
-                            self['directory'], dsc)
+                            self['directory'], self.dsc)
+
+    def source_size(self):
+        """return the total size (in bytes) of the files composing this
+        package in the mirror, .dsc file included
+
+        """
+        dsc = self.dsc_path()
+        size = os.path.getsize(dsc)
+        with open(dsc) as f:
+            for entry in deb822.Dsc(f).get('files', []):
+                size += int(entry['size'])
+        return size
 
     def extraction_dir(self, basedir=None):
         """return package extraction dir, relative to debsources sources_dir
@@ -165,24 +244,103 @@ class SourcePackage(deb822.Sources):
 
         steps = [area,
                  self.prefix(),
-                 self['package'],
-                 self['version']]
+                 self.package,
+                 self.version]
         if basedir:
             steps.insert(0, basedir)
         return os.path.join(*steps)
 
 
+@contextlib.contextmanager
+def _open_Sources(path):
+    """open a (possibly compressed) Sources file for line-based reading"""
+    if path.endswith('.gz'):
+        with gzip.open(path) as f:
+            yield f
+    elif path.endswith('.xz'):
+        # no xz support in the Python 2 standard library, use xz(1)
+        xz = subprocess.Popen(['xz', '--decompress', '--stdout', path],
+                              stdout=subprocess.PIPE)
+        try:
+            yield xz.stdout
+        finally:
+            xz.stdout.close()
+            retcode = xz.wait()
+        if retcode != 0:
+            raise DebmirrorError('cannot decompress Sources file: ' + path)
+    else:
+        with open(path) as f:
+            yield f
+
+
+def parse_Sources(path):
+    """stream-parse the Sources file at `path`, possibly compressed
+
+    Only retain the fields needed by Debsources. Yield one tuple per paragraph:
+    <package, version, directory, section, dsc, vcs>, where `dsc` is the name
+    of the .dsc file and `vcs` a tuple of <vcs-* field, value> pairs (or
+    `None`). Missing fields are set to `None`.
+
+    """
+    def record(fields, dsc, vcs):
+        if 'package' not in fields or 'version' not in fields:
+            logging.warn('ignoring malformed paragraph in %s' % path)
+            return None
+        return (fields['package'], fields['version'], fields.get('directory'),
+                fields.get('section'), dsc, tuple(vcs) or None)
+
+    fields = {}
+    vcs = []
+    dsc = None
+    in_files = False  # are we in a multi-line files / checksums-* field?
+    with _open_Sources(path) as lines:
+        for line in lines:
+            if line[:1] in (' ', '\t'):  # continuation line
+                if in_files and dsc is None:
+                    name = line.split()[-1]
+                    if name.endswith('.dsc'):
+                        dsc = name
+                continue
+            if not line.strip():  # paragraph separator
+                if fields:
+                    pkg = record(fields, dsc, vcs)
+                    if pkg is not None:
+                        yield pkg
+                fields = {}
+                vcs = []
+                dsc = None
+                in_files = False
+                continue
+            (key, _sep, value) = line.partition(':')
+            key = key.lower()
+            in_files = key in SOURCES_FILES_FIELDS
+            if key in SOURCES_RECORD_FIELDS:
+                fields[key] = value.strip()
+            elif key.startswith('vcs-'):
+                vcs.append((key, value.strip()))
+        if fields:
+            pkg = record(fields, dsc, vcs)
+            if pkg is not None:
+                yield pkg
+
+
 class SourceMirror(object):
     """Handle for a local Debian source mirror
     """
 
-    def __init__(self, path):
+    def __init__(self, path, cache_dir=None):
         """create a handle to a local source mirror rooted at path
+
+        if `cache_dir` is given, parsed Sources files will be cached there,
+        and reused as long as the corresponding Sources files do not change
+
         """
         self.mirror_root = path
         self._suites = None    # dict: suite name -> [<package, version>]
         self._packages = None  # set(<package, version>)
+        self._fingerprints = None  # dict: suite name -> fingerprint
         self._dists_dir = os.path.join(path, 'dists')
+        self._cache_dir = cache_dir
 
     @property
     def suites(self):
@@ -210,6 +368,114 @@ class SourceMirror(object):
         assert self._packages is not None
         return self._packages
 
+    @property
+    def fingerprints(self):
+        """return a mapping from suite names to suite fingerprints
+
+        suite fingerprints are opaque strings, that change whenever the
+        suite's Sources files change. Computing them does not require parsing
+        Sources files, hence this property is cheap to access before ls()
+        """
+        if self._fingerprints is None:
+            fingerprints = {}  # suite name -> [Sources fingerprint]
+            for (suite, _src_index, fingerprint) in self.__fingerprints():
+                fingerprints.setdefault(suite, []).append(fingerprint)
+            self._fingerprints = self.__suite_fingerprints(fingerprints)
+        return self._fingerprints
+
+    def __release_checksums(self, suite):
+        """return a mapping from Sources files of `suite` (relative to the
+        suite dir) to their SHA256 checksums, as listed in the Release file
+
+        """
+        checksums = {}
+        release = os.path.join(self._dists_dir, suite, 'Release')
+        if os.path.exists(release):
+            with open(release) as f:
+                for entry in deb822.Release(f).get('sha256', []):
+                    checksums[entry['name']] = entry['sha256']
+        return checksums
+
+    def __fingerprint(self, suite, src_index, release_checksums):
+        """compute the fingerprint of Sources file `src_index` of `suite`"""
+        stat = os.stat(src_index)
+        relpath = os.path.relpath(src_index,
+                                  os.path.join(self._dists_dir, suite))
+        return (relpath, stat.st_size, stat.st_mtime,
+                release_checksums.get(relpath))
+
+    def __fingerprints(self, suite=None):
+        """iterate over <suite, src_index, fingerprint> triples for all the
+        Sources files of the mirror (of `suite` only, if given)
+
+        """
+        release_checksums = {}  # suite name -> Release checksums
+        for (cursuite, src_index) in self.__find_Sources():
+            if suite is not None and cursuite != suite:
+                continue
+            if cursuite not in release_checksums:
+                release_checksums[cursuite] = \
+                    self.__release_checksums(cursuite)
+            yield (cursuite, src_index,
+                   self.__fingerprint(cursuite, src_index,
+                                      release_checksums[cursuite]))
+
+    @staticmethod
+    def __suite_fingerprints(fingerprints):
+        """combine the fingerprints of the Sources files of each suite, given
+        as a mapping from suite names to lists of them
+
+        """
+        return dict((s, hashlib.sha1(repr(sorted(fps))).hexdigest())
+                    for (s, fps) in fingerprints.items())
+
+    def __cache_path(self, src_index):
+        relpath = os.path.relpath(src_index, self._dists_dir)
+        return os.path.join(self._cache_dir,
+                            relpath.replace('/', '_') + '.cache')
+
+    def __load_cache(self, src_index, fingerprint):
+        """return cached records of Sources file `src_index`, or `None` if
+        they are not available for the given `fingerprint`
+
+        """
+        cache = self.__cache_path(src_index)
+        if not os.path.exists(cache):
+            return None
+        try:
+            with open(cache, 'rb') as f:
+                (cached_fingerprint, records) = pickle.load(f)
+        except Exception:
+            logging.warn('ignoring corrupted Sources cache %s' % cache)
+            return None
+        if cached_fingerprint != (SOURCES_CACHE_FORMAT, fingerprint):
+            return None
+        return records
+
+    def __save_cache(self, src_index, fingerprint, records):
+        if not os.path.isdir(self._cache_dir):
+            os.makedirs(self._cache_dir)
+        cache = self.__cache_path(src_index)
+        with open(cache + '.new', 'wb') as f:
+            pickle.dump(((SOURCES_CACHE_FORMAT, fingerprint), records), f,
+                        pickle.HIGHEST_PROTOCOL)
+        os.rename(cache + '.new', cache)
+
+    def __parse_Sources(self, src_index, fingerprint):
+        """iterate over the records of Sources file `src_index` (see
+        `parse_Sources`), using the on-disk cache (if enabled)
+
+        """
+        if self._cache_dir is None:
+            return parse_Sources(src_index)
+        records = self.__load_cache(src_index, fingerprint)
+        if records is not None:
+            logging.debug('use cached parse of %s' % src_index)
+            return records
+        records = list(parse_Sources(src_index))
+        self.__save_cache(src_index, fingerprint, records)
+        return records
+
     def __find_Sources(self):
         """Find Sources entries contained in the mirror, in various supported
         compression formats
@@ -230,15 +496,26 @@ class SourceMirror(object):
             else:
                 return variants[0]
 
-        for root, dirs, files in os.walk(self._dists_dir):
-            src_bases = set([os.path.join(root, os.path.splitext(file)[0])
-                             for file in files
-                             if os.path.splitext(file)[0] == 'Sources'])
-            src_indexes = [choose_comp(b) for b in src_bases]
-            for f in src_indexes:
-                steps = f.split('/')
-                suite = steps[-4]  # wheezy, jessie, sid, ...
-                yield suite, f
+        def subdirs(path):
+            """list subdirectories of `path`, not following symlinks (e.g.,
+            suite aliases), as os.walk would do
+
+            """
+            for name in sorted(os.listdir(path)):
+                subdir = os.path.join(path, name)
+                if os.path.isdir(subdir) and not os.path.islink(subdir):
+                    yield name, subdir
+
+        # list dists/SUITE/COMPONENT/source/Sources* directly, rather than
+        # walking the whole dists/ tree
+        for suite, suite_dir in subdirs(self._dists_dir):
+            for _comp, comp_dir in subdirs(suite_dir):
+                src_dir = os.path.join(comp_dir, 'source')
+                if not os.path.isdir(src_dir) or os.path.islink(src_dir):
+                    continue
+                if any(os.path.splitext(file)[0] == 'Sources'
+                       for file in os.listdir(src_dir)):
+                    yield suite, choose_comp(os.path.join(src_dir, 'Sources'))
 
     def pkg_prefixes(self):
         """Return the list of relevant package prefixes
@@ -269,22 +546,26 @@ class SourceMirror(object):
         """
         self._suites = {}
         self._packages = set()
-
-        for cursuite, src_index in self.__find_Sources():
-            if suite is not None and cursuite != suite:
-                continue
-            with open(src_index) as i:
-                for pkg in SourcePackage.iter_paragraphs(i):
-                    pkg_id = (pkg['package'], pkg['version'])
-
-                    if cursuite not in self._suites:
-                        self._suites[cursuite] = []
-                    self._suites[cursuite].append(pkg_id)
-
-                    if pkg_id not in self._packages:
-                        self._packages.add(pkg_id)
-                        pkg['x-debsources-mirror-root'] = self.mirror_root
-                        yield pkg
+        fingerprints = {}  # suite name -> [Sources fingerprint]
+
+        for (cursuite, src_index, fingerprint) in self.__fingerprints(suite):
+            fingerprints.setdefault(cursuite, []).append(fingerprint)
+            suite_pkgs = self._suites.setdefault(cursuite, [])
+            for (package, version, directory, section, dsc, vcs) \
+                    in self.__parse_Sources(src_index, fingerprint):
+                # the same names and versions recur across suites: intern them
+                # to keep the pairs stored in suites and packages small
+                pkg_id = (intern(package), intern(version))
+                suite_pkgs.append(pkg_id)
+
+                if pkg_id not in self._packages:
+                    self._packages.add(pkg_id)
+                    if section is not None:
+                        section = intern(section)
+                    yield SourcePackage(pkg_id[0], pkg_id[1], directory,
+                                        section, dsc, vcs, self.mirror_root)
+
+        self._fingerprints = self.__suite_fingerprints(fingerprints)
 
     def ls_suites(self, aliases=False):
         """list suites available in the archive
@@ -14,10 +14,21 @@ from __future__ import absolute_import
 import logging
 import os
 import shutil
+import stat
 import subprocess
 
+from collections import namedtuple
+
 import six
 
+try:
+    from os import scandir
+except ImportError:  # Python < 3.5: use the scandir backport, if available
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
 from debsources.consts import DPKG_EXTRACT_UMASK
 from debsources.subprocess_workaround import subprocess_setup
 
@@ -82,6 +93,102 @@ def walk(sources_dir, test=None):
             del(dirs[:])  # stop recursion
 
 
+# file (or directory) of an extracted package, as found by scan_pkg_files.
+# relpath is relative to the package directory, size/blocks/mode/inode/nlink
+# come from lstat(2), link_target is None unless the file is a symlink
+PkgFile = namedtuple('PkgFile', ['relpath', 'abspath', 'size', 'blocks',
+                                 'mode', 'inode', 'nlink', 'link_target'])
+
+
+class FileTable(dict):
+    """package file table: mapping from file paths, relative to the package
+    directory, to DB file identifiers
+
+    Also carry the result of a package scan (if any, None otherwise), so that
+    hooks don't need to scan (or stat) the package again: `files` maps the
+    same paths to `PkgFile` entries, `dirs` lists `PkgFile` entries of
+    package (sub)directories, and `dir_links` those of symlinks pointing to
+    directories (which are neither files nor directories for walking
+    purposes). Note that the mapping to file identifiers might be empty (e.g.,
+    when the DB storage is not used), whereas the scan result is always
+    complete.
+
+    """
+
+    def __init__(self, files=None, dirs=None, dir_links=None):
+        super(FileTable, self).__init__()
+        self.files = files
+        self.dirs = dirs
+        self.dir_links = dir_links
+
+    def discard(self, relpath):
+        """forget about file `relpath`, e.g. after its removal"""
+        self.pop(relpath, None)
+        if self.files is not None:
+            self.files.pop(relpath, None)
+
+
+def _scan_dir(path):
+    """list entries of directory `path` as tuples <name, abspath, lstat,
+    is_dir>, where is_dir follows symlinks (as os.walk does)
+
+    """
+    if scandir is not None:
+        for entry in scandir(path):
+            yield (entry.name, entry.path, entry.stat(follow_symlinks=False),
+                   entry.is_dir())
+    else:
+        for name in os.listdir(path):
+            abspath = os.path.join(path, name)
+            st = os.lstat(abspath)
+            is_dir = stat.S_ISDIR(st.st_mode) or \
+                (stat.S_ISLNK(st.st_mode) and os.path.isdir(abspath))
+            yield (name, abspath, st, is_dir)
+
+
+def scan_pkg_files(pkgdir):
+    """scan the files in pkgdir once, returning a `FileTable` (with no file
+    identifiers) that describes them
+
+    Files are the same of `walk_pkg_files`: symlinks to directories are
+    neither listed as files nor followed, as it happens with os.walk
+
+    """
+    if isinstance(pkgdir, six.text_type):
+        pkgdir = str(pkgdir)  # see walk_pkg_files
+    table = FileTable({}, [], [])
+    todo = [('', pkgdir)]
+    while todo:
+        (reldir, absdir) = todo.pop()
+        for (name, abspath, st, is_dir) in _scan_dir(absdir):
+            relpath = os.path.join(reldir, name) if reldir else name
+            link_target = None
+            if stat.S_ISLNK(st.st_mode):
+                link_target = os.readlink(abspath)
+            info = PkgFile(relpath, abspath, st.st_size, st.st_blocks,
+                           st.st_mode, st.st_ino, st.st_nlink, link_target)
+            if not is_dir:
+                table.files[relpath] = info
+            elif link_target is not None:
+                table.dir_links.append(info)
+            else:
+                table.dirs.append(info)
+                todo.append((relpath, abspath))
+    return table
+
+
+def pkg_files(pkgdir, file_table=None):
+    """iterate over `PkgFile` entries of the source files in pkgdir
+
+    reuse the scan stored in `file_table` (see `FileTable`), if available
+
+    """
+    files = getattr(file_table, 'files', None)
+    if files is None:
+        files = scan_pkg_files(pkgdir).files
+    return six.itervalues(files)
+
+
 def walk_pkg_files(pkgdir, file_table=None):
     """walk the source files in pkgdir, yielding pairs <relpath, abspath>.
     `relpath` is a path relative to `pkgdir`, whereas `abspath` is an absolute
@@ -95,7 +202,10 @@ def walk_pkg_files(pkgdir, file_table=None):
         # might not even be UTF-8 clean. Using str() we ensure that path
         # operations will happen between raw strings, avoding encoding issues.
         pkgdir = str(pkgdir)
-    if file_table:
+    if getattr(file_table, 'files', None) is not None:
+        for info in six.itervalues(file_table.files):
+            yield (info.relpath, info.abspath)
+    elif file_table:
         for relpath in six.iterkeys(file_table):
             abspath = os.path.join(pkgdir, relpath)
             yield (relpath, abspath)
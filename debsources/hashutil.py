@@ -12,29 +12,95 @@
 from __future__ import absolute_import
 
 import hashlib
+import mmap
+import os
+
+from multiprocessing.pool import ThreadPool
 
 # should be a multiple of 64 (sha1/sha256's block size)
 # FWIW coreutils' sha1sum uses 32768
 HASH_BLOCK_SIZE = 32768
 
+# read buffer size used when computing digests; each read chunk is fed to all
+# requested digests
+HASH_BUFFER_SIZE = 32 * HASH_BLOCK_SIZE
+
+# files at least this big are mmap-ed instead of read
+HASH_MMAP_THRESHOLD = 16 * HASH_BUFFER_SIZE
+
+# pseudo-algorithm: Git blob identifier, i.e., SHA1 of "blob SIZE\0" + content
+GIT_BLOB = 'git-blob'
+
+# default number of threads used by `digests_many`; hashlib releases the GIL
+# while hashing, so threads do hash concurrently
+HASH_WORKERS = 4
+
+
+def _hashers(algos, size):
+    hashers = []
+    for algo in algos:
+        if algo == GIT_BLOB:
+            m = hashlib.sha1()
+            m.update('blob %d\0' % size)
+        else:
+            m = hashlib.new(algo)
+        hashers.append(m)
+    return hashers
+
+
+def digests(path, algos=('sha256',)):
+    """compute several digests of the file at `path`, reading it only once
+
+    `algos` are hashlib algorithm names (e.g., 'sha256', 'sha1', 'md5') or
+    GIT_BLOB. Return a dictionary mapping algorithms to hex digests
+
+    """
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        hashers = _hashers(algos, size)
+        if size >= HASH_MMAP_THRESHOLD:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                for m in hashers:
+                    m.update(data)
+            finally:
+                data.close()
+        else:
+            while True:
+                chunk = f.read(HASH_BUFFER_SIZE)
+                if not chunk:
+                    break
+                for m in hashers:
+                    m.update(chunk)
+    return dict((algo, m.hexdigest()) for (algo, m) in zip(algos, hashers))
+
+
+def digests_many(paths, algos=('sha256',), workers=HASH_WORKERS):
+    """compute digests of several files concurrently, see `digests`
+
+    Iterate over <path, digests> pairs, in the same order of `paths`
+
+    """
+    def job(path):
+        return (path, digests(path, algos))
+
+    if workers <= 1:
+        for path in paths:
+            yield job(path)
+        return
+
+    pool = ThreadPool(workers)
+    try:
+        for result in pool.imap(job, paths, 16):
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
 
 def sha1sum(path):
-    m = hashlib.sha1()
-    with open(path) as f:
-        while True:
-            chunk = f.read(HASH_BLOCK_SIZE)
-            if not chunk:
-                break
-            m.update(chunk)
-    return m.hexdigest()
+    return digests(path, ['sha1'])['sha1']
 
 
 def sha256sum(path):
-    m = hashlib.sha256()
-    with open(path) as f:
-        while True:
-            chunk = f.read(HASH_BLOCK_SIZE)
-            if not chunk:
-                break
-            m.update(chunk)
-    return m.hexdigest()
+    return digests(path, ['sha256'])['sha256']
@@ -0,0 +1,236 @@
+# Copyright (C) 2015  The Debsources developers <info@sources.debian.net>.
+# See the AUTHORS file at the top-level directory of this distribution and at
+# https://anonscm.debian.org/gitweb/?p=qa/debsources.git;a=blob;f=AUTHORS;hb=HEAD
+#
+# This file is part of Debsources. Debsources is free software: you can
+# redistribute it and/or modify it under the terms of the GNU Affero General
+# Public License as published by the Free Software Foundation, either version 3
+# of the License, or (at your option) any later version.  For more information
+# see the COPYING file at the top-level directory of this distribution and at
+# https://anonscm.debian.org/gitweb/?p=qa/debsources.git;a=blob;f=COPYING;hb=HEAD
+
+"""timing instrumentation of update runs
+
+Measures are grouped by category (e.g. 'stage', 'package', 'hook', 'db') and
+name within each category (e.g. 'extract', 'add-package/checksums'). Each
+measure records how many times it has been taken, wall-clock time, CPU time
+(child processes included, e.g. dpkg-source) and bytes processed.
+
+Measures nest: measures taken without an explicit amount of bytes accumulate
+the bytes of the measures taken within them, e.g. update stages sum up the
+bytes of the packages they process.
+
+"""
+
+from __future__ import absolute_import
+
+import contextlib
+import json
+import logging
+import os
+import time
+
+import six
+
+from sqlalchemy import event
+
+# category -> number of slowest entries to log at the end of update runs
+SUMMARY_CATEGORIES = [('stage', None), ('package', 10), ('hook', 10),
+                      ('db', None)]
+
+
+def _cpu_time():
+    """CPU time (user + system) used so far by this process and its waited-for
+    children
+
+    """
+    return sum(os.times()[:4])
+
+
+class Timing(object):
+    """aggregated measure"""
+
+    __slots__ = ('count', 'wall', 'cpu', 'bytes')
+
+    def __init__(self, count=0, wall=0., cpu=0., bytes=0):
+        self.count = count
+        self.wall = wall
+        self.cpu = cpu
+        self.bytes = bytes
+
+    def add(self, count, wall, cpu, bytes):
+        self.count += count
+        self.wall += wall
+        self.cpu += cpu
+        self.bytes += bytes
+
+    def to_dict(self):
+        return dict(count=self.count, wall=self.wall, cpu=self.cpu,
+                    bytes=self.bytes)
+
+
+class _Measure(object):
+    """measure in progress"""
+
+    __slots__ = ('category', 'name', 'bytes', 'accumulate', 'wall', 'cpu')
+
+    def __init__(self, category, name, bytes):
+        self.category = category
+        self.name = name
+        self.accumulate = bytes is None
+        self.bytes = bytes or 0
+        self.wall = time.time()
+        self.cpu = _cpu_time()
+
+
+class Instrumentation(object):
+    """collector of timing measures"""
+
+    def __init__(self):
+        self._timings = {}  # category -> name -> Timing
+        self._stack = []    # measures in progress, innermost last
+        self.start_time = time.time()
+
+    def record(self, category, name, wall, cpu, bytes=0, count=1):
+        """record a measure taken by other means"""
+        timings = self._timings.setdefault(category, {})
+        if name not in timings:
+            timings[name] = Timing()
+        timings[name].add(count, wall, cpu, bytes)
+
+    @contextlib.contextmanager
+    def measure(self, category, name, bytes=None):
+        """measure the wrapped block of code
+
+        if `bytes` is None, bytes processed will be the sum of the bytes of the
+        measures nested within this one. The ongoing measure is returned by
+        the context manager, its `bytes` attribute can be updated.
+
+        """
+        m = _Measure(category, name, bytes)
+        self._stack.append(m)
+        try:
+            yield m
+        finally:
+            self._stack.pop()
+            self.record(category, name, time.time() - m.wall,
+                        _cpu_time() - m.cpu, m.bytes)
+            if self._stack and self._stack[-1].accumulate:
+                self._stack[-1].bytes += m.bytes
+
+    def current(self, category):
+        """return the innermost measure in progress for `category`, or None"""
+        for m in reversed(self._stack):
+            if m.category == category:
+                return m
+        return None
+
+    @contextlib.contextmanager
+    def watch_session(self, session):
+        """measure DB activity of `session` within the wrapped block: time
+        spent flushing the session and executing SQL statements (whether
+        issued by flushes or not)
+
+        """
+        flush_start = []
+        exec_start = []
+
+        def before_flush(session, flush_context, instances):
+            flush_start[:] = [time.time(), _cpu_time()]
+
+        def after_flush(session, flush_context):
+            if flush_start:
+                (wall, cpu) = flush_start
+                self.record('db', 'flush', time.time() - wall,
+                            _cpu_time() - cpu)
+                del flush_start[:]
+
+        def before_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+            exec_start.append((time.time(), _cpu_time()))
+
+        def after_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+            if exec_start:
+                (wall, cpu) = exec_start.pop()
+                self.record('db', 'execute', time.time() - wall,
+                            _cpu_time() - cpu)
+
+        listeners = [(session, 'before_flush', before_flush),
+                     (session, 'after_flush_postexec', after_flush)]
+        if session.bind is not None:
+            listeners.extend([
+                (session.bind, 'before_cursor_execute', before_execute),
+                (session.bind, 'after_cursor_execute', after_execute)])
+        for listener in listeners:
+            event.listen(*listener)
+        try:
+            yield
+        finally:
+            for listener in listeners:
+                event.remove(*listener)
+
+    def snapshot(self):
+        """return recorded timings as a JSON-serializable dictionary"""
+        return dict((category, dict((name, t.to_dict())
+                                    for (name, t) in six.iteritems(timings)))
+                    for (category, timings) in six.iteritems(self._timings))
+
+    def merge(self, snapshot):
+        """merge in timings recorded elsewhere, e.g. by a worker process"""
+        for (category, timings) in six.iteritems(snapshot):
+            for (name, t) in six.iteritems(timings):
+                self.record(category, name, t['wall'], t['cpu'], t['bytes'],
+                            t['count'])
+
+    def slowest(self, category, n=None):
+        """return the (at most) `n` slowest entries of `category`, as <name,
+        Timing> pairs, slowest first
+
+        """
+        timings = sorted(six.iteritems(self._timings.get(category, {})),
+                         key=lambda entry: entry[1].wall, reverse=True)
+        return timings[:n] if n is not None else timings
+
+    def write_report(self, fname):
+        """write a JSON report of recorded timings to `fname`"""
+        report = {
+            'start': self.start_time,
+            'end': time.time(),
+            'timings': self.snapshot(),
+        }
+        with open(fname + '.new', 'w') as out:
+            json.dump(report, out, indent=1, sort_keys=True)
+        os.rename(fname + '.new', fname)
+
+    def log_summary(self):
+        """log a summary of the slowest entries of each category"""
+        for (category, n) in SUMMARY_CATEGORIES:
+            entries = self.slowest(category, n)
+            if not entries:
+                continue
+            logging.info('timings of %s (%s):'
+                         % (category, 'top %d' % n if n else 'all'))
+            for (name, t) in entries:
+                logging.info('  %s: %.2fs wall, %.2fs cpu, %d bytes (x%d)'
+                             % (name, t.wall, t.cpu, t.bytes, t.count))
+
+
+_instrumentation = Instrumentation()
+
+
+def get():
+    """return the current (process-wide) instrumentation"""
+    return _instrumentation
+
+
+def reset():
+    """start afresh with a new (process-wide) instrumentation, and return it"""
+    global _instrumentation
+    _instrumentation = Instrumentation()
+    return _instrumentation
+
+
+def measure(category, name, bytes=None):
+    """shorthand for get().measure(...)"""
+    return _instrumentation.measure(category, name, bytes)
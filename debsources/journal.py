@@ -0,0 +1,110 @@
+# Copyright (C) 2015  The Debsources developers <info@sources.debian.net>.
+# See the AUTHORS file at the top-level directory of this distribution and at
+# https://anonscm.debian.org/gitweb/?p=qa/debsources.git;a=blob;f=AUTHORS;hb=HEAD
+#
+# This file is part of Debsources. Debsources is free software: you can
+# redistribute it and/or modify it under the terms of the GNU Affero General
+# Public License as published by the Free Software Foundation, either version 3
+# of the License, or (at your option) any later version.  For more information
+# see the COPYING file at the top-level directory of this distribution and at
+# https://anonscm.debian.org/gitweb/?p=qa/debsources.git;a=blob;f=COPYING;hb=HEAD
+
+"""on-disk journal of update runs, used to resume interrupted runs
+
+The journal is an append-only text file, with one tab-separated record per
+line:
+
+- start TIMESTAMP: beginning of the (first attempt of the) update run
+- mirror FINGERPRINT: state of the mirror the run works on
+- stage STAGE: update stage STAGE has been completed
+- package PACKAGE VERSION: package PACKAGE/VERSION has been completed
+
+Records are only appended after the corresponding DB changes have been
+committed, so that a journal never claims more than what the DB contains. The
+journal is removed at the end of successful runs: if it exists when a run
+starts, the previous run has been interrupted, and the new run resumes it,
+provided that the mirror did not change in between.
+
+"""
+
+from __future__ import absolute_import
+
+import logging
+import os
+import time
+
+
+class Journal(object):
+    """journal of an update run, stored in file `fname`
+
+    if `fname` is None, the journal is kept in memory only (e.g., for dry
+    runs)
+
+    """
+
+    def __init__(self, fname):
+        self._fname = fname
+        self._pending = []  # records not yet written to disk
+        self.start = None
+        self.mirror = None  # mirror fingerprint, see `set_mirror`
+        self.stages = set()
+        self.packages = set()  # <package, version> pairs
+        if fname is not None and os.path.exists(fname):
+            self._load()
+        self.resumed = self.start is not None
+        if not self.resumed:
+            self.start = time.time()
+            self._pending.append(('start', '%f' % self.start))
+
+    def _load(self):
+        with open(self._fname) as journal:
+            for line in journal:
+                if not line.endswith('\n'):
+                    break  # truncated record, e.g. upon crash
+                record = line.rstrip('\n').split('\t')
+                if record[0] == 'start':
+                    self.start = float(record[1])
+                elif record[0] == 'mirror':
+                    self.mirror = record[1]
+                elif record[0] == 'stage':
+                    self.stages.add(record[1])
+                elif record[0] == 'package':
+                    self.packages.add((record[1], record[2]))
+                else:
+                    logging.warn('ignoring unknown journal record: %s'
+                                 % line.rstrip())
+
+    def set_mirror(self, fingerprint):
+        """record the fingerprint of the mirror state the run works on"""
+        self.mirror = fingerprint
+        self._pending.append(('mirror', fingerprint))
+
+    def stage_done(self, stage):
+        self.stages.add(stage)
+        self._pending.append(('stage', stage))
+
+    def package_done(self, package, version):
+        self.packages.add((package, version))
+        self._pending.append(('package', package, version))
+
+    def sync(self):
+        """write pending records to disk
+
+        must be called only once the DB changes corresponding to pending
+        records have been committed
+
+        """
+        if self._fname is None or not self._pending:
+            return
+        with open(self._fname, 'a') as journal:
+            for record in self._pending:
+                journal.write('\t'.join(record) + '\n')
+            journal.flush()
+            os.fsync(journal.fileno())
+        self._pending = []
+
+    def finish(self):
+        """dispose of the journal, at the end of a complete run"""
+        self._pending = []
+        if self._fname is not None and os.path.exists(self._fname):
+            os.unlink(self._fname)
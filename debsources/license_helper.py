@@ -9,8 +9,10 @@
 # see the COPYING file at the top-level directory of this distribution and at
 # https://anonscm.debian.org/gitweb/?p=qa/debsources.git;a=blob;f=COPYING;hb=HEAD
 from __future__ import absolute_import
+import collections
 import io
 import logging
+import os
 import re
 
 from flask import url_for
@@ -75,6 +77,18 @@ Licenses = {
 }
 
 
+# all `Licenses` patterns, compiled once into a single alternation: group
+# "lN" matches the N-th pattern of _LICENSE_PATTERNS
+_LICENSE_PATTERNS = list(Licenses)
+_LICENSES_RE = re.compile('|'.join('(?P<l%d>%s)' % (i, pattern)
+                                   for (i, pattern)
+                                   in enumerate(_LICENSE_PATTERNS)))
+
+# license URLs of synopses, see match_license
+_license_urls = {}
+LICENSES_CACHE_SIZE = 65536
+
+
 def get_sources_path(session, package, version, config):
     ''' Creates a sources_path. Returns exception when it arises
     '''
@@ -94,29 +108,109 @@ def get_sources_path(session, package, version, config):
 
 def parse_license(sources_path):
     required_fields = ['Format:', 'Files:', 'Copyright:', 'License:']
-    d_file = open(sources_path).read()
+    # check raw bytes first: non machine readable files need not be UTF-8
+    with open(sources_path, 'rb') as f:
+        d_file = f.read()
     if not all(field in d_file for field in required_fields):
         raise copyright.NotMachineReadableError
-    with io.open(sources_path, mode='rt', encoding='utf-8') as f:
-        return copyright.Copyright(f)
+    return copyright.Copyright(io.StringIO(d_file.decode('utf-8'),
+                                           newline=None))
 
 
 def license_url(package, version):
     return url_for('.license', packagename=package, version=version)
 
 
+class FilesMatcher(object):
+    """ Compiled matcher of file paths against the Files paragraphs of a
+        parsed debian/copyright
+
+        Globs of all paragraphs are combined into a single regex, with later
+        paragraphs first, so that the first alternative that matches is the
+        last matching paragraph, as in `Copyright.find_files_paragraph`
+    """
+
+    # at most 100 groups per regex with Python 2's re module, hence paragraphs
+    # are compiled in chunks of this size
+    MAX_GROUPS = 99
+
+    def __init__(self, c):
+        self._paragraphs = list(c.all_files_paragraphs())
+        self._chunks = []  # <offset, size, regex>, last paragraphs first
+        for offset in range(0, len(self._paragraphs), self.MAX_GROUPS):
+            chunk = self._paragraphs[offset:offset + self.MAX_GROUPS]
+            pattern = '|'.join('((?:%s))' % copyright.globs_to_re(p.files)
+                               .pattern
+                               for p in reversed(chunk))
+            self._chunks.insert(0, (offset, len(chunk),
+                                    re.compile(pattern,
+                                               re.MULTILINE | re.DOTALL)))
+
+    def find_files_paragraph(self, path):
+        """ Return the last Files paragraph matching `path`, or None
+        """
+        for (offset, size, regex) in self._chunks:
+            m = regex.match(path)
+            if m:
+                return self._paragraphs[offset + size - m.lastindex]
+        return None
+
+    def classify(self, paths):
+        """ Iterate over <path, paragraph> pairs for all `paths`
+        """
+        find = self.find_files_paragraph
+        for path in paths:
+            yield (path, find(path))
+
+
+# parsed copyright files, see get_files_matcher
+_matchers = collections.OrderedDict()
+MATCHERS_CACHE_SIZE = 256
+
+
+def get_files_matcher(license_path):
+    """ Return a FilesMatcher for the debian/copyright at `license_path`, or
+        None if it is not machine readable. Matchers are cached, as long as
+        the copyright file does not change
+    """
+    key = (license_path, os.stat(license_path).st_mtime)
+    if key in _matchers:
+        return _matchers[key]
+    try:
+        matcher = FilesMatcher(parse_license(license_path))
+    except copyright.NotMachineReadableError:
+        matcher = None
+    if len(_matchers) >= MATCHERS_CACHE_SIZE:
+        _matchers.popitem(last=False)
+    _matchers[key] = matcher
+    return matcher
+
+
 def get_license(session, package, version, path, license_path=None):
     # if not license_path:
     #     # retrieve license from DB
     #     return qry.get_license_w_path(session, package, version, path)
 
     # parse license file to get license
-    try:
-        c = parse_license(license_path)
-    except copyright.NotMachineReadableError:
+    matcher = get_files_matcher(license_path)
+    if matcher is None:
         return None
 
-    paragraph = c.find_files_paragraph(path)
+    return get_file_license(matcher, package, version, path)
+
+
+def get_file_license(matcher, package, version, path):
+    """ Return the license synopsis of `path` according to `matcher` (either
+        a FilesMatcher or a parsed copyright), or None
+    """
+    return get_paragraph_license(matcher.find_files_paragraph(path),
+                                 package, version, path)
+
+
+def get_paragraph_license(paragraph, package, version, path):
+    """ Return the license synopsis of Files `paragraph` (that matched `path`),
+        or None
+    """
     if paragraph:
         try:
             return paragraph.license.synopsis
@@ -197,11 +291,18 @@ def create_url(glob="", base=None,):
 def match_license(synopsis):
     """ Matches a `synopsis` with a license and creates a url
     """
-    key = filter(lambda x: re.search(x, synopsis) is not None, Licenses)
-    if len(key) is not 0:
-        return Licenses[key[0]]
-    else:
-        return None
+    try:
+        return _license_urls[synopsis]
+    except KeyError:
+        pass
+    url = None
+    m = _LICENSES_RE.search(synopsis)
+    if m is not None:
+        url = Licenses[_LICENSE_PATTERNS[int(m.lastgroup[1:])]]
+    if len(_license_urls) >= LICENSES_CACHE_SIZE:
+        _license_urls.clear()
+    _license_urls[synopsis] = url
+    return url
 
 
 def parse_license_synopsis(copyright, synopsis):
@@ -36,6 +36,11 @@ DEFAULT_CONFIG.update({
         'expire_days': '0',
         'force_triggers': [],
         'single_transaction': 'true',
+        'extract_workers': '1',
+        'charts_workers': '1',
+        'journal': 'false',
+        'commit_every': '0/0',
+        'time_budget': '0',
         },
     'webapp': {
         'hidden_files': '*/*.pc/'
@@ -67,13 +72,12 @@ PROBABLE_CONF_FILES = [
 
 
 def parse_exclude(fname):
-    """parse file exclusion specifications from file `fname`
+    """parse exclusion specifications from file `fname`, and compile them to
+    an `updater.ExclusionSpecs`
 
     """
-    exclude_specs = []
     with open(fname) as f:
-        exclude_specs = list(deb822.Deb822.iter_paragraphs(f))
-    return exclude_specs
+        return updater.ExclusionSpecs(deb822.Deb822.iter_paragraphs(f))
 
 
 def guess_conffile():
@@ -92,11 +96,26 @@ def guess_conffile():
                     % str(PROBABLE_CONF_FILES))
 
 
+def parse_commit_every(s):
+    """parse a commit frequency specification of the form "PACKAGES/SECONDS",
+    e.g. "500/300" for committing every 500 packages or 5 minutes, whichever
+    comes first. Either can be 0, meaning no limit. Return a pair <packages,
+    seconds>
+
+    """
+    (packages, seconds) = s.split('/')
+    (packages, seconds) = (int(packages), int(seconds))
+    if packages < 0 or seconds < 0:
+        raise ValueError('invalid commit frequency %s' % s)
+    return (packages, seconds)
+
+
 def parse_conf_infra(items):
     """ returns correct typing for the [infra] section """
     typed = {}
     for (key, value) in items:
-        if key == 'expire_days':
+        if key in ['expire_days', 'extract_workers', 'charts_workers',
+                   'time_budget']:
             value = int(value)
         elif key == 'dry_run':
             assert value in ['true', 'false']
@@ -109,7 +128,9 @@ def parse_conf_infra(items):
             value = set(value.split())
         elif key == 'stages':
             value = updater.parse_stages(value)
-        elif key == 'single_transaction':
+        elif key == 'commit_every':
+            value = parse_commit_every(value)
+        elif key in ['single_transaction', 'journal']:
             assert value in ['true', 'false']
             value = (value == 'true')
         typed[key] = value
@@ -150,7 +171,7 @@ def load_conf(conffile, section="infra"):
         typed_conf.update(parse_conf_infra(conf.items('infra')))
 
         exclude_file = os.path.join(typed_conf['local_dir'], 'exclude.conf')
-        typed_conf['exclude'] = []
+        typed_conf['exclude'] = updater.ExclusionSpecs()
         if os.path.exists(exclude_file):
             typed_conf['exclude'] = parse_exclude(exclude_file)
 
@@ -178,6 +199,12 @@ def add_arguments(cmdline):
                          'using this you can mess up the update logic, use at '
                          'your own risk.',
                          dest='backends')
+    cmdline.add_argument('--commit-every', dest='commit_every',
+                         metavar='PACKAGES/SECONDS', type=parse_commit_every,
+                         help='in single transaction mode, commit every '
+                         'PACKAGES added packages or SECONDS seconds, '
+                         'whichever comes first; 0 means no limit (default: '
+                         '0/0)')
     cmdline.add_argument('--config', '-c', dest='conffile',
                          help='alternate configuration file')
     cmdline.add_argument('--dburi', '-u', dest='dburi',
@@ -200,6 +227,10 @@ def add_arguments(cmdline):
                          'your own risk.' %
                          list(map(updater.pp_stage, updater.UPDATE_STAGES)),
                          dest='stages')
+    cmdline.add_argument('--time-budget', dest='time_budget',
+                         metavar='MINUTES', type=int,
+                         help='stop the update run after MINUTES minutes; '
+                         'the next run will resume it (default: no limit)')
     cmdline.add_argument('--trigger', '-t',
                          metavar='EVENT/HOOK',
                          action='append',
@@ -242,6 +273,10 @@ def override_conf(conf, cmdline):
             conf['force_triggers'].append((event, hook))
     if cmdline.single_transaction:
         conf['single_transaction'] = (cmdline.single_transaction == 'yes')
+    if cmdline.commit_every is not None:
+        conf['commit_every'] = cmdline.commit_every
+    if cmdline.time_budget is not None:
+        conf['time_budget'] = cmdline.time_budget
 
 
 def conf_warnings(conf):
@@ -258,6 +293,10 @@ def conf_warnings(conf):
                      list(map(updater.pp_stage, conf['stages'])))
     if conf['force_triggers']:
         logging.warn('forcing triggers: %s' % conf['force_triggers'])
+    if any(conf['commit_every']) and not conf['single_transaction']:
+        logging.warn('commit_every ignored: not in single transaction mode')
+    if conf['time_budget']:
+        logging.warn('time budget: %d minutes' % conf['time_budget'])
 
 
 def load_hooks(conf):
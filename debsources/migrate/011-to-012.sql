@@ -0,0 +1,4 @@
+ALTER TYPE metric_types ADD VALUE 'apparent_size';
+ALTER TYPE metric_types ADD VALUE 'file_count';
+ALTER TYPE metric_types ADD VALUE 'dir_count';
+ALTER TYPE metric_types ADD VALUE 'largest_file';
@@ -0,0 +1,41 @@
+CREATE TABLE package_summaries (
+  package_id BIGINT NOT NULL,
+  size BIGINT,
+  source_files BIGINT,
+  ctags BIGINT,
+  CONSTRAINT package_summaries_package_id_fkey
+    FOREIGN KEY (package_id) REFERENCES packages(id)
+    ON DELETE CASCADE,
+  PRIMARY KEY (package_id)
+);
+
+CREATE TABLE package_licenses (
+  id BIGSERIAL NOT NULL,
+  package_id BIGINT NOT NULL,
+  license VARCHAR,
+  files BIGINT NOT NULL,
+  CONSTRAINT package_licenses_package_id_fkey
+    FOREIGN KEY (package_id) REFERENCES packages(id)
+    ON DELETE CASCADE,
+  PRIMARY KEY (id)
+);
+
+CREATE INDEX ix_package_licenses_package_id ON package_licenses (package_id);
+
+-- populate summaries from existing data, once and for all
+
+INSERT INTO package_summaries (package_id, size, source_files, ctags)
+  SELECT packages.id,
+    (SELECT value_ FROM metrics
+     WHERE metrics.package_id = packages.id AND metric = 'size'),
+    (SELECT count(*) FROM checksums
+     WHERE checksums.package_id = packages.id),
+    (SELECT count(*) FROM ctags
+     WHERE ctags.package_id = packages.id)
+  FROM packages;
+
+INSERT INTO package_licenses (package_id, license, files)
+  SELECT files.package_id, copyright.license, count(*)
+  FROM copyright, files
+  WHERE copyright.file_id = files.id
+  GROUP BY files.package_id, copyright.license;
@@ -27,7 +27,7 @@ Base = declarative_base()
 
 
 # used for migrations, see scripts under debsources/migrate/
-DB_SCHEMA_VERSION = 11
+DB_SCHEMA_VERSION = 13
 
 
 class PackageName(Base):
@@ -292,6 +292,46 @@ class Metric(Base):
         self.value = value
 
 
+class PackageSummary(Base):
+    """per-package totals of the data added by hooks, maintained at
+    add-package time and aggregated to compute statistics
+
+    columns are NULL if the corresponding hook has not been run on the package
+
+    """
+    __tablename__ = 'package_summaries'
+
+    package_id = Column(BIGINT,
+                        ForeignKey('packages.id', ondelete="CASCADE"),
+                        primary_key=True)
+    size = Column(BIGINT, nullable=True)          # disk usage, in KiB
+    source_files = Column(BIGINT, nullable=True)  # checksummed files
+    ctags = Column(BIGINT, nullable=True)
+
+    def __init__(self, version, size=None, source_files=None, ctags=None):
+        self.package_id = version.id
+        self.size = size
+        self.source_files = source_files
+        self.ctags = ctags
+
+
+class PackageLicense(Base):
+    """per-package file count of each license, summarizing `FileCopyright`"""
+    __tablename__ = 'package_licenses'
+
+    id = Column(BIGINT, primary_key=True)
+    package_id = Column(BIGINT,
+                        ForeignKey('packages.id', ondelete="CASCADE"),
+                        index=True, nullable=False)
+    license = Column(String)
+    files = Column(BIGINT, nullable=False)
+
+    def __init__(self, version, license, files):
+        self.package_id = version.id
+        self.license = license
+        self.files = files
+
+
 class HistorySize(Base):
     """historical record of debsources size"""
 
@@ -13,8 +13,9 @@ from __future__ import absolute_import
 
 import logging
 import os
+import stat
 
-from sqlalchemy import sql
+from six.moves import zip
 
 from debsources import db_storage
 from debsources import fs_storage
@@ -32,8 +33,7 @@ MY_EXT = '.' + MY_NAME
 def sums_path(pkgdir):
     return pkgdir + MY_EXT
 
-# maximum number of ctags after which a (bulk) insert is sent to the DB
-BULK_FLUSH_THRESHOLD = 100000
+CHECKSUMS_COLUMNS = ('package_id', 'file_id', 'sha256')
 
 
 def parse_checksums(path):
@@ -58,63 +58,42 @@ def add_package(session, pkg, pkgdir, file_table):
     sumsfile = sums_path(pkgdir)
     sumsfile_tmp = sumsfile + '.new'
 
-    def emit_checksum(out, relpath, abspath):
-        if os.path.islink(abspath) or not os.path.isfile(abspath):
+    if 'hooks.fs' in conf['backends']:
+        if not os.path.exists(sumsfile):  # compute checksums only if needed
             # Do not checksum symlinks, if they are not dangling / external we
             # will checksum their target anyhow. Do not check special files
             # either; they shouldn't be there per policy, but they might be
             # (and they are in old releases)
-            return
-        sha256 = hashutil.sha256sum(abspath)
-        out.write('%s  %s\n' % (sha256, relpath))
-
-    if 'hooks.fs' in conf['backends']:
-        if not os.path.exists(sumsfile):  # compute checksums only if needed
+            files = [f for f in fs_storage.pkg_files(pkgdir, file_table)
+                     if stat.S_ISREG(f.mode)]
+            sums = hashutil.digests_many([f.abspath for f in files])
             with open(sumsfile_tmp, 'w') as out:
-                for (relpath, abspath) in \
-                        fs_storage.walk_pkg_files(pkgdir, file_table):
-                    emit_checksum(out, relpath, abspath)
+                for (f, (_path, digests)) in zip(files, sums):
+                    out.write('%s  %s\n' % (digests['sha256'], f.relpath))
             os.rename(sumsfile_tmp, sumsfile)
 
     if 'hooks.db' in conf['backends']:
         db_package = db_storage.lookup_package(session, pkg['package'],
                                                pkg['version'])
-        insert_q = sql.insert(Checksum.__table__)
-        insert_params = []
         if not session.query(Checksum) \
                       .filter_by(package_id=db_package.id) \
                       .first():
             # ASSUMPTION: if *a* checksum of this package has already
             # been added to the db in the past, then *all* of them have,
             # as additions are part of the same transaction
-            for (sha256, relpath) in parse_checksums(sumsfile):
-                params = {'package_id': db_package.id,
-                          'sha256': sha256}
-                if file_table:
-                    try:
-                        file_id = file_table[relpath]
-                        params['file_id'] = file_id
-                    except KeyError:
-                        continue
-                else:
-                    file_ = session.query(File) \
-                                   .filter_by(package_id=db_package.id,
-                                              path=relpath) \
-                                   .first()
-                    if not file_:
-                        continue
-                    params['file_id'] = file_.id
-                insert_params.append(params)
-                if len(insert_params) >= BULK_FLUSH_THRESHOLD:
-                    session.execute(insert_q, insert_params)
-                    session.flush()
-                    insert_params = []
-            if insert_params:  # source packages shouldn't be empty but...
-                session.execute(insert_q, insert_params)
-                session.flush()
-
-
-def rm_package(session, pkg, pkgdir, file_table):
+            if not file_table:
+                file_table = dict(session.query(File.path, File.id)
+                                  .filter_by(package_id=db_package.id))
+            rows = ((db_package.id, file_table[relpath], sha256)
+                    for (sha256, relpath) in parse_checksums(sumsfile)
+                    if relpath in file_table)
+            count = db_storage.bulk_inserter(session).insert(
+                Checksum.__table__, CHECKSUMS_COLUMNS, rows)
+            db_storage.update_summary(session, db_package.id,
+                                      source_files=count)
+
+
+def rm_package(session, pkg, pkgdir, file_table, package_id):
     global conf
     logging.debug('rm-package %s' % pkg)
 
@@ -123,12 +102,11 @@ def rm_package(session, pkg, pkgdir, file_table):
         if os.path.exists(sumsfile):
             os.unlink(sumsfile)
 
-    if 'hooks.db' in conf['backends']:
-        db_package = db_storage.lookup_package(session, pkg['package'],
-                                               pkg['version'])
+    if 'hooks.db' in conf['backends'] and package_id is not None:
         session.query(Checksum) \
-               .filter_by(package_id=db_package.id) \
-               .delete()
+               .filter_by(package_id=package_id) \
+               .delete(synchronize_session=False)
+        db_storage.update_summary(session, package_id, source_files=None)
 
 
 def init_plugin(debsources):
@@ -11,12 +11,17 @@
 
 from __future__ import absolute_import
 
+import collections
 import io
 import logging
 import os
 
+import six
+
+from debian import copyright
+
 from debsources import db_storage, fs_storage
-from debsources.models import FileCopyright, File
+from debsources.models import FileCopyright, File, PackageLicense
 from debsources import license_helper as helper
 
 conf = None
@@ -24,6 +29,9 @@ conf = None
 MY_NAME = 'copyright'
 MY_EXT = '.' + MY_NAME
 
+COPYRIGHT_COLUMNS = ('file_id', 'oracle', 'license')
+PACKAGE_LICENSES_COLUMNS = ('package_id', 'license', 'files')
+
 
 def license_path(pkgdir):
     return pkgdir + MY_EXT
@@ -45,26 +53,28 @@ def add_package(session, pkg, pkgdir, file_table):
     license_file = license_path(pkgdir)
     license_file_tmp = license_file + '.new'
 
-    def emit_license(out, session, package, version, relpath, pkgdir):
-        """ Retrieve license of the file. We use `relpath` as we want the path
-            inside the package directory which is used in the d/copyright files
-            paragraphs
-        """
-        # join path for debian/copyright file as we are already in the sources
-        # directory.
-        synopsis = helper.get_license(session, package, version, relpath,
-                                      os.path.join(pkgdir, 'debian/copyright'))
-        if synopsis is not None:
-            s = '%s\t%s\n' % (synopsis, relpath.decode('utf-8'))
-            out.write(s)
-
     if 'hooks.fs' in conf['backends']:
         if not os.path.exists(license_file):  # run license only if needed
+            # parse debian/copyright once, and classify all files against it
+            try:
+                matcher = helper.FilesMatcher(helper.parse_license(
+                    os.path.join(pkgdir, 'debian/copyright')))
+            except copyright.NotMachineReadableError:
+                matcher = None
             with io.open(license_file_tmp, 'w', encoding='utf-8') as out:
-                for (relpath, abspath) in \
-                        fs_storage.walk_pkg_files(pkgdir, file_table):
-                    emit_license(out, session, pkg['package'], pkg['version'],
-                                 relpath, pkgdir)
+                if matcher is not None:
+                    # We use `relpath` as we want the path inside the package
+                    # directory which is used in the d/copyright files
+                    # paragraphs
+                    relpaths = (relpath for (relpath, _abspath) in
+                                fs_storage.walk_pkg_files(pkgdir, file_table))
+                    for (relpath, paragraph) in matcher.classify(relpaths):
+                        synopsis = helper.get_paragraph_license(
+                            paragraph, pkg['package'], pkg['version'],
+                            relpath)
+                        if synopsis is not None:
+                            out.write('%s\t%s\n'
+                                      % (synopsis, relpath.decode('utf-8')))
             os.rename(license_file_tmp, license_file)
 
     if 'hooks.db' in conf['backends']:
@@ -76,25 +86,22 @@ def add_package(session, pkg, pkgdir, file_table):
             # ASSUMPTION: if *a* license of this package has already been
             # added to the db in the past, then *all* of them have, as
             # additions are part of the same transaction
-            for (synopsis, path) in licenses:
-                if file_table:
-                    try:
-                        file_id = file_table[path]
-                    except KeyError:
-                        continue
-                else:
-                    file_ = session.query(File) \
-                                   .filter_by(package_id=db_package.id,
-                                              path=path) \
-                                   .first()
-                    if not file_:
-                        continue
-                    file_id = file_.id
-                license = FileCopyright(file_id, 'debian', synopsis)
-                session.add(license)
-
-
-def rm_package(session, pkg, pkgdir, file_table):
+            if not file_table:
+                file_table = dict(session.query(File.path, File.id)
+                                  .filter_by(package_id=db_package.id))
+            rows = [(file_table[path], 'debian', license)
+                    for (license, path) in licenses if path in file_table]
+            inserter = db_storage.bulk_inserter(session)
+            inserter.insert(FileCopyright.__table__, COPYRIGHT_COLUMNS, rows)
+            # per-license summary, see `models.PackageLicense`
+            counts = collections.Counter(license for (_id, _oracle, license)
+                                         in rows)
+            inserter.insert(PackageLicense.__table__, PACKAGE_LICENSES_COLUMNS,
+                            ((db_package.id, license, files)
+                             for (license, files) in six.iteritems(counts)))
+
+
+def rm_package(session, pkg, pkgdir, file_table, package_id):
     global conf
     logging.debug('rm-package %s' % pkg)
 
@@ -103,15 +110,16 @@ def rm_package(session, pkg, pkgdir, file_table):
         if os.path.exists(licensefile):
             os.unlink(licensefile)
 
-    if 'hooks.db' in conf['backends']:
-        db_package = db_storage.lookup_package(session, pkg['package'],
-                                               pkg['version'])
-        files = (session.query(FileCopyright.id)
-                 .join(File)
-                 .filter(File.package_id == db_package.id)).all()
-        for f in files:
-            session.query(FileCopyright) \
-                   .filter(FileCopyright.id == f).delete()
+    if 'hooks.db' in conf['backends'] and package_id is not None:
+        files_q = session.query(File.id) \
+                         .filter_by(package_id=package_id) \
+                         .subquery()
+        session.query(FileCopyright) \
+               .filter(FileCopyright.file_id.in_(files_q)) \
+               .delete(synchronize_session=False)
+        session.query(PackageLicense) \
+               .filter_by(package_id=package_id) \
+               .delete(synchronize_session=False)
 
 
 def init_plugin(debsources):
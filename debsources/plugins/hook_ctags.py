@@ -15,8 +15,6 @@ import logging
 import os
 import subprocess
 
-from sqlalchemy import sql
-
 from debsources import db_storage
 
 from debsources.models import Ctag, File
@@ -39,51 +37,43 @@ MY_EXT = '.' + MY_NAME
 def ctags_path(pkgdir):
     return pkgdir + MY_EXT
 
-# maximum number of ctags after which a (bulk) insert is sent to the DB
-BULK_FLUSH_THRESHOLD = 20000
+CTAGS_COLUMNS = ('package_id', 'tag', 'file_id', 'line', 'kind', 'language')
 
 # maximum number of detailed warnings for malformed tags that will be emitted.
 # used to avoid flooding logs
 BAD_TAGS_THRESHOLD = 5
 
 
-def parse_ctags(path):
+def iter_ctags(path):
     """parse exuberant ctags tags file
 
-    for each tag yield a tag dictionary::
-
-      { 'tag':  'TAG_NAME',
-        'path': 'PATH/WITH/IN/PACKAGE',
-        'line': LINE_NUMBER, # int
-        'kind': 'TAG_KIND', # 1 letter
-        'language': 'TAG_LANGUAGE',
-      }
+    for each tag yield a tuple <tag, path, line, kind, language>, where `path`
+    is relative to the package directory and `line` is an int; `kind` and
+    `language` might be None
     """
     def parse_tag(line):
-        tag = {'kind': None, 'line': None, 'language': None}
-        # initialize with extension fields which are not guaranteed to exist
-
         fields = line.rstrip().split('\t')
         # will fail when encountering encoding
         # issues; that is intended
-        tag['tag'] = fields[0].decode()
-        tag['path'] = fields[1]
+        tag = fields[0].decode()
         # note: ignore fields[2], ex_cmd
 
+        # initialize with extension fields which are not guaranteed to exist
+        kind = lineno = language = None
         for ext in fields[3:]:  # parse extension fields
             k, v = ext.split(':', 1)  # caution: "typeref:struct:__RAW_R_INFO"
             if k == 'kind':
-                tag['kind'] = v
+                kind = v
             elif k == 'line':
-                tag['line'] = int(v)
+                lineno = int(v)
             elif k == 'language':
-                tag['language'] = v.lower()
+                language = v.lower()
             else:
                 pass  # ignore other fields
 
-        assert tag['line'] is not None
-        assert len(tag['tag']) <= MAX_KEY_LENGTH
-        return tag
+        assert lineno is not None
+        assert len(tag) <= MAX_KEY_LENGTH
+        return (tag, fields[1], lineno, kind, language)
 
     with open(path) as ctags:
         bad_tags = 0
@@ -93,16 +83,51 @@ def parse_ctags(path):
             if line.startswith('!_TAG'):  # skip ctags metadata
                 continue
             try:
-                yield parse_tag(line)
+                tag = parse_tag(line)
             except:
                 bad_tags += 1
                 if bad_tags <= BAD_TAGS_THRESHOLD:
                     logging.warn('ignore malformed tag "%s"' % line.rstrip())
+                continue
+            yield tag
         if bad_tags > BAD_TAGS_THRESHOLD:
             logging.warn('%d extra malformed tag(s) ignored' %
                          (bad_tags - BAD_TAGS_THRESHOLD))
 
 
+def parse_ctags(path):
+    """parse exuberant ctags tags file
+
+    for each tag yield a tag dictionary::
+
+      { 'tag':  'TAG_NAME',
+        'path': 'PATH/WITH/IN/PACKAGE',
+        'line': LINE_NUMBER, # int
+        'kind': 'TAG_KIND', # 1 letter
+        'language': 'TAG_LANGUAGE',
+      }
+    """
+    for (tag, path, line, kind, language) in iter_ctags(path):
+        yield {'tag': tag, 'path': path, 'line': line, 'kind': kind,
+               'language': language}
+
+
+def ctags_rows(package_id, ctagsfile, file_table):
+    """iterate over rows of the ctags table for the tags in `ctagsfile`, as
+    tuples <package_id, tag, file_id, line, kind, language>
+
+    tags referring to files not in `file_table` (mapping relative paths to
+    file IDs) are skipped
+
+    """
+    for (tag, relpath, line, kind, language) in iter_ctags(ctagsfile):
+        try:
+            file_id = file_table[relpath]
+        except KeyError:
+            continue
+        yield (package_id, tag, file_id, line, kind, language)
+
+
 def add_package(session, pkg, pkgdir, file_table):
     global conf
     logging.debug('add-package %s' % pkg)
@@ -123,51 +148,20 @@ def add_package(session, pkg, pkgdir, file_table):
     if 'hooks.db' in conf['backends']:
         db_package = db_storage.lookup_package(session, pkg['package'],
                                                pkg['version'])
-        # poor man's cache for last <relpath, file_id>;
-        # rely on the fact that ctags file are path-sorted
-        curfile = {None: None}
-        insert_q = sql.insert(Ctag.__table__)
-        insert_params = []
         if not session.query(Ctag).filter_by(package_id=db_package.id).first():
             # ASSUMPTION: if *a* ctag of this package has already been added to
             # the db in the past, then *all* of them have, as additions are
             # part of the same transaction
-            for tag in parse_ctags(ctagsfile):
-                params = ({'package_id': db_package.id,
-                           'tag': tag['tag'],
-                           # 'file_id': 	# will be filled below
-                           'line': tag['line'],
-                           'kind': tag['kind'],
-                           'language': tag['language']})
-                relpath = tag['path']
-                if file_table:
-                    try:
-                        params['file_id'] = file_table[relpath]
-                    except KeyError:
-                        continue
-                else:
-                    try:
-                        params['file_id'] = curfile[relpath]
-                    except KeyError:
-                        file_ = session.query(File) \
-                                       .filter_by(package_id=db_package.id,
-                                                  path=relpath) \
-                                       .first()
-                        if not file_:
-                            continue
-                        curfile = {relpath: file_.id}
-                        params['file_id'] = file_.id
-                insert_params.append(params)
-                if len(insert_params) >= BULK_FLUSH_THRESHOLD:
-                    session.execute(insert_q, insert_params)
-                    session.flush()
-                    insert_params = []
-            if insert_params:  # might be empty if there are no ctags at all!
-                session.execute(insert_q, insert_params)
-                session.flush()
-
-
-def rm_package(session, pkg, pkgdir, file_table):
+            if not file_table:
+                file_table = dict(session.query(File.path, File.id)
+                                  .filter_by(package_id=db_package.id))
+            count = db_storage.bulk_inserter(session).insert(
+                Ctag.__table__, CTAGS_COLUMNS,
+                ctags_rows(db_package.id, ctagsfile, file_table))
+            db_storage.update_summary(session, db_package.id, ctags=count)
+
+
+def rm_package(session, pkg, pkgdir, file_table, package_id):
     global conf
     logging.debug('rm-package %s' % pkg)
 
@@ -176,12 +170,11 @@ def rm_package(session, pkg, pkgdir, file_table):
         if os.path.exists(ctagsfile):
             os.unlink(ctagsfile)
 
-    if 'hooks.db' in conf['backends']:
-        db_package = db_storage.lookup_package(session, pkg['package'],
-                                               pkg['version'])
+    if 'hooks.db' in conf['backends'] and package_id is not None:
         session.query(Ctag) \
-               .filter_by(package_id=db_package.id) \
-               .delete()
+               .filter_by(package_id=package_id) \
+               .delete(synchronize_session=False)
+        db_storage.update_summary(session, package_id, ctags=None)
 
 
 def init_plugin(debsources):
@@ -21,7 +21,7 @@ def add_package(session, pkg, pkgdir, file_table):
     logging.debug('add-package %s %s' % (pkg, pkgdir))
 
 
-def rm_package(session, pkg, pkgdir, file_table):
+def rm_package(session, pkg, pkgdir, file_table, package_id):
     global conf
     logging.debug('rm-package %s %s' % (pkg, pkgdir))
 
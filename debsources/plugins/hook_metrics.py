@@ -11,12 +11,17 @@
 
 from __future__ import absolute_import
 
+import itertools
 import logging
 import os
-import subprocess
+import stat
+
+import six
 
 from debsources import db_storage
+from debsources import fs_storage
 
+from debsources.consts import METRIC_TYPES
 from debsources.models import Metric
 
 
@@ -25,6 +30,8 @@ conf = None
 MY_NAME = 'metrics'
 MY_EXT = '.stats'
 
+METRICS_COLUMNS = ('package_id', 'metric', 'value_')
+
 
 def metricsfile_path(pkgdir):
     return pkgdir + MY_EXT
@@ -39,43 +46,81 @@ def parse_metrics(path):
     return metrics
 
 
+def disk_usage(pkgdir, file_table=None):
+    """compute the metrics of package directory `pkgdir`, reusing the package
+    scan in `file_table` (see `fs_storage.FileTable`), if available
+
+    return a dictionary of metrics, see `consts.METRIC_TYPES`. The 'size'
+    metric follows the semantics of `du --summarize`: blocks of all files,
+    symlinks and directories (pkgdir included) are counted, hard-linked
+    files only once, and the result is in KiB, rounded up
+
+    """
+    if getattr(file_table, 'files', None) is None:
+        file_table = fs_storage.scan_pkg_files(pkgdir)
+    blocks = os.lstat(pkgdir).st_blocks
+    apparent_size = 0
+    largest_file = 0
+    seen = set()  # inodes of hard-linked files, to count them only once
+    for f in six.itervalues(file_table.files):
+        if f.nlink > 1:
+            if f.inode in seen:
+                continue
+            seen.add(f.inode)
+        blocks += f.blocks
+        apparent_size += f.size
+        if stat.S_ISREG(f.mode):
+            largest_file = max(largest_file, f.size)
+    for d in itertools.chain(file_table.dirs, file_table.dir_links):
+        blocks += d.blocks
+    return {
+        'size': (blocks * 512 + 1023) // 1024,
+        'apparent_size': apparent_size,
+        'file_count': len(file_table.files),
+        'dir_count': len(file_table.dirs),
+        'largest_file': largest_file,
+    }
+
+
 def add_package(session, pkg, pkgdir, file_table):
     global conf
     logging.debug('add-package %s' % pkg)
 
-    metric_type = 'size'
-    metric_value = None
+    metrics = None
     metricsfile = metricsfile_path(pkgdir)
     metricsfile_tmp = metricsfile + '.new'
 
     if 'hooks.fs' in conf['backends']:
-        if not os.path.exists(metricsfile):  # run du only if needed
-            cmd = ['du', '--summarize', pkgdir]
-            metric_value = int(subprocess.check_output(cmd).split()[0])
+        if not os.path.exists(metricsfile):  # compute metrics only if needed
+            metrics = disk_usage(pkgdir, file_table)
             with open(metricsfile_tmp, 'w') as out:
-                out.write('%s\t%d\n' % (metric_type, metric_value))
+                for metric_type in METRIC_TYPES:
+                    out.write('%s\t%d\n' % (metric_type, metrics[metric_type]))
             os.rename(metricsfile_tmp, metricsfile)
 
     if 'hooks.db' in conf['backends']:
-        if metric_value is None:
-            # hooks.db is enabled but hooks.fs is not, so we don't have a
-            # metric_value handy. Parse it from metrics file, hoping it exists
+        if metrics is None:
+            # hooks.db is enabled but hooks.fs is not, so we don't have
+            # metrics handy. Parse them from metrics file, hoping it exists
             # from previous runs...
-            metric_value = parse_metrics(metricsfile)[metric_type]
+            metrics = parse_metrics(metricsfile)
 
         db_package = db_storage.lookup_package(session, pkg['package'],
                                                pkg['version'])
-        metric = session.query(Metric) \
-                        .filter_by(package_id=db_package.id,
-                                   metric=metric_type,
-                                   value=metric_value) \
-                        .first()
-        if not metric:
-            metric = Metric(db_package, metric_type, metric_value)
-            session.add(metric)
-
-
-def rm_package(session, pkg, pkgdir, file_table):
+        known = set(metric_type for (metric_type,)
+                    in session.query(Metric.metric)
+                              .filter_by(package_id=db_package.id))
+        db_storage.bulk_inserter(session).insert(
+            Metric.__table__, METRICS_COLUMNS,
+            ((db_package.id, metric_type, metrics[metric_type])
+             for metric_type in METRIC_TYPES
+             if metric_type in metrics and metric_type not in known))
+        if 'size' in metrics:
+            db_storage.update_summary(session, db_package.id,
+                                      size=metrics['size'])
+
+
+def rm_package(session, pkg, pkgdir, file_table, package_id):
     global conf
     logging.debug('rm-package %s' % pkg)
 
@@ -84,12 +129,11 @@ def rm_package(session, pkg, pkgdir, file_table):
         if os.path.exists(metricsfile):
             os.unlink(metricsfile)
 
-    if 'hooks.db' in conf['backends']:
-        db_package = db_storage.lookup_package(session, pkg['package'],
-                                               pkg['version'])
+    if 'hooks.db' in conf['backends'] and package_id is not None:
         session.query(Metric) \
-               .filter_by(package_id=db_package.id) \
-               .delete()
+               .filter_by(package_id=package_id) \
+               .delete(synchronize_session=False)
+        db_storage.update_summary(session, package_id, size=None)
 
 
 def init_plugin(debsources):
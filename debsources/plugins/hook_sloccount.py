@@ -26,6 +26,8 @@ conf = None
 
 SLOCCOUNT_FLAGS = ['--addlangall']
 
+SLOCCOUNT_COLUMNS = ('package_id', 'language', 'count')
+
 MY_NAME = 'sloccount'
 MY_EXT = '.' + MY_NAME
 
@@ -101,12 +103,13 @@ def add_package(session, pkg, pkgdir, file_table):
             # ASSUMPTION: if *a* loc count of this package has already been
             # added to the db in the past, then *all* of them have, as
             # additions are part of the same transaction
-            for (lang, locs) in six.iteritems(slocs):
-                sloccount = SlocCount(db_package, lang, locs)
-                session.add(sloccount)
+            db_storage.bulk_inserter(session).insert(
+                SlocCount.__table__, SLOCCOUNT_COLUMNS,
+                ((db_package.id, lang, locs)
+                 for (lang, locs) in six.iteritems(slocs)))
 
 
-def rm_package(session, pkg, pkgdir, file_table):
+def rm_package(session, pkg, pkgdir, file_table, package_id):
     global conf
     logging.debug('rm-package %s' % pkg)
 
@@ -115,12 +118,10 @@ def rm_package(session, pkg, pkgdir, file_table):
         if os.path.exists(slocfile):
             os.unlink(slocfile)
 
-    if 'hooks.db' in conf['backends']:
-        db_package = db_storage.lookup_package(session, pkg['package'],
-                                               pkg['version'])
+    if 'hooks.db' in conf['backends'] and package_id is not None:
         session.query(SlocCount) \
-               .filter_by(package_id=db_package.id) \
-               .delete()
+               .filter_by(package_id=package_id) \
+               .delete(synchronize_session=False)
 
 
 def init_plugin(debsources):
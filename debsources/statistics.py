@@ -13,7 +13,7 @@
 
 """
 
-from __future__ import absolute_import
+from __future__ import absolute_import, division
 
 import logging
 import os
@@ -21,13 +21,13 @@ import re
 
 import six
 
-from sqlalchemy import distinct
+from sqlalchemy import distinct, literal, select, union_all
 from sqlalchemy import func as sql_func
 
 from debsources.consts import SLOCCOUNT_LANGUAGES, SUITES
-from debsources.models import Checksum, Ctag, Metric, SlocCount, \
-    Suite, SuiteInfo, Package, PackageName, FileCopyright, File
-from debsources.license_helper import Licenses
+from debsources.models import File, SlocCount, Suite, SuiteInfo, Package, \
+    PackageName, PackageSummary, PackageLicense
+from debsources.license_helper import LICENSES_CACHE_SIZE, match_license
 
 
 def _count(query):
@@ -84,8 +84,7 @@ def disk_usage(session, suite=None, areas=None):
 
     """
     logging.debug('compute disk usage for suite %s...' % suite)
-    q = session.query(sql_func.sum(Metric.value)) \
-               .filter(Metric.metric == 'size')
+    q = session.query(sql_func.sum(PackageSummary.size))
     if suite or areas:
         q = q.join(Package)
     if suite:
@@ -129,10 +128,8 @@ def source_files(session, suite=None, areas=None):
     Return 0 if the checksum plugin is not enabled
 
     """
-    # TODO when a separate File table will be present, this will need to be
-    # adapted to use that instead of Checksum
     logging.debug('count source files for suite %s...' % suite)
-    q = session.query(sql_func.count(Checksum.id))
+    q = session.query(sql_func.sum(PackageSummary.source_files))
     if suite or areas:
         q = q.join(Package)
     if suite:
@@ -196,7 +193,7 @@ def ctags(session, suite=None, areas=None):
 
     """
     logging.debug('count ctags for suite %s...' % suite)
-    q = session.query(sql_func.count(Ctag.id))
+    q = session.query(sql_func.sum(PackageSummary.ctags))
     if suite or areas:
         q = q.join(Package)
     if suite:
@@ -365,26 +362,15 @@ def stats_grouped_by(session, stat, areas=None):
              .join(Package)
              .group_by(Suite.suite)
              )
-    elif stat is 'source_files':
+    elif stat in ('source_files', 'disk_usage', 'ctags'):
+        column = {'source_files': PackageSummary.source_files,
+                  'disk_usage': PackageSummary.size,
+                  'ctags': PackageSummary.ctags}[stat]
         q = (session.query(Suite.suite.label("suite"),
-                           sql_func.count(Checksum.id))
+                           sql_func.coalesce(sql_func.sum(column), 0))
+             .select_from(Suite)
              .join(Package)
-             .join(Checksum)
-             .group_by(Suite.suite)
-             )
-    elif stat is 'disk_usage':
-        q = (session.query(Suite.suite.label("suite"),
-                           sql_func.sum(Metric.value))
-             .filter(Metric.metric == 'size')
-             .join(Package)
-             .join(Metric)
-             .group_by(Suite.suite)
-             )
-    elif stat is 'ctags':
-        q = (session.query(Suite.suite.label('suite'),
-                           sql_func.count(Ctag.id))
-             .join(Package)
-             .join(Ctag)
+             .join(PackageSummary)
              .group_by(Suite.suite)
              )
     elif stat is 'sloccount':
@@ -403,6 +389,90 @@ def stats_grouped_by(session, stat, areas=None):
     return q.all()
 
 
+# size statistics computed by `suites_stats`, on top of per-language sloccount
+SIZE_STATS = ['disk_usage', 'source_packages', 'source_files', 'ctags']
+
+
+def _suites_membership(suites=None):
+    """return a <package_id, suite> selectable mapping packages to the suites
+    they belong to (only those in `suites`, if given), plus each package to
+    the 'ALL' pseudo-suite
+
+    grouping on it yields both per-suite and overall statistics, without
+    counting overall twice packages shared among suites (which GROUPING SETS
+    would do)
+
+    """
+    by_suite = select([Suite.package_id.label('package_id'),
+                       Suite.suite.label('suite')])
+    if suites is not None:
+        by_suite = by_suite.where(Suite.suite.in_(suites))
+    overall = select([Package.id.label('package_id'),
+                      literal('ALL').label('suite')])
+    return union_all(by_suite, overall).alias('membership')
+
+
+def suites_stats(session, suites=None, areas=None):
+    """compute all size and sloccount statistics, for all suites and overall,
+    in one pass over the (per-package) tables they come from
+
+    return a dictionary mapping suite names, plus 'ALL' for overall totals, to
+    dictionaries of statistics: one entry per `SIZE_STATS` element, plus a
+    'sloccount' entry mapping languages to SLOC counts. Packages belonging to
+    several suites are counted once in overall totals
+
+    only consider suites in `suites`, if given; they are all returned, with
+    zero-valued statistics if missing from the DB
+
+    only consider packages in archive `areas`, if given
+
+    """
+    logging.debug('compute size and sloccount stats for all suites')
+    membership = _suites_membership(suites)
+
+    stats = {}
+
+    def suite_stats(suite):
+        if suite not in stats:
+            stats[suite] = dict((stat, 0) for stat in SIZE_STATS)
+            stats[suite]['sloccount'] = {}
+        return stats[suite]
+
+    for suite in list(suites or []) + ['ALL']:
+        suite_stats(suite)
+
+    q = (session.query(membership.c.suite,
+                       sql_func.count(Package.id),
+                       sql_func.sum(PackageSummary.size),
+                       sql_func.sum(PackageSummary.source_files),
+                       sql_func.sum(PackageSummary.ctags))
+         .select_from(membership)
+         .join(Package, Package.id == membership.c.package_id)
+         .outerjoin(PackageSummary, PackageSummary.package_id == Package.id)
+         .group_by(membership.c.suite))
+    if areas:
+        q = q.filter(Package.area.in_(areas))
+    for (suite, packages, size, files, ctags) in q:
+        d = suite_stats(suite)
+        d['source_packages'] = packages
+        d['disk_usage'] = size or 0
+        d['source_files'] = files or 0
+        d['ctags'] = ctags or 0
+
+    q = (session.query(membership.c.suite, SlocCount.language,
+                       sql_func.sum(SlocCount.count))
+         .select_from(membership)
+         .join(SlocCount, SlocCount.package_id == membership.c.package_id)
+         .group_by(membership.c.suite, SlocCount.language))
+    if areas:
+        q = q.join(Package, Package.id == SlocCount.package_id) \
+             .filter(Package.area.in_(areas))
+    for (suite, language, slocs) in q:
+        suite_stats(suite)['sloccount'][language] = slocs
+
+    return stats
+
+
 def load_metadata_cache(fname):
     """load a `stats.data` file and return its content as an integer-valued
     dictionary
@@ -433,27 +503,84 @@ def get_licenses(session, suite=None):
     """
     logging.debug('grouped by license summary')
     if not suite:
-        q = (session.query(FileCopyright.license, Suite.suite,
-                           sql_func.count(FileCopyright.id))
-             .join(File)
+        q = (session.query(PackageLicense.license, Suite.suite,
+                           sql_func.sum(PackageLicense.files))
+             .select_from(PackageLicense)
              .join(Package)
              .join(Suite)
              .group_by(Suite.suite)
-             .group_by(FileCopyright.license)
+             .group_by(PackageLicense.license)
              .order_by(Suite.suite))
         return q.all()
     else:
-        q = (session.query(FileCopyright.license,
-                           sql_func.count(FileCopyright.id))
-             .join(File)
-             .join(Package))
+        q = session.query(PackageLicense.license,
+                          sql_func.sum(PackageLicense.files))
         if suite != 'ALL':
-            q = q.join(Suite) \
+            q = q.join(Package) \
+                 .join(Suite) \
                  .filter(Suite.suite == suite)
-        q = q.group_by(FileCopyright.license)
+        q = q.group_by(PackageLicense.license)
         return dict(q.all())
 
 
+def license_stats(session):
+    """compute license statistics of all suites and overall, at once
+
+    return a dictionary mapping suite names, plus 'ALL' for overall totals, to
+    dictionaries with keys: 'files' (file count), 'licensed_files' (count of
+    files with license information), and 'licenses' (a dictionary mapping
+    license synopses to file counts, as returned by `get_licenses`)
+
+    """
+    logging.debug('compute license stats for all suites')
+    membership = _suites_membership()
+    stats = {}
+
+    def suite_stats(suite):
+        if suite not in stats:
+            stats[suite] = {'files': 0, 'licensed_files': 0, 'licenses': {}}
+        return stats[suite]
+
+    suite_stats('ALL')
+
+    # count files per package first, so that files are not joined with (the
+    # many) package memberships
+    files = (session.query(File.package_id.label('package_id'),
+                           sql_func.count(File.id).label('files'))
+             .group_by(File.package_id)
+             .subquery())
+    q = (session.query(membership.c.suite, sql_func.sum(files.c.files))
+         .select_from(membership)
+         .join(files, files.c.package_id == membership.c.package_id)
+         .group_by(membership.c.suite))
+    for (suite, count) in q:
+        suite_stats(suite)['files'] = count
+
+    q = (session.query(membership.c.suite, PackageLicense.license,
+                       sql_func.sum(PackageLicense.files))
+         .select_from(membership)
+         .join(PackageLicense,
+               PackageLicense.package_id == membership.c.package_id)
+         .group_by(membership.c.suite, PackageLicense.license))
+    for (suite, license, count) in q:
+        d = suite_stats(suite)
+        d['licenses'][license] = count
+        d['licensed_files'] += count
+
+    return stats
+
+
+def license_ratio(suite_license_stats):
+    """percentage of files without license information, given the license
+    statistics of a suite (see `license_stats`); like `query.get_ratio`
+
+    """
+    files = suite_license_stats['files']
+    if not files:
+        return 0
+    return int((1 - suite_license_stats['licensed_files'] / files) * 100)
+
+
 def _hist_copyright_sample(session, interval, projection, suite=None):
     q = "\
       SELECT * \
@@ -514,72 +641,93 @@ def history_copyright_monthly(session, interval, suite):
                                   suite=suite)
 
 
+# summary keys of license synopses, see _license_keys
+_license_keys_cache = {}
+# canonical keys of dual license synopses, see _dual_license_key
+_dual_keys_cache = {}
+
+
+def _is_dual(synopsis):
+    return any(keyword in synopsis for keyword in ['and', 'or'])
+
+
+def _license_keys(synopsis):
+    """return the keys of `licenses_summary` that files licensed under
+    `synopsis` count towards: one per license in `synopsis`, 'unknown' for
+    non-standard ones
+
+    """
+    try:
+        return _license_keys_cache[synopsis]
+    except KeyError:
+        pass
+    if _is_dual(synopsis):
+        licenses = [lic.rstrip()
+                    for lic in re.split(', |and |or ', synopsis)]
+    else:
+        licenses = [synopsis]
+    keys = tuple(lic.replace(' ', '_') if match_license(lic) else 'unknown'
+                 for lic in licenses)
+    if len(_license_keys_cache) >= LICENSES_CACHE_SIZE:
+        _license_keys_cache.clear()
+    _license_keys_cache[synopsis] = keys
+    return keys
+
+
+def _dual_license_key(synopsis):
+    """return the canonical key of `synopsis` for `licenses_summary_w_dual`,
+    or None if it is not made of standard licenses only
+
+    the canonical key of a dual license does not depend on the order in which
+    licenses are listed, so that e.g. "GPL-2+ or Artistic" and "Artistic or
+    GPL-2+" share it
+
+    """
+    try:
+        return _dual_keys_cache[synopsis]
+    except KeyError:
+        pass
+    key = None
+    if _is_dual(synopsis):
+        licenses = re.split(', |and |or ', synopsis)
+        if all(match_license(lic) for lic in licenses):
+            key = frozenset(synopsis.split())
+    elif match_license(synopsis):
+        key = synopsis
+    if len(_dual_keys_cache) >= LICENSES_CACHE_SIZE:
+        _dual_keys_cache.clear()
+    _dual_keys_cache[synopsis] = key
+    return key
+
+
 def licenses_summary_w_dual(results):
+    """summarize `results` (a dictionary mapping license synopses to file
+    counts) as file counts per standard license, keeping dual licenses as
+    such. Non-standard licenses count as 'unknown'
+
+    """
     summary = dict(unknown=0)
-    for result in results:
-        if any(keyword in result for keyword in ['and', 'or']):
-            # verify all are standard
-            licenses = re.split(', |and |or ', result)
-            unknown = True  # verify all licenses in statement are standard
-            for l in licenses:
-                key = filter(lambda x: re.search(x, l) is not None,
-                             Licenses)
-                if not key:
-                    unknown = False
-            if not unknown:
-                summary['unknown'] += results[result]
-            else:
-                # search if result exists in dict but in different order
-                found = None
-                for key in summary.keys():
-                    # replace spaces with _ as one loading the stats file
-                    # later we don't break it correctly.
-                    if set(result.split('_')) == set(key.split(' ')):
-                        # key exists
-                        found = key
-                        break
-                if found is not None:
-                    summary[found] += results[result]
-                else:
-                    summary[result.replace(' ', '_')] = results[result]
-        else:
-            key = filter(lambda x: re.search(x, result)
-                         is not None, Licenses)
-            # standard licenses
-            if len(key) > 0:
-                summary[result.replace(' ', '_')] = results[result]
-            else:
-                summary['unknown'] += results[result]
+    names = {}  # canonical key -> summary key
+    for result in sorted(results):
+        key = _dual_license_key(result)
+        if key is None:
+            summary['unknown'] += results[result]
+            continue
+        if key not in names:
+            names[key] = result.replace(' ', '_')
+        name = names[key]
+        summary[name] = summary.get(name, 0) + results[result]
     return summary
 
 
 def licenses_summary(results):
+    """summarize `results` (a dictionary mapping license synopses to file
+    counts) as file counts per standard license, splitting dual licenses.
+    Non-standard licenses count as 'unknown'
+
+    """
     summary = dict(unknown=0)
-    for result in results:
-        if any(keyword in result for keyword in ['and', 'or']):
-            # split all licenses
-            licenses = re.split(', |and |or ', result)
-            for license in licenses:
-                license = license.rstrip()
-                key = filter(lambda x: re.search(x, license)
-                             is not None, Licenses)
-                if len(key) > 0:
-                    # if license already in dict then add it up
-                    if license.replace(' ', '_') in summary.keys():
-                        summary[license.replace(' ', '_')] += results[result]
-                    else:
-                        summary[license.replace(' ', '_')] = results[result]
-                else:
-                    summary['unknown'] += results[result]
-        else:
-            key = filter(lambda x: re.search(x, result)
-                         is not None, Licenses)
-            if len(key) > 0:
-                    # if license already in dict then add it up
-                    if result.replace(' ', '_') in summary.keys():
-                        summary[result.replace(' ', '_')] += results[result]
-                    else:
-                        summary[result.replace(' ', '_')] = results[result]
-            else:
-                summary['unknown'] += results[result]
+    for (result, count) in six.iteritems(results):
+        for key in _license_keys(result):
+            summary[key] = summary.get(key, 0) + count
     return summary
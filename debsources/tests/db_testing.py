@@ -17,12 +17,25 @@ import sqlalchemy.orm
 import subprocess
 
 
+from debsources.consts import METRIC_TYPES
+from debsources.debmirror import SourcePackage
+from debsources.models import DB_SCHEMA_VERSION, Metric, Package
+from debsources.plugins import hook_metrics
 from debsources.subprocess_workaround import subprocess_setup
 from debsources.tests.testdata import *  # NOQA
+from debsources.tests.testdata import TEST_DATA_DIR
 
 
 TEST_DB_DUMP = os.path.join(TEST_DATA_DIR, 'db/pg-dump-custom')
 
+# schema version of TEST_DB_DUMP. Restored DBs are upgraded to
+# DB_SCHEMA_VERSION using the scripts under debsources/migrate/; bump it when
+# the dump is regenerated (see doc/testing.txt)
+TEST_DB_SCHEMA_VERSION = 11
+
+MIGRATE_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                           'migrate')
+
 # queries to compare two DB schemas (e.g. "public.*" and "ref.*")
 DB_COMPARE_QUERIES = {
     "package_names":
@@ -115,6 +128,41 @@ def pg_restore(dbname, dumpfile):
                           preexec_fn=subprocess_setup)
 
 
+def pg_migrate(dbname, from_version, to_version=DB_SCHEMA_VERSION):
+    """upgrade the schema of DB `dbname` from version `from_version` to
+    `to_version`, applying migration scripts in order
+
+    """
+    for version in range(from_version, to_version):
+        script = os.path.join(MIGRATE_DIR,
+                              '%03d-to-%03d.sql' % (version, version + 1))
+        subprocess.check_call(['psql', '--quiet', '--set', 'ON_ERROR_STOP=1',
+                               '--dbname', dbname, '--file', script],
+                              preexec_fn=subprocess_setup)
+
+
+def add_missing_metrics(session, sources_dir):
+    """add to the DB the metrics of packages extracted under `sources_dir`
+    which are missing from it, e.g. metrics introduced after the reference DB
+    dump was generated
+
+    """
+    for package in session.query(Package):
+        pkgdir = os.path.join(sources_dir, package.area,
+                              SourcePackage.pkg_prefix(package.name.name),
+                              package.name.name, package.version)
+        if not os.path.isdir(pkgdir):
+            continue
+        known = set(metric for (metric,) in
+                    session.query(Metric.metric)
+                           .filter_by(package_id=package.id))
+        metrics = hook_metrics.disk_usage(pkgdir)
+        for metric in METRIC_TYPES:
+            if metric not in known:
+                session.add(Metric(package, metric, metrics[metric]))
+    session.commit()
+
+
 def pg_dump(dbname, dumpfile):
     subprocess.check_call(['pg_dump', '--no-owner', '--no-privileges', '-Fc',
                            '-f', dumpfile, dbname],
@@ -149,8 +197,14 @@ def db_setup(test_subj, dbname=TEST_DB_NAME, dbdump=TEST_DB_DUMP, echo=False):
     test_subj.db = sqlalchemy.create_engine(
         'postgresql:///' + dbname, echo=echo)
     pg_restore(dbname, dbdump)
+    pg_migrate(dbname, TEST_DB_SCHEMA_VERSION)
     Session = sqlalchemy.orm.sessionmaker()
     test_subj.session = Session(bind=test_subj.db)
+    if TEST_DB_SCHEMA_VERSION < 12:
+        # metrics added by schema version 12 are missing from the reference
+        # DB: compute them from the reference sources
+        add_missing_metrics(test_subj.session,
+                            os.path.join(TEST_DATA_DIR, 'sources'))
 
 
 def db_teardown(test_subj):
@@ -0,0 +1,103 @@
+# Copyright (C) 2015  The Debsources developers <info@sources.debian.net>.
+# See the AUTHORS file at the top-level directory of this distribution and at
+# https://anonscm.debian.org/gitweb/?p=qa/debsources.git;a=blob;f=AUTHORS;hb=HEAD
+#
+# This file is part of Debsources. Debsources is free software: you can
+# redistribute it and/or modify it under the terms of the GNU Affero General
+# Public License as published by the Free Software Foundation, either version 3
+# of the License, or (at your option) any later version.  For more information
+# see the COPYING file at the top-level directory of this distribution and at
+# https://anonscm.debian.org/gitweb/?p=qa/debsources.git;a=blob;f=COPYING;hb=HEAD
+
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from nose.tools import istest
+from nose.plugins.attrib import attr
+
+from debsources import charts
+
+
+SLOC = {
+    'jessie': {'ansic': 100, 'python': 50, 'perl': 20},
+    'stretch': {'ansic': 120, 'python': 80, 'perl': 15},
+    'sid': {'ansic': 130, 'python': 90, 'perl': 10},
+}
+
+
+@attr('charts')
+class RenderCharts(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(suffix='.debsources-test')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def jobs(self, sloc):
+        """one sloccount pie chart per suite of `sloc`"""
+        return [('pie_chart', (sloc[suite],),
+                 {'fname': os.path.join(self.tmpdir,
+                                        '%s-sloc_pie.png' % suite)})
+                for suite in sorted(sloc)]
+
+    def chart_files(self):
+        return sorted(f for f in os.listdir(self.tmpdir)
+                      if f.endswith('.png'))
+
+    def age(self):
+        """backdate all rendered charts, to spot the ones rendered next"""
+        for chart in self.chart_files():
+            os.utime(os.path.join(self.tmpdir, chart), (0, 0))
+
+    def rendered(self):
+        """charts (re-)written since the last call to age()"""
+        return [chart for chart in self.chart_files()
+                if os.stat(os.path.join(self.tmpdir, chart)).st_mtime != 0]
+
+    def assertRenders(self, sloc, expected, workers=1):
+        self.age()
+        count = charts.render_charts(self.jobs(sloc), self.tmpdir,
+                                     workers=workers)
+        self.assertEqual(len(expected), count)
+        self.assertEqual(expected, self.rendered())
+
+    @istest
+    def skipsUnchangedCharts(self):
+        all_charts = ['jessie-sloc_pie.png', 'sid-sloc_pie.png',
+                      'stretch-sloc_pie.png']
+        self.assertRenders(SLOC, all_charts)
+        self.assertTrue(os.path.exists(os.path.join(self.tmpdir,
+                                                    charts.CHARTS_INDEX)))
+        self.assertRenders(SLOC, [])
+
+        sloc = dict(SLOC, sid=dict(SLOC['sid'], python=95))
+        self.assertRenders(sloc, ['sid-sloc_pie.png'])
+        self.assertRenders(sloc, [])
+
+    @istest
+    def skipsUnchangedChartsInParallel(self):
+        self.assertRenders(SLOC, ['jessie-sloc_pie.png', 'sid-sloc_pie.png',
+                                  'stretch-sloc_pie.png'], workers=2)
+        self.assertRenders(SLOC, [], workers=2)
+        sloc = dict(SLOC, jessie=dict(SLOC['jessie'], perl=25))
+        self.assertRenders(sloc, ['jessie-sloc_pie.png'], workers=2)
+
+    @istest
+    def rerendersMissingCharts(self):
+        self.assertEqual(3, charts.render_charts(self.jobs(SLOC),
+                                                 self.tmpdir))
+        os.unlink(os.path.join(self.tmpdir, 'stretch-sloc_pie.png'))
+        self.assertRenders(SLOC, ['stretch-sloc_pie.png'])
+
+    @istest
+    def keepsIndexOfUnrenderedCharts(self):
+        self.assertRenders(SLOC, ['jessie-sloc_pie.png', 'sid-sloc_pie.png',
+                                  'stretch-sloc_pie.png'])
+        # rendering a subset of the charts must not forget the others
+        self.assertRenders({'sid': SLOC['sid']}, [])
+        self.assertRenders(SLOC, [])
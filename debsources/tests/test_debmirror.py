@@ -0,0 +1,199 @@
+# Copyright (C) 2015  The Debsources developers <info@sources.debian.net>.
+# See the AUTHORS file at the top-level directory of this distribution and at
+# https://anonscm.debian.org/gitweb/?p=qa/debsources.git;a=blob;f=AUTHORS;hb=HEAD
+#
+# This file is part of Debsources. Debsources is free software: you can
+# redistribute it and/or modify it under the terms of the GNU Affero General
+# Public License as published by the Free Software Foundation, either version 3
+# of the License, or (at your option) any later version.  For more information
+# see the COPYING file at the top-level directory of this distribution and at
+# https://anonscm.debian.org/gitweb/?p=qa/debsources.git;a=blob;f=COPYING;hb=HEAD
+
+from __future__ import absolute_import
+
+import glob
+import gzip
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+from debian import deb822
+from nose.tools import istest
+from nose.plugins.attrib import attr
+from six.moves import cPickle as pickle
+
+from debsources import debmirror
+from debsources.tests.testdata import TEST_DATA_DIR
+
+
+SOURCES = """Package: foo
+Binary: foo
+Version: 1.0-1
+Maintainer: Jane Doe <jane@example.org>
+Format: 3.0 (quilt)
+Files:
+ 0123 100 foo_1.0-1.dsc
+ 4567 2000 foo_1.0.orig.tar.gz
+Checksums-Sha256:
+ abcd 100 foo_1.0-1.dsc
+ ef01 2000 foo_1.0.orig.tar.gz
+Vcs-Git: git://example.org/foo.git
+Vcs-Browser: http://example.org/foo
+Directory: pool/main/f/foo
+Section: utils
+
+Package: bar
+Version: 2:2.0
+Checksums-Sha256:
+ ef01 200 bar_2.0.orig.tar.gz
+ abcd 100 bar_2.0.dsc
+Directory: pool/non-free/b/bar
+Description: a multi-line field
+ Package: not-a-package
+ Files:
+  0000 1 not-a.dsc
+Files:
+ 4567 200 bar_2.0.orig.tar.gz
+ 0123 100 bar_2.0.dsc
+
+Package: libbaz
+Version: 0.1
+Directory: pool/contrib/libb/libbaz
+Section: contrib/libs
+Files:
+ 0123 1 libbaz_0.1.dsc
+"""
+
+
+def deb822_records(path):
+    """parse Sources file `path` as Debsources used to, with deb822, into
+    records comparable to those of `debmirror.parse_Sources`
+
+    """
+    with (gzip.open(path) if path.endswith('.gz') else open(path)) as f:
+        for pkg in deb822.Sources.iter_paragraphs(f):
+            files_field = [field for field in ['checksums-sha256', 'files']
+                           if field in pkg][0]
+            dsc = [entry['name'] for entry in pkg[files_field]
+                   if entry['name'].endswith('.dsc')][0]
+            vcs = tuple((k.lower(), v) for (k, v) in pkg.items()
+                        if k.lower().startswith('vcs-'))
+            yield (pkg['package'], pkg['version'], pkg.get('directory'),
+                   pkg.get('section'), dsc, vcs or None)
+
+
+@attr('mirror')
+class SourcesParsing(unittest.TestCase):
+    """ Unit tests for debsources.debmirror.parse_Sources """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(suffix='.debsources-test')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def assertParsedAsDeb822(self, path):
+        records = list(debmirror.parse_Sources(path))
+        self.assertTrue(records, path)
+        self.assertEqual(records, list(deb822_records(path)), path)
+
+    @istest
+    def parsesAsDeb822(self):
+        for (name, opener) in [('Sources', open), ('Sources.gz', gzip.open)]:
+            path = os.path.join(self.tmpdir, name)
+            with opener(path, 'wb') as f:
+                f.write(SOURCES)
+            self.assertParsedAsDeb822(path)
+
+    @istest
+    def parsesTestdataAsDeb822(self):
+        sources = glob.glob(os.path.join(TEST_DATA_DIR, 'mirror', 'dists',
+                                         '*', '*', 'source', 'Sources.gz'))
+        self.assertTrue(sources, 'no Sources files in test data')
+        for path in sources:
+            self.assertParsedAsDeb822(path)
+
+
+@attr('mirror')
+class SourcesCache(unittest.TestCase):
+    """ Unit tests for the Sources cache of debsources.debmirror.SourceMirror
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(suffix='.debsources-test')
+        self.mirror_dir = os.path.join(self.tmpdir, 'mirror')
+        self.cache_dir = os.path.join(self.tmpdir, 'cache')
+        self.suite_dir = os.path.join(self.mirror_dir, 'dists', 'sid')
+        src_dir = os.path.join(self.suite_dir, 'main', 'source')
+        os.makedirs(src_dir)
+        with gzip.open(os.path.join(src_dir, 'Sources.gz'), 'wb') as f:
+            f.write(SOURCES)
+        self.write_release(SOURCES)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write_release(self, sources):
+        """write a Release file for sid, with the checksum of `sources`"""
+        with open(os.path.join(self.suite_dir, 'Release'), 'w') as f:
+            f.write('Suite: unstable\nCodename: sid\nSHA256:\n %s %d %s\n'
+                    % (hashlib.sha256(sources).hexdigest(), len(sources),
+                       'main/source/Sources.gz'))
+
+    def ls(self):
+        mirror = debmirror.SourceMirror(self.mirror_dir,
+                                        cache_dir=self.cache_dir)
+        return sorted(str(pkg) for pkg in mirror.ls())
+
+    def tamper_cache(self):
+        """replace the records of all cache entries, keeping their
+        fingerprints, so that using the cache can be told apart
+
+        """
+        caches = glob.glob(os.path.join(self.cache_dir, '*.cache'))
+        self.assertEqual(len(caches), 1)
+        with open(caches[0], 'rb') as f:
+            (fingerprint, _records) = pickle.load(f)
+        with open(caches[0], 'wb') as f:
+            pickle.dump((fingerprint,
+                         [('cached', '1', 'pool/main/c/cached', 'main',
+                           'cached_1.dsc', None)]),
+                        f, pickle.HIGHEST_PROTOCOL)
+
+    PACKAGES = ['bar/2:2.0', 'foo/1.0-1', 'libbaz/0.1']
+
+    @istest
+    def reusesCacheOfUnchangedSources(self):
+        self.assertEqual(self.ls(), self.PACKAGES)
+        self.tamper_cache()
+        self.assertEqual(self.ls(), ['cached/1'])
+
+    @istest
+    def releaseChecksumInvalidatesCache(self):
+        self.assertEqual(self.ls(), self.PACKAGES)
+        self.tamper_cache()
+        self.write_release(SOURCES + '\n')
+        self.assertEqual(self.ls(), self.PACKAGES)
+
+    @istest
+    def cacheFormatInvalidatesCache(self):
+        self.assertEqual(self.ls(), self.PACKAGES)
+        self.tamper_cache()
+        cache_format = debmirror.SOURCES_CACHE_FORMAT
+        debmirror.SOURCES_CACHE_FORMAT += 1
+        try:
+            self.assertEqual(self.ls(), self.PACKAGES)
+        finally:
+            debmirror.SOURCES_CACHE_FORMAT = cache_format
+
+    @istest
+    def fingerprintsDoNotNeedListing(self):
+        fingerprints = debmirror.SourceMirror(self.mirror_dir).fingerprints
+        mirror = debmirror.SourceMirror(self.mirror_dir)
+        list(mirror.ls())
+        self.assertEqual(fingerprints, mirror.fingerprints)
+        self.write_release(SOURCES + '\n')
+        self.assertNotEqual(
+            fingerprints, debmirror.SourceMirror(self.mirror_dir).fingerprints)
@@ -17,7 +17,7 @@ import unittest
 from nose.tools import istest
 from nose.plugins.attrib import attr
 
-from debsources.hashutil import sha1sum, sha256sum
+from debsources.hashutil import sha1sum, sha256sum, digests, digests_many
 from debsources.tests.testdata import *  # NOQA
 
 
@@ -40,3 +40,15 @@ class HashutilTests(unittest.TestCase):
         self.assertEqual(
             sha256sum(make_path('main/libc/libcaca/0.99.beta18-1/COPYING')),
             'd10f0447c835a590ef137d99dd0e3ed29b5e032e7434a87315b30402bf14e7fd')
+
+    @istest
+    def assertMultipleDigests(self):
+        path = make_path('main/libc/libcaca/0.99.beta18-1/COPYING')
+        sums = digests(path, ['sha1', 'sha256'])
+        self.assertEqual(sums['sha1'],
+                         'b57075f60950289e0f32be3145b74b7b17e6e5c5')
+        self.assertEqual(
+            sums['sha256'],
+            'd10f0447c835a590ef137d99dd0e3ed29b5e032e7434a87315b30402bf14e7fd')
+        self.assertEqual(list(digests_many([path, path], ['sha1', 'sha256'])),
+                         [(path, sums), (path, sums)])
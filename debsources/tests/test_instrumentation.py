@@ -0,0 +1,68 @@
+# Copyright (C) 2015  The Debsources developers <info@sources.debian.net>.
+# See the AUTHORS file at the top-level directory of this distribution and at
+# https://anonscm.debian.org/gitweb/?p=qa/debsources.git;a=blob;f=AUTHORS;hb=HEAD
+#
+# This file is part of Debsources. Debsources is free software: you can
+# redistribute it and/or modify it under the terms of the GNU Affero General
+# Public License as published by the Free Software Foundation, either version 3
+# of the License, or (at your option) any later version.  For more information
+# see the COPYING file at the top-level directory of this distribution and at
+# https://anonscm.debian.org/gitweb/?p=qa/debsources.git;a=blob;f=COPYING;hb=HEAD
+
+from __future__ import absolute_import
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from nose.tools import istest
+from nose.plugins.attrib import attr
+
+from debsources.instrumentation import Instrumentation
+
+
+@attr('instrumentation')
+class InstrumentationTests(unittest.TestCase):
+    """ Unit tests for debsources.instrumentation """
+
+    @istest
+    def accumulatesNestedBytes(self):
+        timings = Instrumentation()
+        with timings.measure('stage', 'extract'):
+            for name in ['foo', 'bar']:
+                with timings.measure('package', name, 10) as pkg:
+                    with timings.measure('hook', 'checksums',
+                                         timings.current('package').bytes):
+                        pass
+                    pkg.bytes += 5
+        timings = timings.snapshot()
+        self.assertEqual(timings['stage']['extract']['bytes'], 30)
+        self.assertEqual(timings['package']['foo']['bytes'], 15)
+        self.assertEqual(timings['hook']['checksums']['bytes'], 20)
+        self.assertEqual(timings['hook']['checksums']['count'], 2)
+
+    @istest
+    def mergesAndReports(self):
+        timings = Instrumentation()
+        timings.record('hook', 'ctags', 2., 1., 100)
+        worker = Instrumentation()
+        worker.record('hook', 'ctags', 1., 1., 50)
+        worker.record('hook', 'sloccount', 4., 1., 50)
+        timings.merge(worker.snapshot())
+        self.assertEqual([name for (name, _t) in timings.slowest('hook')],
+                         ['sloccount', 'ctags'])
+        self.assertEqual(timings.slowest('hook', 1)[0][1].count, 1)
+
+        tmpdir = tempfile.mkdtemp(suffix='.debsources-test')
+        try:
+            report = os.path.join(tmpdir, 'timings.json')
+            timings.write_report(report)
+            with open(report) as f:
+                ctags = json.load(f)['timings']['hook']['ctags']
+            self.assertEqual(ctags['count'], 2)
+            self.assertEqual(ctags['wall'], 3.)
+            self.assertEqual(ctags['bytes'], 150)
+        finally:
+            shutil.rmtree(tmpdir)
@@ -0,0 +1,66 @@
+# Copyright (C) 2015  The Debsources developers <info@sources.debian.net>.
+# See the AUTHORS file at the top-level directory of this distribution and at
+# https://anonscm.debian.org/gitweb/?p=qa/debsources.git;a=blob;f=AUTHORS;hb=HEAD
+#
+# This file is part of Debsources. Debsources is free software: you can
+# redistribute it and/or modify it under the terms of the GNU Affero General
+# Public License as published by the Free Software Foundation, either version 3
+# of the License, or (at your option) any later version.  For more information
+# see the COPYING file at the top-level directory of this distribution and at
+# https://anonscm.debian.org/gitweb/?p=qa/debsources.git;a=blob;f=COPYING;hb=HEAD
+
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from nose.tools import istest
+from nose.plugins.attrib import attr
+
+from debsources.journal import Journal
+
+
+@attr('journal')
+class JournalTests(unittest.TestCase):
+    """ Unit tests for debsources.journal """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(suffix='.debsources-test')
+        self.fname = os.path.join(self.tmpdir, 'update-journal')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    @istest
+    def resumesSyncedRecordsOnly(self):
+        journal = Journal(self.fname)
+        self.assertFalse(journal.resumed)
+        journal.package_done('foo', '1.0')
+        journal.stage_done('extract')
+        journal.sync()
+        journal.package_done('bar', '2.0')  # never synced, e.g. crash
+
+        resumed = Journal(self.fname)
+        self.assertTrue(resumed.resumed)
+        self.assertAlmostEqual(resumed.start, journal.start, places=5)
+        self.assertEqual(resumed.stages, set(['extract']))
+        self.assertEqual(resumed.packages, set([('foo', '1.0')]))
+
+    @istest
+    def recordsMirrorState(self):
+        journal = Journal(self.fname)
+        self.assertIsNone(journal.mirror)
+        journal.set_mirror('0123abcd')
+        journal.sync()
+        self.assertEqual(Journal(self.fname).mirror, '0123abcd')
+
+    @istest
+    def finishDisposesOfJournal(self):
+        journal = Journal(self.fname)
+        journal.stage_done('extract')
+        journal.sync()
+        journal.finish()
+        self.assertFalse(os.path.exists(self.fname))
+        self.assertFalse(Journal(self.fname).resumed)
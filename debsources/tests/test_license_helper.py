@@ -0,0 +1,168 @@
+# Copyright (C) 2015  The Debsources developers <info@sources.debian.net>.
+# See the AUTHORS file at the top-level directory of this distribution and at
+# https://anonscm.debian.org/gitweb/?p=qa/debsources.git;a=blob;f=AUTHORS;hb=HEAD
+#
+# This file is part of Debsources. Debsources is free software: you can
+# redistribute it and/or modify it under the terms of the GNU Affero General
+# Public License as published by the Free Software Foundation, either version 3
+# of the License, or (at your option) any later version.  For more information
+# see the COPYING file at the top-level directory of this distribution and at
+# https://anonscm.debian.org/gitweb/?p=qa/debsources.git;a=blob;f=COPYING;hb=HEAD
+
+from __future__ import absolute_import
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from debian import copyright
+from nose.tools import istest
+from nose.plugins.attrib import attr
+
+from debsources import license_helper
+from debsources.plugins import hook_copyright
+
+
+# not machine readable, and not UTF-8 either
+LATIN1_COPYRIGHT = u"""This package was debianized by J\xe9r\xf4me Dupont.
+
+Copyright: 1999-2003 J\xe9r\xf4me Dupont
+License: GPL-2+, see /usr/share/common-licenses/GPL-2
+""".encode('latin-1')
+
+
+DEP5_COPYRIGHT = br"""Format: https://www.debian.org/doc/packaging-manuals/copyright-format/1.0/
+Upstream-Name: foo
+
+Files: *
+Copyright: 2015 Upstream Author
+License: GPL-2+
+
+Files: src/*
+Copyright: 2015 Upstream Author
+License: BSD-3-clause
+
+Files: src/?.c
+Copyright: 2015 Upstream Author
+License: Expat
+
+Files: src/vendor/*
+Copyright: 2015 Vendor
+License: ISC
+
+Files: src/special/\*star\?.txt src/back\\slash
+Copyright: 2015 Upstream Author
+License: Apache-2.0
+
+Files: doc/* src/main.c
+Copyright: 2015 Upstream Author
+License: LGPL-2.1
+"""
+
+# paths to classify, and the license they get (if any)
+DEP5_PATHS = [
+    ('README', 'GPL-2+'),
+    ('./README', 'GPL-2+'),
+    ('src/ab.c', 'BSD-3-clause'),
+    ('src/a.c', 'Expat'),              # last match wins, with ?
+    ('./src/a.c', 'GPL-2+'),           # globs are not relative to ./
+    ('src/a.h', 'BSD-3-clause'),
+    ('src/vendor/a.c', 'ISC'),
+    ('src/vendor/sub/x.c', 'ISC'),     # * matches / too
+    ('src/special/*star?.txt', 'Apache-2.0'),
+    ('src/special/xstarx.txt', 'BSD-3-clause'),
+    ('src/back\\slash', 'Apache-2.0'),
+    ('src/main.c', 'LGPL-2.1'),
+    ('doc/manual.txt', 'LGPL-2.1'),
+    ('doc', 'GPL-2+'),
+    ('src/a.c\nfoo', 'BSD-3-clause'),
+]
+
+
+@attr('copyright')
+class LicenseHelperTests(unittest.TestCase):
+    """ Unit tests for debsources.license_helper """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(suffix='.debsources-test')
+        self.pkgdir = os.path.join(self.tmpdir, 'pkg')
+        os.makedirs(os.path.join(self.pkgdir, 'debian'))
+        open(os.path.join(self.pkgdir, 'foo.c'), 'w').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write_copyright(self, content):
+        path = os.path.join(self.pkgdir, 'debian', 'copyright')
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    @istest
+    def latin1NotMachineReadableHasNoLicense(self):
+        path = self.write_copyright(LATIN1_COPYRIGHT)
+        self.assertIsNone(license_helper.get_license(None, 'pkg', '1.0',
+                                                     'foo.c', path))
+
+    @istest
+    def latin1NotMachineReadableInHook(self):
+        self.write_copyright(LATIN1_COPYRIGHT)
+        orig_conf = hook_copyright.conf
+        hook_copyright.conf = {'backends': set(['hooks.fs'])}
+        try:
+            hook_copyright.add_package(None,
+                                       {'package': 'pkg', 'version': '1.0'},
+                                       self.pkgdir, None)
+        finally:
+            hook_copyright.conf = orig_conf
+        license_file = hook_copyright.license_path(self.pkgdir)
+        self.assertEqual(hook_copyright.parse_license_file(license_file), [])
+
+    def assertSameParagraph(self, c, matcher, path):
+        expected = c.find_files_paragraph(path)
+        actual = matcher.find_files_paragraph(path)
+        if expected is None:
+            self.assertIsNone(actual, path)
+        else:
+            self.assertEqual((actual.files, actual.license.synopsis),
+                             (expected.files, expected.license.synopsis),
+                             path)
+
+    @istest
+    def filesMatcherMatchesPythonDebian(self):
+        path = self.write_copyright(DEP5_COPYRIGHT)
+        c = license_helper.parse_license(path)
+        matcher = license_helper.FilesMatcher(c)
+        for (relpath, synopsis) in DEP5_PATHS:
+            self.assertSameParagraph(c, matcher, relpath)
+            self.assertEqual(license_helper.get_file_license(
+                matcher, 'pkg', '1.0', relpath), synopsis, relpath)
+
+    @istest
+    def filesMatcherHandlesManyParagraphs(self):
+        # more paragraphs than regex groups allowed by a single regex
+        paragraphs = [b'Files: f%d *%d\nCopyright: X\nLicense: L%d\n'
+                      % (i, i % 7, i) for i in range(250)]
+        c = copyright.Copyright(io.StringIO(
+            (DEP5_COPYRIGHT.split(b'\n\n')[0] + b'\n\n' +
+             b'\n'.join(paragraphs)).decode('utf-8')))
+        matcher = license_helper.FilesMatcher(c)
+        for path in ['f0', 'f99', 'f100', 'f249', 'x3', 'f3', 'nomatch']:
+            self.assertSameParagraph(c, matcher, path)
+
+    @istest
+    def filesMatchersAreCached(self):
+        path = self.write_copyright(LATIN1_COPYRIGHT)
+        self.assertIsNone(license_helper.get_files_matcher(path))
+        key = (path, os.stat(path).st_mtime)
+        self.assertIn(key, license_helper._matchers)
+        self.assertIsNone(license_helper._matchers[key])
+
+        # a changed file is parsed again
+        self.write_copyright(DEP5_COPYRIGHT)
+        os.utime(path, (0, 0))
+        matcher = license_helper.get_files_matcher(path)
+        self.assertIsInstance(matcher, license_helper.FilesMatcher)
+        self.assertIs(license_helper.get_files_matcher(path), matcher)
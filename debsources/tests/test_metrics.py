@@ -0,0 +1,76 @@
+# Copyright (C) 2015  The Debsources developers <info@sources.debian.net>.
+# See the AUTHORS file at the top-level directory of this distribution and at
+# https://anonscm.debian.org/gitweb/?p=qa/debsources.git;a=blob;f=AUTHORS;hb=HEAD
+#
+# This file is part of Debsources. Debsources is free software: you can
+# redistribute it and/or modify it under the terms of the GNU Affero General
+# Public License as published by the Free Software Foundation, either version 3
+# of the License, or (at your option) any later version.  For more information
+# see the COPYING file at the top-level directory of this distribution and at
+# https://anonscm.debian.org/gitweb/?p=qa/debsources.git;a=blob;f=COPYING;hb=HEAD
+
+from __future__ import absolute_import
+
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from nose.tools import istest
+from nose.plugins.attrib import attr
+
+from debsources import fs_storage
+from debsources.plugins import hook_metrics
+
+
+@attr('metrics')
+class MetricsTests(unittest.TestCase):
+    """ Unit tests for debsources.plugins.hook_metrics """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(suffix='.debsources-test')
+        self.pkgdir = os.path.join(self.tmpdir, 'pkg')
+        os.makedirs(os.path.join(self.pkgdir, 'src', 'sub'))
+        os.makedirs(os.path.join(self.pkgdir, 'debian'))
+        with open(os.path.join(self.pkgdir, 'src', 'big.c'), 'w') as f:
+            f.write('x' * 100000)
+        with open(os.path.join(self.pkgdir, 'src', 'sub', 'small.h'),
+                  'w') as f:
+            f.write('y' * 10)
+        open(os.path.join(self.pkgdir, 'debian', 'empty'), 'w').close()
+        # hard link: counted once by du
+        os.link(os.path.join(self.pkgdir, 'src', 'big.c'),
+                os.path.join(self.pkgdir, 'debian', 'big.c'))
+        # symlinks, to a file and to a directory: not followed by du
+        os.symlink('../src/sub/small.h',
+                   os.path.join(self.pkgdir, 'debian', 'small.h'))
+        os.symlink('src/sub', os.path.join(self.pkgdir, 'sub'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def du(self, path):
+        out = subprocess.check_output(['du', '--summarize', '-k', path])
+        return int(out.split()[0])
+
+    @istest
+    def diskUsageMatchesDu(self):
+        metrics = hook_metrics.disk_usage(self.pkgdir)
+        self.assertEqual(metrics['size'], self.du(self.pkgdir))
+
+    @istest
+    def diskUsageReusesScan(self):
+        file_table = fs_storage.scan_pkg_files(self.pkgdir)
+        self.assertEqual(hook_metrics.disk_usage(self.pkgdir, file_table),
+                         hook_metrics.disk_usage(self.pkgdir))
+
+    @istest
+    def diskUsageMetrics(self):
+        metrics = hook_metrics.disk_usage(self.pkgdir)
+        # big.c (x2, hard linked), small.h, empty, plus the small.h symlink
+        self.assertEqual(metrics['file_count'], 5)
+        self.assertEqual(metrics['dir_count'], 3)  # src, src/sub, debian
+        self.assertEqual(metrics['largest_file'], 100000)
+        self.assertEqual(metrics['apparent_size'],
+                         100000 + 10 + 0 + len('../src/sub/small.h'))
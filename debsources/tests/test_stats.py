@@ -14,11 +14,14 @@ from __future__ import absolute_import
 import unittest
 
 import six
+from sqlalchemy import func as sql_func
 
 from nose.tools import istest
 from nose.plugins.attrib import attr
 
+from debsources import query as qry
 from debsources import statistics
+from debsources.models import File, FileCopyright, Suite
 
 from debsources.tests.db_testing import DbTestFixture
 
@@ -209,3 +212,70 @@ class Stats(unittest.TestCase, DbTestFixture):
         wheezy_sloc = [[item[1], item[2]] for item in sloc_list
                        if item[0] == "wheezy"]
         self.assertEqual(dict(wheezy_sloc)['sh'], 13560)
+
+    @istest
+    def suitesStatsMatchReferenceDb(self):
+        stats = statistics.suites_stats(self.session)
+        self.assertEqual(stats['etch']['disk_usage'], 32736)
+        self.assertEqual(stats['wheezy']['ctags'], 20150)
+        self.assertEqual(stats['jessie']['source_packages'], 13)
+        self.assertEqual(stats['wheezy']['source_files'], 1632)
+        self.assertEqual(stats['wheezy']['sloccount']['sh'], 13560)
+        self.assertEqual(stats['ALL']['disk_usage'], 180732)
+        self.assertEqual(stats['ALL']['source_packages'], 36)
+
+    def raw_stats(self, select, table, suite=None, where='TRUE'):
+        """compute a statistic from the raw tables, not from the per-package
+        summary tables
+
+        """
+        q = 'SELECT %s FROM %s' % (select, table)
+        if suite:
+            q += ' JOIN suites ON suites.package_id = %s.package_id \
+                   WHERE suites.suite = :suite AND %s' % (table, where)
+        else:
+            q += ' WHERE %s' % where
+        return self.session.execute(q, {'suite': suite}).scalar() or 0
+
+    @istest
+    def suitesStatsMatchRawTables(self):
+        stats = statistics.suites_stats(self.session)
+        for (suite, suite_stats) in six.iteritems(stats):
+            s = suite if suite != 'ALL' else None
+            self.assertEqual(suite_stats['disk_usage'],
+                             self.raw_stats('sum(value_)', 'metrics', s,
+                                            "metric = 'size'"))
+            self.assertEqual(suite_stats['source_files'],
+                             self.raw_stats('count(*)', 'checksums', s))
+            self.assertEqual(suite_stats['ctags'],
+                             self.raw_stats('count(*)', 'ctags', s))
+            for (lang, slocs) in six.iteritems(suite_stats['sloccount']):
+                self.assertEqual(slocs,
+                                 self.raw_stats('sum(sloccounts.count)',
+                                                'sloccounts', s,
+                                                "language = '%s'" % lang))
+
+    @istest
+    def licenseStatsMatchReferenceDb(self):
+        stats = statistics.license_stats(self.session)
+        self.assertEqual(statistics.license_ratio(stats['ALL']), 77)
+        self.assertEqual(statistics.license_ratio(stats['jessie']), 50)
+        self.assertEqual(statistics.license_ratio(stats['squeeze']), 100)
+        self.assertEqual(stats['jessie']['licenses'],
+                         statistics.get_licenses(self.session, 'jessie'))
+
+    @istest
+    def licenseStatsMatchRawTables(self):
+        stats = statistics.license_stats(self.session)
+        for (suite, suite_stats) in six.iteritems(stats):
+            s = suite if suite != 'ALL' else None
+            self.assertEqual(statistics.license_ratio(suite_stats),
+                             qry.get_ratio(self.session, s))
+            q = (self.session.query(FileCopyright.license,
+                                    sql_func.count(FileCopyright.id))
+                 .join(File))
+            if s:
+                q = q.join(Suite, Suite.package_id == File.package_id) \
+                     .filter(Suite.suite == s)
+            q = q.group_by(FileCopyright.license)
+            self.assertEqual(suite_stats['licenses'], dict(q.all()))
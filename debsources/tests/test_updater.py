@@ -27,11 +27,13 @@ from nose.tools import istest
 from nose.plugins.attrib import attr
 
 from debsources import db_storage
+from debsources import journal
 from debsources import mainlib
 from debsources import models
 from debsources import statistics
 from debsources import updater
 
+from debsources.debmirror import SourceMirror
 from debsources.tests.db_testing import DbTestFixture, DB_COMPARE_QUERIES
 from debsources.tests.updater_testing import mk_conf
 from debsources.subprocess_workaround import subprocess_setup
@@ -100,6 +102,23 @@ def assert_dir_equal(test_subj, dir1, dir2, exclude=[]):
     test_subj.assertTrue(dir_eq, 'file system storages differ')
 
 
+class InterruptedStatus(updater.UpdateStatus):
+    """update status of a run that gets interrupted (as if by a crash, or by
+    its time budget) once `budget` packages have been completed
+
+    """
+
+    def __init__(self, run_journal, budget):
+        super(InterruptedStatus, self).__init__(run_journal)
+        self.budget = budget
+
+    def package_done(self, package, version):
+        super(InterruptedStatus, self).package_done(package, version)
+        self.budget -= 1
+        if self.budget <= 0:
+            self.interrupted = True
+
+
 @attr('infra')
 @attr('postgres')
 @attr('slow')
@@ -144,6 +163,22 @@ class Updater(unittest.TestCase, DbTestFixture):
 
         assert_db_schema_equal(self, 'ref', 'public')
 
+    @istest
+    @attr('notravis')
+    def parallelExtractionProducesReferenceDb(self):
+        db_mv_tables_to_schema(self.session, 'ref')
+        self.conf['extract_workers'] = 4
+        self.do_update()
+
+        exclude_pat = ['*' + ext for ext in self.conf['file_exts']] \
+            + ['*.log']
+        assert_dir_equal(self,
+                         os.path.join(self.tmpdir, 'sources'),
+                         os.path.join(TEST_DATA_DIR, 'sources'),
+                         exclude=exclude_pat)
+
+        assert_db_schema_equal(self, 'ref', 'public')
+
     @istest
     def producesReferenceSourcesTxt(self):
         def parse_sources_txt(fname):
@@ -227,6 +262,55 @@ class Updater(unittest.TestCase, DbTestFixture):
                          'gone package %s/%s persisted in DB storage' %
                          GC_PACKAGE)
 
+    @istest
+    @attr('notravis')
+    def resumesInterruptedRun(self):
+        db_mv_tables_to_schema(self.session, 'ref')
+        self.conf['journal'] = True
+        self.conf['observers'], self.conf['file_exts'] = \
+            mainlib.load_hooks(self.conf)
+        updater.ensure_cache_dir(self.conf)
+        journal_file = os.path.join(self.conf['cache_dir'], updater.JOURNAL)
+
+        # first update run, interrupted after the addition of a few packages
+        mirror = SourceMirror(self.conf['mirror_dir'])
+        status = InterruptedStatus(updater._open_journal(self.conf, mirror), 3)
+        updater.extract_new(status, self.conf, self.session, mirror)
+        updater.checkpoint(status, self.conf, self.session)
+        done = journal.Journal(journal_file).packages
+        self.assertEqual(len(done), 3)
+        for pkg_id in done:
+            self.assertTrue(db_storage.lookup_package(self.session, *pkg_id),
+                            'journaled package %s/%s not in DB storage'
+                            % pkg_id)
+
+        # second update run, resuming the first one
+        self.do_update()
+        self.assertFalse(os.path.exists(journal_file),
+                         'journal persisted after complete update run')
+        assert_db_schema_equal(self, 'ref', 'public')
+
+    @istest
+    @attr('notravis')
+    def restartsInterruptedRunOnMirrorChange(self):
+        db_mv_tables_to_schema(self.session, 'ref')
+        self.conf['journal'] = True
+        updater.ensure_cache_dir(self.conf)
+        journal_file = os.path.join(self.conf['cache_dir'], updater.JOURNAL)
+
+        # journal of a run interrupted at the very end, on another mirror
+        stale = journal.Journal(journal_file)
+        stale.set_mirror('some other mirror')
+        for stage in self.TEST_STAGES:
+            stale.stage_done(updater.pp_stage(stage))
+        stale.sync()
+
+        # were it resumed, all stages would be skipped
+        self.do_update()
+        self.assertFalse(os.path.exists(journal_file),
+                         'journal persisted after complete update run')
+        assert_db_schema_equal(self, 'ref', 'public')
+
     @istest
     def excludeFiles(self):
         PKG = 'bsdgames-nonfree'
@@ -335,3 +419,73 @@ class MetadataCache(unittest.TestCase, DbTestFixture):
         }
 
         self.assertDictContainsSubset(expected_stats, license_stats)
+
+
+# sample package tree, and file glob patterns of exclusion stanzas (from
+# doc/exclude.txt and the Updater tests, plus corner cases) together with the
+# files they exclude, as glob.glob() would find them
+EXCLUSION_TREE = ['foo/bar.c', 'foo/baz.c', 'foo/.hidden.c', 'top.c',
+                  '.dotfile', 'a1.txt', 'ab.txt', 'baz/qux/a/x.c',
+                  'baz/qux/a/x.h', 'baz/qux/b/c/y.c', 'baz/qux/z.c',
+                  'tests/battlestar.in17', 'tests/battlestar.in1']
+EXCLUSION_GLOBS = [
+    ('foo/bar.c', ['foo/bar.c']),
+    ('./foo/bar.c', ['foo/bar.c']),
+    ('baz/qux/*/*.c', ['baz/qux/a/x.c']),         # * does not match /
+    ('tests/battlestar.in17', ['tests/battlestar.in17']),
+    ('tests/battlestar.in1?', ['tests/battlestar.in17']),
+    ('tests/battlestar.in1*', ['tests/battlestar.in1',
+                               'tests/battlestar.in17']),
+    ('*.c', ['top.c']),                           # anchored at package root
+    ('*', ['a1.txt', 'ab.txt', 'top.c']),         # no dot files, no dirs
+    ('foo/*', ['foo/bar.c', 'foo/baz.c']),
+    ('foo/.*', ['foo/.hidden.c']),
+    ('.*', ['.dotfile']),
+    ('a[0-9].txt', ['a1.txt']),
+    ('a[!0-9].txt', ['ab.txt']),
+    ('foo', []),                                  # directories never match
+    ('bar.c', []),                                # not a basename pattern
+    ('nomatch/*.c', []),
+]
+
+
+@attr('exclude')
+class Exclusions(unittest.TestCase):
+    """ Unit tests for debsources.updater.ExclusionSpecs """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(suffix='.debsources-test')
+        for relpath in EXCLUSION_TREE:
+            path = os.path.join(self.tmpdir, relpath)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            open(path, 'w').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def glob_files(self, pat):
+        """files matching `pat` in the sample tree, as per glob.glob()"""
+        return sorted(os.path.normpath(os.path.relpath(path, self.tmpdir))
+                      for path in glob.glob(os.path.join(self.tmpdir, pat))
+                      if not os.path.isdir(path))
+
+    @istest
+    def excludedFilesMatchGlob(self):
+        for (pat, expected) in EXCLUSION_GLOBS:
+            specs = updater.ExclusionSpecs([{'package': 'pkg',
+                                             'files': pat}])
+            excluded = sorted(specs.excluded_files('pkg', EXCLUSION_TREE))
+            self.assertEqual(excluded, expected, pat)
+            self.assertEqual(self.glob_files(pat), expected, pat)
+
+    @istest
+    def excludedFilesOfPackageOnly(self):
+        specs = updater.ExclusionSpecs([
+            {'package': 'pkg', 'files': 'foo/bar.c\n baz/qux/*/*.c'},
+            {'package': 'pkg', 'files': 'top.c'},
+            {'package': 'other', 'files': '*'},
+        ])
+        self.assertEqual(sorted(specs.excluded_files('pkg', EXCLUSION_TREE)),
+                         ['baz/qux/a/x.c', 'foo/bar.c', 'top.c'])
+        self.assertEqual(specs.excluded_files('nopkg', EXCLUSION_TREE), [])
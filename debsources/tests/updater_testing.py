@@ -31,6 +31,7 @@ def mk_conf(tmpdir):
         'single_transaction': 'true',
         'dry_run': False,
         'expire_days': 0,
+        'extract_workers': 1,
         'force_triggers': '',
         'hooks': ['sloccount', 'checksums', 'ctags', 'metrics', 'copyright'],
         'mirror_dir': os.path.join(TEST_DATA_DIR, 'mirror'),
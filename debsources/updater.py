@@ -12,11 +12,14 @@
 from __future__ import absolute_import
 from __future__ import division
 
-import glob
+import hashlib
 import logging
+import multiprocessing
 import os
+import re
 import string
 import subprocess
+import time
 
 import six
 from six.moves import map
@@ -24,12 +27,15 @@ from six.moves import range
 
 from datetime import datetime
 from email.utils import formatdate
-from sqlalchemy import sql, not_
+from sqlalchemy import event, sql, not_
+from sqlalchemy import func as sql_func
+from sqlalchemy.orm import joinedload
 
 from debsources import db_storage
+from debsources import instrumentation
 from debsources import fs_storage
+from debsources import journal
 from debsources import statistics
-from . import query as qry
 
 from debsources.consts import DEBIAN_RELEASES, SLOCCOUNT_LANGUAGES
 from debsources.debmirror import SourceMirror, SourcePackage
@@ -43,12 +49,42 @@ NO_OBSERVERS = dict([(e, []) for e in KNOWN_EVENTS])
 # maximum number of pending rows before performing a (bulk) insert
 BULK_FLUSH_THRESHOLD = 50000
 
+# shell hooks following the batch protocol (see `notify`) are passed at most
+# this many packages per invocation
+SHELL_HOOKS_BATCH_SIZE = 100
+
+# names of shell hooks run (by run-parts) once per package, and of those
+# following the batch protocol. Note: the latter are ignored by run-parts
+SHELL_HOOK_NAME = re.compile(r'^[a-zA-Z0-9_-]+$')
+BATCH_SHELL_HOOK_NAME = re.compile(r'^[a-zA-Z0-9_-]+\.batch$')
+
+# timings report of the last update run, relative to cache_dir
+TIMINGS_REPORT = 'update-timings.json'
+
+# journal of the ongoing update run, relative to cache_dir. See
+# `debsources.journal`
+JOURNAL = 'update-journal'
+
+# when journaling, the work done so far is committed (and recorded in the
+# journal) at the end of each update stage and, while adding packages, every
+# CHECKPOINT_PACKAGES packages or CHECKPOINT_SECONDS seconds, whichever comes
+# first. conf['commit_every'] overrides the latter two
+CHECKPOINT_PACKAGES = 1000
+CHECKPOINT_SECONDS = 600
+
 
 class UpdateStatus(object):
     """store update status during update runs"""
 
-    def __init__(self):
+    def __init__(self, journal=None, deadline=None):
         self._sources = {}
+        self._packages = None
+        self._license_stats = None
+        self.journal = journal  # `debsources.journal.Journal`, or None
+        self.deadline = deadline  # time at which the run should stop, if any
+        self.interrupted = False
+        self.last_checkpoint = time.time()
+        self.unsaved_packages = 0  # packages completed since last checkpoint
 
     @property
     def sources(self):
@@ -64,11 +100,104 @@ class UpdateStatus(object):
     def sources(self, new_sources):
         self._sources = new_sources
 
+    def packages(self, session):
+        """index of the packages known to the DB, as a
+        `db_storage.PackageIndex`
+
+        the index is loaded via `session` upon first access, and then shared
+        by all update stages
+
+        """
+        if self._packages is None:
+            self._packages = db_storage.PackageIndex(session)
+        return self._packages
+
+    def license_stats(self, session):
+        """license statistics of all suites, see `statistics.license_stats`
+
+        statistics are computed via `session` upon first access, and then
+        shared by the stats and charts stages
+
+        """
+        if self._license_stats is None:
+            self._license_stats = statistics.license_stats(session)
+        return self._license_stats
+
+    def package_done(self, package, version):
+        """record that some work on package <package, version> (e.g. its
+        addition) has been done, and is due to be committed
+
+        """
+        if self.journal is not None:
+            self.journal.package_done(package, version)
+        self.unsaved_packages += 1
+
+    def out_of_time(self):
+        """check whether the time budget of the run (if any) has been
+        exhausted; if so, mark the run as interrupted
+
+        """
+        if self.deadline is not None and time.time() >= self.deadline:
+            if not self.interrupted:
+                logging.warn('time budget exhausted, interrupting update run')
+            self.interrupted = True
+        return self.interrupted
+
+    def discard_package(self, package, version):
+        """forget about package <package, version>, if the package index has
+        been loaded
+
+        """
+        if self._packages is not None:
+            self._packages.discard(package, version)
+
+
+def commit_frequency(conf):
+    """return the checkpoint frequency of update runs with configuration
+    `conf`, as a pair <packages, seconds>: a checkpoint is due every that many
+    packages or seconds, whichever comes first; 0 means never
+
+    """
+    (packages, seconds) = conf.get('commit_every') or (0, 0)
+    if not (packages or seconds) and conf.get('journal'):
+        (packages, seconds) = (CHECKPOINT_PACKAGES, CHECKPOINT_SECONDS)
+    return (packages, seconds)
+
+
+def checkpoint(status, conf, session, force=True):
+    """commit the work done so far (in single transaction mode), pass the
+    packages pending for batch shell hooks to them, and record the work in the
+    journal (if journaling). This is a no-op unless journaling or batched
+    commits (conf['commit_every']) are enabled
+
+    if `force` is not set, only do so if a checkpoint is due according to
+    `commit_frequency`
+
+    """
+    (packages, seconds) = commit_frequency(conf)
+    if not (packages or seconds):
+        return
+    if not force and \
+       not (packages and status.unsaved_packages >= packages) and \
+       not (seconds and time.time() - status.last_checkpoint >= seconds):
+        return
+    if conf['single_transaction'] and not conf['dry_run']:
+        logging.debug('checkpoint: commit...')
+        session.commit()
+    # pending batch shell hook invocations are not journaled: do them before
+    # recording the packages they are about as done
+    run_shell_batches(conf)
+    if status.journal is not None:
+        status.journal.sync()
+    status.last_checkpoint = time.time()
+    status.unsaved_packages = 0
+
 
 # TODO fill tables: BinaryPackage, BinaryVersion
 # TODO get rid of shell hooks; they shall die a horrible death
 
-def notify(conf, event, session, pkg, pkgdir, file_table=None):
+def notify(conf, event, session, pkg, pkgdir, file_table=None,
+           package_id=None):
     """notify (Python and shell) hooks of occurred events
 
     Currently supported events:
@@ -95,55 +224,173 @@ def notify(conf, event, session, pkg, pkgdir, file_table=None):
     * file_table: a dictionary mapping file names to DB file identifiers
       (unique integers). If != None, the hook can rely on the file_table keys
       to avoid re-scanning the file-system and use the corresponding file IDs.
-      If None, the hook will have to redo the scanning work.
-
-    Shell hoks re invoked with the following arguments: pkgdir, package name,
-    package version
+      If None, the hook will have to redo the scanning work. The file table
+      is usually a fs_storage.FileTable, which also carries the result of a
+      single scan of the package directory (sizes, modes, symlink targets,
+      inodes, ...), available even if there are no file IDs: hooks should
+      use fs_storage.pkg_files() / walk_pkg_files() to exploit it.
+
+    rm-package Python hooks are passed an additional argument:
+
+    * package_id: DB identifier of the package, whose hook-specific data
+      should be removed from the DB. If None, the package itself is being
+      removed from the DB, and hook-specific data referencing it will go away
+      with it (ON DELETE CASCADE): there is no DB work left for the hook
+
+    Shell hooks are the executables found in BIN_DIR/EVENT.d. They are invoked
+    (via run-parts) with the following arguments: pkgdir, package name,
+    package version. If there are no shell hooks, run-parts is not invoked at
+    all; shell hook directories are only scanned once, see `shell_hooks`.
+
+    Shell hooks named NAME.batch (ignored by run-parts) opt in the batch
+    protocol instead: they are invoked with no arguments and passed several
+    packages at once on their standard input, one per line, as tab-separated
+    pkgdir, package name, package version. Batch hooks run after the fact,
+    i.e. after the packages have been processed by other hooks (for
+    rm-package, pkgdir might hence be gone). Their failures are logged, but
+    do not affect the processing of the packages
 
     """
     logging.debug('notify %s for %s' % (event, pkg))
     package, version = pkg['package'], pkg['version']
-    cmd = ['run-parts', '--exit-on-error',
-           '--arg', pkgdir,
-           '--arg', package,
-           '--arg', version,
-           os.path.join(conf['bin_dir'], event + '.d')]
+    (scripts, batch_scripts) = shell_hooks(conf, event)
 
     # fire shell hooks
-    try:
-        subprocess.check_output(cmd, stderr=subprocess.STDOUT,
-                                preexec_fn=subprocess_setup)
-    except subprocess.CalledProcessError as e:
-        logging.error('shell hooks for %s on %s returned exit code %d.'
-                      ' Output: %s'
-                      % (event, pkg, e.returncode, e.output))
-        raise e
+    if scripts:
+        cmd = ['run-parts', '--exit-on-error',
+               '--arg', pkgdir,
+               '--arg', package,
+               '--arg', version,
+               os.path.join(conf['bin_dir'], event + '.d')]
+        try:
+            with instrumentation.measure('hook', event + '/shell',
+                                         _pkg_bytes()):
+                subprocess.check_output(cmd, stderr=subprocess.STDOUT,
+                                        preexec_fn=subprocess_setup)
+        except subprocess.CalledProcessError as e:
+            logging.error('shell hooks for %s on %s returned exit code %d.'
+                          ' Output: %s'
+                          % (event, pkg, e.returncode, e.output))
+            raise e
 
     notify_plugins(conf['observers'], event, session, pkg, pkgdir,
-                   file_table=file_table)
+                   file_table=file_table, package_id=package_id)
+
+    if batch_scripts:
+        batch = _shell_batches.setdefault(event, [])
+        batch.append((pkgdir, package, version))
+        if len(batch) >= SHELL_HOOKS_BATCH_SIZE:
+            run_shell_batches(conf, event)
+
+
+# shell hooks dir -> pair <per-package hooks, batch hooks>, see `shell_hooks`
+_shell_hooks = {}
+
+# event -> packages pending for batch shell hooks, as <pkgdir, package,
+# version> triples
+_shell_batches = {}
+
+
+def shell_hooks(conf, event):
+    """return the shell hooks for `event`, as a pair <hooks, batch_hooks> of
+    lists of paths. Shell hook directories are scanned once, on first use
+
+    """
+    hooks_dir = os.path.join(conf['bin_dir'], event + '.d')
+    if hooks_dir not in _shell_hooks:
+        (scripts, batch_scripts) = ([], [])
+        if os.path.isdir(hooks_dir):
+            for name in sorted(os.listdir(hooks_dir)):
+                path = os.path.join(hooks_dir, name)
+                if not os.path.isfile(path) or not os.access(path, os.X_OK):
+                    continue
+                if SHELL_HOOK_NAME.match(name):
+                    scripts.append(path)
+                elif BATCH_SHELL_HOOK_NAME.match(name):
+                    batch_scripts.append(path)
+        logging.debug('shell hooks in %s: %s, batch: %s'
+                      % (hooks_dir, scripts, batch_scripts))
+        _shell_hooks[hooks_dir] = (scripts, batch_scripts)
+    return _shell_hooks[hooks_dir]
+
+
+def run_shell_batches(conf, event=None):
+    """pass the packages pending for batch shell hooks of `event` (or of all
+    events, if None) to the hooks, see `notify`
+
+    handles and logs exceptions
+    """
+    events = [event] if event is not None else list(_shell_batches)
+    for event in events:
+        batch = _shell_batches.pop(event, [])
+        if not batch:
+            continue
+        stdin = ''.join('\t'.join(entry) + '\n' for entry in batch)
+        for script in shell_hooks(conf, event)[1]:
+            logging.debug('run batch shell hook %s on %d packages'
+                          % (script, len(batch)))
+            try:
+                with instrumentation.measure('hook', '%s/%s' % (
+                        event, os.path.basename(script)), 0):
+                    proc = subprocess.Popen([script], stdin=subprocess.PIPE,
+                                            stdout=subprocess.PIPE,
+                                            stderr=subprocess.STDOUT,
+                                            preexec_fn=subprocess_setup)
+                    output = proc.communicate(stdin)[0]
+                if proc.returncode != 0:
+                    logging.error('batch shell hook %s for %s returned exit'
+                                  ' code %d. Output: %s'
+                                  % (script, event, proc.returncode, output))
+            except Exception:
+                logging.exception('batch shell hook %s for %s failed'
+                                  % (script, event))
 
 
 def notify_plugins(observers, event, session, pkg, pkgdir,
-                   triggers=None, dry=False, file_table=None):
+                   triggers=None, dry=False, file_table=None, package_id=None):
     """notify Python hooks of occurred events
 
     If triggers is not None, only Python hooks whose names are listed in them
     will be triggered. Note: shell hooks will not be triggered in that case.
     """
+    args = (session, pkg, pkgdir, file_table)
+    if event == 'rm-package':
+        args += (package_id,)
     for (title, action) in observers[event]:
         try:
-            if triggers is None:
-                action(session, pkg, pkgdir, file_table)
-            elif (event, title) in triggers:
-                logging.info('notify (forced) %s/%s for %s'
-                             % (event, title, pkg))
-                if not dry:
-                    action(session, pkg, pkgdir, file_table)
+            with instrumentation.measure('hook', '%s/%s' % (event, title),
+                                         _pkg_bytes()):
+                if triggers is None:
+                    action(*args)
+                elif (event, title) in triggers:
+                    logging.info('notify (forced) %s/%s for %s'
+                                 % (event, title, pkg))
+                    if not dry:
+                        action(*args)
         except:
             logging.error('plugin hooks for %s on %s failed' % (event, pkg))
             raise
 
 
+def _pkg_bytes():
+    """bytes of the package being processed, for instrumentation purposes"""
+    m = instrumentation.get().current('package')
+    return m.bytes if m is not None else 0
+
+
+def _measure_pkg_bytes(timing, pkg):
+    """set the bytes of package measure `timing` to the size of `pkg` in the
+    mirror, if it can be determined
+
+    this is best effort: a broken package (e.g. with an unreadable .dsc) must
+    not fail because of instrumentation; its measure is left with no bytes
+    """
+    try:
+        timing.bytes = pkg.source_size()
+    except Exception as e:
+        logging.warn('cannot determine size of %s: %s' % (pkg, e))
+
+
 def ensure_dir(dir):
     if not os.path.exists(dir):
         os.makedirs(dir)
@@ -157,6 +404,116 @@ def ensure_stats_dir(conf):
     ensure_dir(os.path.join(conf['cache_dir'], 'stats'))
 
 
+def _glob_regex(pat):
+    """translate UNIX-style glob `pat` (relative to the package directory) to
+    an equivalent regular expression, to be matched against relative file
+    paths
+
+    as with glob.glob(), wildcards do not match "/", and do not match file
+    names starting with "." unless the pattern component does too
+
+    """
+    if pat.startswith('./'):
+        pat = pat[2:]
+    components = []
+    for component in pat.split('/'):
+        regex = '' if component.startswith('.') else r'(?!\.)'
+        i = 0
+        while i < len(component):
+            c = component[i]
+            i += 1
+            if c == '*':
+                regex += '[^/]*'
+            elif c == '?':
+                regex += '[^/]'
+            elif c == '[':
+                j = i
+                if j < len(component) and component[j] == '!':
+                    j += 1
+                if j < len(component) and component[j] == ']':
+                    j += 1
+                j = component.find(']', j)
+                if j < 0:  # no closing bracket: match it literally
+                    regex += r'\['
+                else:
+                    chars = component[i:j].replace('\\', r'\\')
+                    i = j + 1
+                    if chars[0] == '!':
+                        chars = '^/' + chars[1:]
+                    elif chars[0] == '^':
+                        chars = '\\' + chars
+                    regex += '[%s]' % chars
+            else:
+                regex += re.escape(c)
+        components.append(regex)
+    return '/'.join(components)
+
+
+class ExclusionSpecs(object):
+    """exclusion specifications (see doc/exclude.txt), compiled for fast
+    lookup: stanzas are indexed by package name, and the file patterns of each
+    package are compiled to a single regular expression
+
+    """
+
+    def __init__(self, stanzas=[]):
+        self._packages = {}  # name -> set of excluded versions, None for all
+        self._patterns = {}  # name -> list of file glob patterns
+        for stanza in stanzas:
+            package = stanza['package']
+            if 'files' in stanza:
+                self._patterns.setdefault(package, []) \
+                              .extend(stanza['files'].split())
+            elif 'version' not in stanza:
+                self._packages[package] = None
+            elif self._packages.get(package, set()) is not None:
+                self._packages.setdefault(package, set()) \
+                              .add(stanza['version'])
+        self._files = dict(
+            (package, re.compile('(?:%s)\\Z'
+                                 % '|'.join(map(_glob_regex, patterns))))
+            for (package, patterns) in six.iteritems(self._patterns))
+
+    def excludes_package(self, package, version):
+        """whether package <package, version> is excluded"""
+        if package not in self._packages:
+            return False
+        versions = self._packages[package]
+        return versions is None or version in versions
+
+    def excluded_files(self, package, relpaths):
+        """filter `relpaths`, paths relative to the directory of a version of
+        `package`, returning those excluded
+
+        """
+        regex = self._files.get(package)
+        if regex is None:
+            return []
+        return [relpath for relpath in relpaths if regex.match(relpath)]
+
+
+def _exclusion_specs(exclude_specs):
+    """return `exclude_specs` as `ExclusionSpecs`, compiling them if needed
+    (e.g., when given as a list of stanzas)
+
+    """
+    if isinstance(exclude_specs, ExclusionSpecs):
+        return exclude_specs
+    return ExclusionSpecs(exclude_specs)
+
+
+def _excluded_files(pkg, exclude_specs, file_table):
+    """list files of `pkg` eligible for exclusion according to
+    `exclude_specs`, as paths relative to the package directory
+
+    files are looked up in the scan of the package carried by `file_table`, a
+    `fs_storage.FileTable`
+
+    """
+    return _exclusion_specs(exclude_specs) \
+        .excluded_files(pkg['package'], file_table.files)
+
+
 def exclude_files(session, pkg, pkgdir, file_table, exclude_specs):
     """remove files matching `exclude_specs` from storage and exclude them from
     further processing
@@ -164,18 +521,9 @@ def exclude_files(session, pkg, pkgdir, file_table, exclude_specs):
     Side effect: excluded files will be removed from `file_table`
 
     """
-    # enforce spec's Package field
-    specs = [spec for spec in exclude_specs
-             # ignore non file-based exclusion stanzas
-             if 'files' in spec and
-             spec['package'] == pkg['package']]
-    candidates = []  # files eligible for exclusion
-    for spec in specs:
-        # enforce spec's Files field
-        for pat in spec['files'].split():
-            # ASSUMPTION: `pkgdir` is the CWD; enforced by _add_package
-            for relpath in glob.iglob(pat):
-                candidates.append(relpath)
+    if file_table is None or file_table.files is None:
+        return  # package has not been scanned (e.g., no FS storage)
+    candidates = _excluded_files(pkg, exclude_specs, file_table)
 
     # remove exclusion candidates from FS and DB storage
     if candidates:
@@ -184,53 +532,129 @@ def exclude_files(session, pkg, pkgdir, file_table, exclude_specs):
             logging.debug('excluding file %s' % relpath)
             fs_storage.rm_file(pkgdir, relpath)
             db_storage.rm_file(session, pkg['package'], relpath, file_table)
-            del(file_table[relpath])
+            file_table.discard(relpath)
 
 
 def is_excluded_package(pkg, exclude_specs):
     """check whether a given package match 1+ package exclusion stanzas
 
     """
-    # compute list of *matching* package exclusion stanzas
-    specs = [spec for spec in exclude_specs
-             # ignore non package exclusion stanzas
-             if 'files' not in spec and
-             spec['package'] == pkg['package'] and
-             ('version' not in spec or
-              spec['version'] == pkg['version'])]
-    return bool(specs)
+    return _exclusion_specs(exclude_specs) \
+        .excludes_package(pkg['package'], pkg['version'])
 
 
-def _add_package(pkg, conf, session, sticky=False):
+def _add_package(pkg, conf, session, sticky=False, extracted=None):
     """add package `pkg` to both FS and DB storage, and notify plugins
 
-    handles and logs exceptions
+    if `extracted` is given, `pkg` has already been extracted to the FS
+    storage (and FS-side hooks have already been run on it) by an extraction
+    worker, see `_extract_package`, and `extracted` is its file table; only
+    DB-side work is left to do
+
+    handles and logs exceptions; return True if the package has been added
     """
     logging.info('add %s...' % pkg)
     workdir = os.getcwd()
-    try:
-        pkgdir = pkg.extraction_dir(conf['sources_dir'])
-        if pkgdir is None:
-            logging.warning('package %s has no extracion dir, skipping' % pkg)
-            return
+    with instrumentation.measure('package', 'add %s' % pkg, 0) as timing:
         if not conf['dry_run'] and 'fs' in conf['backends']:
+            _measure_pkg_bytes(timing, pkg)
+        try:
+            pkgdir = pkg.extraction_dir(conf['sources_dir'])
+            if pkgdir is None:
+                logging.warning('package %s has no extracion dir, skipping'
+                                % pkg)
+                return
+            file_table = None
+            if not conf['dry_run'] and 'fs' in conf['backends']:
+                if extracted is None:
+                    fs_storage.extract_package(pkg, pkgdir)
+                    # single package scan, shared by DB storage and hooks
+                    file_table = fs_storage.scan_pkg_files(pkgdir)
+                else:
+                    file_table = extracted  # as scanned by the worker
+                os.chdir(pkgdir)
+            with db_storage.bulk_inserter(session).savepoint():
+                # single db session for package addition and hook execution:
+                # if the hooks fail, the package won't be added to the db (it
+                # will be tried again at next run), and rows queued by hooks
+                # for bulk insertion will be discarded
+                if not conf['dry_run'] and 'db' in conf['backends']:
+                    file_ids = db_storage.add_package(session, pkg, pkgdir,
+                                                      sticky, file_table)
+                    if file_ids:
+                        if file_table is None:
+                            file_table = fs_storage.FileTable()
+                        file_table.update(file_ids)
+                exclude_files(session, pkg, pkgdir, file_table,
+                              conf['exclude'])
+                if not conf['dry_run'] and 'hooks' in conf['backends']:
+                    notify(conf, 'add-package', session, pkg, pkgdir,
+                           file_table)
+            return True
+        except:
+            logging.exception('failed to add %s' % pkg)
+        finally:
+            os.chdir(workdir)
+
+
+# configuration of extraction workers, set by _init_extract_worker
+_worker_conf = None
+
+
+def _init_extract_worker(conf):
+    """initialize an extraction worker process, see `_extract_package`
+
+    """
+    global _worker_conf
+    # workers only act on the FS storage: all DB work, DB-side hooks included,
+    # is left to the parent process. Note: plugins share the very same conf
+    # dictionary, so they will notice the change
+    conf['backends'] = conf['backends'] - set(['db', 'hooks.db'])
+    _worker_conf = conf
+    instrumentation.reset()
+
+
+def _extract_package(job):
+    """extraction worker: extract a package to the FS storage, apply file
+    exclusions, and run FS-side hooks on it
+
+    `job` is a pair <index, pkg>. Return a triple <index, file_table,
+    timings>, where file_table is the `fs_storage.FileTable` of the package if
+    it is ready to be added to the DB (None otherwise), see
+    `_add_package(..., extracted=file_table)`, and timings are the
+    instrumentation measures taken by the worker for this job
+
+    handles and logs exceptions
+    """
+    (i, pkg) = job
+    conf = _worker_conf
+    logging.info('extract %s...' % pkg)
+    workdir = os.getcwd()
+    extracted = None
+    with instrumentation.measure('package', 'extract %s' % pkg, 0) as timing:
+        _measure_pkg_bytes(timing, pkg)
+        try:
+            pkgdir = pkg.extraction_dir(conf['sources_dir'])
             fs_storage.extract_package(pkg, pkgdir)
             os.chdir(pkgdir)
-        with session.begin_nested():
-            # single db session for package addition and hook execution: if the
-            # hooks fail, the package won't be added to the db (it will be
-            # tried again at next run)
-            file_table = None
-            if not conf['dry_run'] and 'db' in conf['backends']:
-                file_table = db_storage.add_package(session, pkg, pkgdir,
-                                                    sticky)
-            exclude_files(session, pkg, pkgdir, file_table, conf['exclude'])
-            if not conf['dry_run'] and 'hooks' in conf['backends']:
-                notify(conf, 'add-package', session, pkg, pkgdir, file_table)
-    except:
-        logging.exception('failed to add %s' % pkg)
-    finally:
-        os.chdir(workdir)
+            file_table = fs_storage.scan_pkg_files(pkgdir)
+            # there is no DB file table yet, exclude files from FS storage
+            # only; they will hence never make it to the DB
+            for relpath in _excluded_files(pkg, conf['exclude'], file_table):
+                logging.debug('excluding file %s' % relpath)
+                fs_storage.rm_file(pkgdir, relpath)
+                file_table.discard(relpath)
+            if 'hooks' in conf['backends']:
+                notify_plugins(conf['observers'], 'add-package', None, pkg,
+                               pkgdir, file_table=file_table)
+            extracted = file_table
+        except Exception:
+            logging.exception('failed to extract %s' % pkg)
+        finally:
+            os.chdir(workdir)
+    timings = instrumentation.get().snapshot()
+    instrumentation.reset()
+    return (i, extracted, timings)
 
 
 def _rm_package(pkg, conf, session, db_package=None):
@@ -246,16 +670,22 @@ def _rm_package(pkg, conf, session, db_package=None):
         if not db_package:
             logging.warn('cannot find package %s, not removing' % pkg)
             return
-    try:
-        if not conf['dry_run'] and 'hooks' in conf['backends']:
-            notify(conf, 'rm-package', session, pkg, pkgdir)
-        if not conf['dry_run'] and 'fs' in conf['backends']:
-            fs_storage.remove_package(pkg, pkgdir)
-        if not conf['dry_run'] and 'db' in conf['backends']:
-            with session.begin_nested():
-                db_storage.rm_package(session, pkg, db_package)
-    except:
-        logging.exception('failed to remove %s' % pkg)
+    with instrumentation.measure('package', 'rm %s' % pkg, 0):
+        try:
+            if not conf['dry_run'] and 'hooks' in conf['backends']:
+                # if the package is about to be removed from the DB, hook data
+                # will go away with it: no need to remove them beforehand
+                package_id = None if 'db' in conf['backends'] \
+                    else db_package.id
+                notify(conf, 'rm-package', session, pkg, pkgdir,
+                       package_id=package_id)
+            if not conf['dry_run'] and 'fs' in conf['backends']:
+                fs_storage.remove_package(pkg, pkgdir)
+            if not conf['dry_run'] and 'db' in conf['backends']:
+                with session.begin_nested():
+                    db_storage.rm_package(session, pkg, db_package)
+        except:
+            logging.exception('failed to remove %s' % pkg)
 
 
 def _add_suite(conf, session, suite, sticky=False, aliases=[]):
@@ -285,39 +715,117 @@ def extract_new(status, conf, session, mirror):
     """
     ensure_cache_dir(conf)
 
+    # extraction pool: if enabled, new packages are extracted (and FS-side
+    # hooks run on them) by worker processes, whereas DB additions are
+    # serialized in this process, as the single DB writer
+    workers = conf['extract_workers']
+    use_pool = workers > 1 and not conf['dry_run'] \
+        and 'fs' in conf['backends']
+    new_pkgs = []  # new packages, waiting for the extraction pool
+    packages = status.packages(session)
+
+    def force_triggers(pkg):
+        """run forced triggers on `pkg`; return True if they succeeded"""
+        pkgdir = pkg.extraction_dir(conf['sources_dir'])
+        # hooks check the DB for previous runs on this package: make
+        # rows queued for bulk insertion visible to them
+        db_storage.bulk_flush(session)
+        try:
+            notify_plugins(conf['observers'], 'add-package',
+                           session, pkg, pkgdir,
+                           triggers=conf['force_triggers'],
+                           dry=conf['dry_run'])
+        except:
+            logging.exception('trigger failure on %s' % pkg)
+            return False
+        return True
+
     def add_package(pkg):
         if is_excluded_package(pkg, conf['exclude']):
             logging.info('skipping excluded package %s' % pkg)
             return
-        if not db_storage.lookup_package(session, pkg['package'],
-                                         pkg['version']):
-            # use DB as completion marker: if the package has been inserted, it
-            # means everything went fine last time we tried. If not, we redo
-            # everything, just to be safe
-            _add_package(pkg, conf, session)
-        pkgdir = pkg.extraction_dir(conf['sources_dir'])
-        if conf['force_triggers']:
-            try:
-                notify_plugins(conf['observers'], 'add-package',
-                               session, pkg, pkgdir,
-                               triggers=conf['force_triggers'],
-                               dry=conf['dry_run'])
-            except:
-                logging.exception('trigger failure on %s' % pkg)
-        # add entry for sources.txt, temporarily with no suite associated
         pkg_id = (pkg['package'], pkg['version'])
+        # add entry for sources.txt, temporarily with no suite associated
         dsc_rel = os.path.relpath(pkg.dsc_path(), conf['mirror_dir'])
         pkgdir_rel = os.path.relpath(pkg.extraction_dir(conf['sources_dir']),
                                      conf['sources_dir'])
         status.sources[pkg_id] = pkg.archive_area(), dsc_rel, pkgdir_rel, []
+        # packages completed by a previous, interrupted, run
+        if status.journal is not None and pkg_id in status.journal.packages:
+            return
+        done = True
+        worked = False
+        if not packages.lookup(*pkg_id):
+            # use DB as completion marker: if the package has been inserted, it
+            # means everything went fine last time we tried. If not, we redo
+            # everything, just to be safe
+            if use_pool:
+                # forced triggers will run once the package is in the DB, see
+                # add_extracted
+                new_pkgs.append(pkg)
+                return
+            done = worked = _add_package(pkg, conf, session)
+        if conf['force_triggers']:
+            worked = True
+            done = force_triggers(pkg) and done
+        if done and worked:
+            # packages already known to the DB need no journal record: the
+            # lookup above skips them anyway
+            status.package_done(pkg['package'], pkg['version'])
+
+    def add_extracted(pkg, file_table):
+        if not _add_package(pkg, conf, session, extracted=file_table):
+            return
+        if conf['force_triggers'] and not force_triggers(pkg):
+            return
+        status.package_done(pkg['package'], pkg['version'])
 
     logging.info('add new packages...')
     for pkg in mirror.ls():
+        if status.out_of_time():
+            break
         if not conf['single_transaction']:
             with session.begin():
                 add_package(pkg)
         else:
             add_package(pkg)
+        checkpoint(status, conf, session, force=False)
+
+    if new_pkgs and not status.interrupted:
+        logging.info('extract %d new packages using %d workers...'
+                     % (len(new_pkgs), workers))
+        # ASSUMPTION: workers never use the DB connection inherited from the
+        # parent process; they terminate via os._exit(), so they won't even
+        # try to close it
+        pool = multiprocessing.Pool(workers, _init_extract_worker, (conf,))
+        try:
+            for (i, file_table, timings) in pool.imap_unordered(
+                    _extract_package, enumerate(new_pkgs)):
+                instrumentation.get().merge(timings)
+                if file_table is None:
+                    continue  # failure already logged by the worker
+                if not conf['single_transaction']:
+                    with session.begin():
+                        add_extracted(new_pkgs[i], file_table)
+                else:
+                    add_extracted(new_pkgs[i], file_table)
+                checkpoint(status, conf, session, force=False)
+                if status.out_of_time():
+                    break
+            if status.interrupted:
+                # do not wait for pending extractions, they will be redone
+                pool.terminate()
+            else:
+                pool.close()
+        except Exception:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+    # make sure later stages see all rows added by hooks
+    db_storage.bulk_flush(session)
+    run_shell_batches(conf)
 
 
 def garbage_collect(status, conf, session, mirror):
@@ -325,7 +833,17 @@ def garbage_collect(status, conf, session, mirror):
 
     """
     logging.info('garbage collection...')
-    for version in session.query(Package).filter(not_(Package.sticky)):
+    if conf['force_triggers']:
+        # triggers are to be forced on all packages
+        q = session.query(Package) \
+                   .options(joinedload(Package.name)) \
+                   .filter(not_(Package.sticky))
+    else:
+        # only GC candidates are of interest: packages known to the DB, but
+        # gone from the mirror
+        q = db_storage.gone_packages(session, mirror.packages)
+        logging.info('%d package(s) gone from the mirror' % len(q))
+    for version in q:
         pkg = SourcePackage.from_db_model(version)
         pkg_id = (pkg['package'], pkg['version'])
         pkgdir = pkg.extraction_dir(conf['sources_dir'])
@@ -339,6 +857,7 @@ def garbage_collect(status, conf, session, mirror):
                     datetime.fromtimestamp(os.path.getmtime(pkgdir))
             if not age or age.days >= expire_days:
                 _rm_package(pkg, conf, session, db_package=version)
+                status.discard_package(*pkg_id)
             else:
                 logging.debug('not removing %s as it is too young' % pkg)
 
@@ -347,40 +866,123 @@ def garbage_collect(status, conf, session, mirror):
                 notify_plugins(conf['observers'], 'rm-package',
                                session, pkg, pkgdir,
                                triggers=conf['force_triggers'],
-                               dry=conf['dry_run'])
+                               dry=conf['dry_run'], package_id=version.id)
             except:
                 logging.exception('trigger failure on %s' % pkg)
 
+    run_shell_batches(conf)
+
+
+def _update_suite_info(conf, session, suite):
+    """ensure the static suite info of (non-sticky) `suite` is up to date,
+    touching the DB only if needed
+
+    """
+    db_suite = session.query(SuiteInfo).get(suite)
+    if not db_suite:
+        _add_suite(conf, session, suite)
+        return
+    suite_version = None
+    suite_reldate = None
+    if suite in DEBIAN_RELEASES:
+        suite_version = DEBIAN_RELEASES[suite]['version']
+        suite_reldate = DEBIAN_RELEASES[suite]['date']
+    if (db_suite.sticky, db_suite.version, db_suite.release_date) != \
+       (False, suite_version, suite_reldate):
+        db_suite.sticky = False
+        db_suite.version = suite_version
+        db_suite.release_date = suite_reldate
+
+
+def load_synced_suites(fname):
+    """load a `suites-synced` file and return its content as a dictionary
+    mapping suite names to the mirror fingerprints they were last synced at
+
+    """
+    synced = {}
+    with open(fname) as f:
+        for line in f:
+            suite, fingerprint = line.split()
+            synced[suite] = fingerprint
+    return synced
+
+
+def save_synced_suites(synced, fname):
+    """save a `suites-synced` file, atomically, reading fingerprints from a
+    dictionary mapping suite names to them
+
+    """
+    with open(fname + '.new', 'w') as out:
+        for suite, fingerprint in sorted(six.iteritems(synced)):
+            out.write('%s\t%s\n' % (suite, fingerprint))
+    os.rename(fname + '.new', fname)
+
+
+def _suites_synced(conf, session, synced):
+    """record that the DB suite mappings of `synced` suites are in sync with
+    the mirror, as of the given mirror fingerprints
+
+    the record is stored in the `suites-synced` cache file only once the
+    ongoing DB transaction (if any) has been committed
+
+    """
+    ensure_cache_dir(conf)
+    synced_file = os.path.join(conf['cache_dir'], 'suites-synced')
+
+    def save(session=None):
+        save_synced_suites(synced, synced_file)
+
+    if os.path.exists(synced_file):
+        # not in sync until the transaction commits
+        os.unlink(synced_file)
+    if session.autocommit:
+        save()
+    else:
+        event.listen(session, 'after_commit', save, once=True)
+
 
 def update_suites(status, conf, session, mirror):
-    """update stage: sweep and recreate suite mappings
+    """update stage: sync suite mappings with the mirror
+
+    only the differences between the mirror and the DB are applied, as bulk
+    insertions and deletions. Suites whose Sources files did not change since
+    the last (committed) sync are skipped altogether, unless they contain
+    newly added packages
 
     """
     logging.info('update suites mappings...')
 
     insert_q = sql.insert(Suite.__table__)
     insert_params = []
-
-    # load suites aliases
-    suites_aliases = mirror.ls_suites_with_aliases()
-    if not conf['dry_run'] and 'db' in conf['backends']:
-        session.query(SuiteAlias).delete()
+    packages = status.packages(session)
+    db_writes = not conf['dry_run'] and 'db' in conf['backends']
+
+    # suites synced with the mirror in past runs, see _suites_synced()
+    synced_file = os.path.join(conf['cache_dir'], 'suites-synced')
+    synced = {}
+    if os.path.exists(synced_file):
+        synced = load_synced_suites(synced_file)
+    # cheap sanity check of synced suites, e.g. against DB restores
+    db_counts = dict(session.query(Suite.suite, sql_func.count(Suite.id))
+                            .group_by(Suite.suite))
+    now_synced = {}
 
     for (suite, pkgs) in six.iteritems(mirror.suites):
-        if not conf['dry_run'] and 'db' in conf['backends']:
-            session.query(Suite).filter_by(suite=suite).delete()
+        fingerprint = mirror.fingerprints[suite]
+        complete = True  # whether all suite packages are in the DB
+        unchanged = synced.get(suite) == fingerprint
+        mirror_ids = set()
         for pkg_id in pkgs:
             (pkg, version) = pkg_id
-            db_package = db_storage.lookup_package(session, pkg, version)
-            if not db_package:
+            package_id = packages.lookup(pkg, version)
+            if not package_id:
                 logging.warn('package %s/%s not found in suite %s, skipping'
                              % (pkg, version, suite))
+                complete = False
             else:
-                logging.debug('add suite mapping: %s/%s -> %s'
-                              % (pkg, version, suite))
-                params = {'package_id': db_package.id,
-                          'suite': suite}
-                insert_params.append(params)
+                mirror_ids.add(package_id)
+                if not packages.preloaded(pkg, version):
+                    unchanged = False
                 if pkg_id in status.sources:
                     # fill-in incomplete suite information in status
                     status.sources[pkg_id][-1].append(suite)
@@ -388,21 +990,59 @@ def update_suites(status, conf, session, mirror):
                     # defensive measure to make update_suites() more reusable
                     logging.warn('cannot find %s/%s during suite update'
                                  % (pkg, version))
-        if not conf['dry_run'] and 'db' in conf['backends'] \
-           and len(insert_params) >= BULK_FLUSH_THRESHOLD:
+        if complete:
+            now_synced[suite] = fingerprint
+        if unchanged and db_counts.get(suite) == len(mirror_ids):
+            logging.debug('suite %s unchanged, skipping' % suite)
+            continue
+
+        db_ids = set(row[0] for row in
+                     session.query(Suite.package_id)
+                            .filter(Suite.suite == suite))
+        gone_ids = db_ids - mirror_ids
+        logging.debug('suite %s: %d mapping(s) to add, %d to remove'
+                      % (suite, len(mirror_ids - db_ids), len(gone_ids)))
+        if db_writes:
+            if gone_ids:
+                session.query(Suite) \
+                       .filter(Suite.suite == suite) \
+                       .filter(Suite.package_id.in_(gone_ids)) \
+                       .delete(synchronize_session=False)
+            insert_params.extend({'package_id': package_id, 'suite': suite}
+                                 for package_id in mirror_ids - db_ids)
+            if len(insert_params) >= BULK_FLUSH_THRESHOLD:
+                session.execute(insert_q, insert_params)
+                session.flush()
+                insert_params = []
+            _update_suite_info(conf, session, suite)
+
+    if db_writes:
+        if insert_params:
             session.execute(insert_q, insert_params)
-            session.flush()
-            insert_params = []
-
-        if not conf['dry_run'] and 'db' in conf['backends']:
-            session.query(SuiteInfo).filter_by(name=suite).delete()
-            _add_suite(conf, session, suite, aliases=suites_aliases[suite])
+        session.flush()
 
-    if not conf['dry_run'] and 'db' in conf['backends'] \
-       and insert_params:
-        session.execute(insert_q, insert_params)
+        # sync suite aliases. Note: aliases of suites no longer in the mirror
+        # get removed
+        aliases_q = sql.insert(SuiteAlias.__table__)
+        mirror_aliases = set((alias, suite) for (suite, aliases)
+                             in six.iteritems(mirror.ls_suites_with_aliases())
+                             if suite in mirror.suites
+                             for alias in aliases)
+        db_aliases = set(session.query(SuiteAlias.alias, SuiteAlias.suite))
+        gone_aliases = [alias for (alias, _suite)
+                        in db_aliases - mirror_aliases]
+        if gone_aliases:
+            session.query(SuiteAlias) \
+                   .filter(SuiteAlias.alias.in_(gone_aliases)) \
+                   .delete(synchronize_session=False)
+        new_aliases = [{'alias': alias, 'suite': suite}
+                       for (alias, suite) in mirror_aliases - db_aliases]
+        if new_aliases:
+            session.execute(aliases_q, new_aliases)
         session.flush()
 
+        _suites_synced(conf, session, now_synced)
+
     # update sources.txt, now that we know the suite mappings
     src_list_path = os.path.join(conf['cache_dir'], 'sources.txt')
     with open(src_list_path + '.new', 'w') as src_list:
@@ -463,48 +1103,22 @@ def update_statistics(status, conf, session, suites=None):
             total_slocs += v
         d[prefix] = total_slocs
 
-    # compute overall stats
-    suite = 'ALL'
-    siz = HistorySize(suite, timestamp=now)
-    loc = HistorySlocCount(suite, timestamp=now)
-    for stat in ['disk_usage', 'source_packages', 'source_files', 'ctags']:
-        v = getattr(statistics, stat)(session)
-        stats['total.' + stat] = v
-        setattr(siz, stat, v)
-    store_sloccount_stats(statistics.sloccount_summary(session),
-                          stats, 'total.sloccount', loc)
-    if not conf['dry_run'] and 'db' in conf['backends']:
-        session.add(siz)
-        session.add(loc)
-
-    # Update HistorySize
-    suite_key = 'debian_'
-    hist_siz = dict((suite, HistorySize(suite, timestamp=now))
-                    for suite in suites)
-    for stat in ['disk_usage', 'source_packages', 'source_files', 'ctags']:
-        stats_result = statistics.stats_grouped_by(session, stat)
-        for res in stats_result:
-            if res[0] in suites:
-                stats[suite_key + res[0] + '.' + stat] = res[1]
-                setattr(hist_siz[res[0]], stat, res[1])
-
-    if not conf['dry_run'] and 'db' in conf['backends']:
-        for siz in hist_siz.values():
+    # compute overall and per-suite stats, all at once
+    all_stats = statistics.suites_stats(session, suites)
+    for (suite, suite_stats) in six.iteritems(all_stats):
+        if suite == 'ALL':
+            prefix = 'total.'
+        else:
+            prefix = 'debian_' + suite + '.'
+        siz = HistorySize(suite, timestamp=now)
+        loc = HistorySlocCount(suite, timestamp=now)
+        for stat in statistics.SIZE_STATS:
+            stats[prefix + stat] = suite_stats[stat]
+            setattr(siz, stat, suite_stats[stat])
+        store_sloccount_stats(suite_stats['sloccount'], stats,
+                              prefix + 'sloccount', loc)
+        if not conf['dry_run'] and 'db' in conf['backends']:
             session.add(siz)
-
-    # update historySlocCount
-    sloccount_res = statistics.stats_grouped_by(session, 'sloccount')
-    hist_loc = dict((suite, HistorySlocCount(suite, timestamp=now))
-                    for suite in suites)
-    for suite in suites:
-        temp = dict((item[1], item[2]) for item in sloccount_res
-                    if item[0] == suite)
-        store_sloccount_stats(dict(temp), stats,
-                              suite_key + suite + ".sloccount",
-                              hist_loc[suite])
-
-    if not conf['dry_run'] and 'db' in conf['backends']:
-        for loc in hist_loc.values():
             session.add(loc)
 
     session.flush()
@@ -524,10 +1138,9 @@ def update_statistics(status, conf, session, suites=None):
 
         hist_lic = dict((suite, HistoryCopyright(suite, timestamp=now))
                         for suite in suites)
-        results = statistics.get_licenses(session)
+        all_stats = status.license_stats(session)
         for suite in suites:
-            temp = dict((item[0], item[2]) for item in results
-                        if item[1] == suite)
+            temp = all_stats.get(suite, {}).get('licenses', {})
             summary = statistics.licenses_summary(temp)
             for res in summary:
                 license_stats[suite + "." + res.rstrip()] = summary[res]
@@ -542,7 +1155,7 @@ def update_statistics(status, conf, session, suites=None):
 
         # overall dual licenses
         overall_d_licenses = statistics.licenses_summary_w_dual(
-            statistics.get_licenses(session, 'ALL'))
+            all_stats['ALL']['licenses'])
         for stat in overall_d_licenses:
             license_d_stats['overall.' + stat] = overall_d_licenses[stat]
 
@@ -552,7 +1165,7 @@ def update_statistics(status, conf, session, suites=None):
 
         session.flush()
         overall_licenses = statistics.licenses_summary(
-            statistics.get_licenses(session, 'ALL'))
+            all_stats['ALL']['licenses'])
         for stat in overall_licenses:
             lic = HistoryCopyright('ALL', timestamp=now)
             setattr(lic, 'license', stat.replace('_', ' '))
@@ -592,12 +1205,23 @@ def update_metadata(status, conf, session):
 
 
 def update_charts(status, conf, session, suites=None):
-    """update stage: rebuild charts"""
+    """update stage: rebuild charts
+
+    charts whose inputs did not change since the previous run are not
+    rendered again; the others are rendered in parallel, using
+    `conf['charts_workers']` processes
 
+    """
     from debsources import charts
     logging.info('update charts...')
     ensure_stats_dir(conf)
     suites = __target_suites(session, suites)
+    stats_dir = os.path.join(conf['cache_dir'], 'stats')
+    jobs = []  # charts to render, see `charts.render_charts`
+
+    def chart(plot, fname, *args, **kwargs):
+        kwargs['fname'] = os.path.join(stats_dir, fname)
+        jobs.append((plot, args, kwargs))
 
     CHARTS = [  # <period, granularity> paris
         ('1 month', 'hourly'),
@@ -612,12 +1236,8 @@ def update_charts(status, conf, session, suites=None):
             for suite in suites + ['ALL']:
                 series = getattr(statistics, 'history_size_' + granularity)(
                     session, metric, interval=period, suite=suite)
-                chart_file = os.path.join(conf['cache_dir'], 'stats',
-                                          '%s-%s-%s.png' %
-                                          (suite, metric,
-                                           period.replace(' ', '-')))
-                if not conf['dry_run']:
-                    charts.size_plot(series, chart_file)
+                chart('size_plot', '%s-%s-%s.png' %
+                      (suite, metric, period.replace(' ', '-')), series)
 
     # sloccount: historical histograms
     for (period, granularity) in CHARTS:
@@ -625,11 +1245,8 @@ def update_charts(status, conf, session, suites=None):
             # historical histogram
             mseries = getattr(statistics, 'history_sloc_' + granularity)(
                 session, interval=period, suite=suite)
-            chart_file = os.path.join(conf['cache_dir'], 'stats',
-                                      '%s-sloc-%s.png' %
-                                      (suite, period.replace(' ', '-')))
-            if not conf['dry_run']:
-                charts.multiseries_plot(mseries, chart_file)
+            chart('multiseries_plot', '%s-sloc-%s.png' %
+                  (suite, period.replace(' ', '-')), mseries)
 
     # sloccount: current pie charts
     sloc_per_suite = []
@@ -640,18 +1257,15 @@ def update_charts(status, conf, session, suites=None):
         slocs = statistics.sloccount_summary(session, suite=sloc_suite)
         if suite not in ['ALL']:
             sloc_per_suite.append(slocs)
-        chart_file = os.path.join(conf['cache_dir'], 'stats',
-                                  '%s-sloc_pie-current.png' % suite)
-        if not conf['dry_run']:
-            charts.pie_chart(slocs, chart_file)
+        chart('pie_chart', '%s-sloc_pie-current.png' % suite, slocs)
 
     # sloccount: bar chart plot
     if 'charts_top_langs' in conf.keys():
         top_langs = int(conf['charts_top_langs'])
     else:
         top_langs = 6
-    chart_file = os.path.join(conf['cache_dir'], 'stats', 'sloc_bar_plot.png')
-    charts.bar_chart(sloc_per_suite, suites, chart_file, top_langs, 'SLOC')
+    chart('bar_chart', 'sloc_bar_plot.png', sloc_per_suite, suites,
+          N=top_langs, y_label='SLOC')
 
     def update_license_charts():
         # License: historical histogramms
@@ -660,51 +1274,44 @@ def update_charts(status, conf, session, suites=None):
                 mseries = getattr(statistics,
                                   'history_copyright_' + granularity)(
                     session, interval=period, suite=suite)
-                chart_file = os.path.join(conf['cache_dir'], 'stats',
-                                          'copyright_%s-license-%s.png' %
-                                          (suite, period.replace(' ', '-')))
-                if not conf['dry_run']:
-                    charts.multiseries_plot(mseries, chart_file, cols=3)
+                chart('multiseries_plot', 'copyright_%s-license-%s.png' %
+                      (suite, period.replace(' ', '-')), mseries, cols=3)
 
         # License: overall pie chart
+        all_stats = status.license_stats(session)
         overall_licenses = statistics.licenses_summary(
-            statistics.get_licenses(session, 'ALL'))
-        ratio = qry.get_ratio(session)
-        chart_file = os.path.join(conf['cache_dir'], 'stats',
-                                  'copyright_overall-license_pie.png')
-        if not conf['dry_run']:
-            charts.pie_chart(overall_licenses, chart_file, ratio)
+            all_stats['ALL']['licenses'])
+        ratio = statistics.license_ratio(all_stats['ALL'])
+        chart('pie_chart', 'copyright_overall-license_pie.png',
+              overall_licenses, ratio=ratio)
 
         # License: bar chart and per suite pie chart.
         all_suites = statistics.sticky_suites(session) \
             + __target_suites(session, None)
         licenses_per_suite = []
-        results = statistics.get_licenses(session)
+        empty_stats = {'files': 0, 'licensed_files': 0, 'licenses': {}}
         for suite in all_suites:
-            temp = dict((item[0], item[2]) for item in results
-                        if item[1] == suite)
-            licenses = statistics.licenses_summary(temp)
-            ratio = qry.get_ratio(session, suite=suite)
+            suite_stats = all_stats.get(suite, empty_stats)
+            licenses = statistics.licenses_summary(suite_stats['licenses'])
+            ratio = statistics.license_ratio(suite_stats)
             # draw license pie chart
-            if not conf['dry_run']:
-                chart_file = os.path.join(conf['cache_dir'], 'stats',
-                                          'copyright_%s'
-                                          '-license_pie-current.png'
-                                          % suite)
-                charts.pie_chart(licenses, chart_file, ratio)
-
+            chart('pie_chart', 'copyright_%s-license_pie-current.png' % suite,
+                  licenses, ratio=ratio)
             licenses_per_suite.append(licenses)
 
-        chart_file = os.path.join(conf['cache_dir'], 'stats',
-                                  'copyright_license_bar_plot.png')
-        if not conf['dry_run']:
-            charts.bar_chart(licenses_per_suite, all_suites, chart_file,
-                             top_langs, 'Number of files')
+        chart('bar_chart', 'copyright_license_bar_plot.png',
+              licenses_per_suite, all_suites, N=top_langs,
+              y_label='Number of files')
 
     # LICENSE CHARTS
     if 'copyright' in conf['hooks']:
         update_license_charts()
 
+    if not conf['dry_run']:
+        charts.render_charts(jobs, stats_dir,
+                             workers=conf.get('charts_workers', 1))
+
+
 # update stages
 (STAGE_EXTRACT,
  STAGE_SUITES,
@@ -742,25 +1349,114 @@ def pp_stage(stage):
         raise ValueError('unknown update stage %s' % stage)
 
 
+def _mirror_state(mirror):
+    """return a fingerprint of the state of `mirror` as a whole, see
+    `SourceMirror.fingerprints`
+
+    """
+    return hashlib.sha1(repr(sorted(mirror.fingerprints.items()))) \
+        .hexdigest()
+
+
+def _open_journal(conf, mirror):
+    """return the journal of the update run, resuming the one of a previous,
+    interrupted, run if any. The journal of a previous run is discarded if
+    `mirror` has changed since, as completed stages would then miss the
+    changes
+
+    """
+    journal_file = None
+    if not conf['dry_run']:
+        ensure_cache_dir(conf)
+        journal_file = os.path.join(conf['cache_dir'], JOURNAL)
+    run_journal = journal.Journal(journal_file)
+    state = _mirror_state(mirror)
+    if run_journal.resumed and run_journal.mirror != state:
+        logging.warn('mirror changed since interrupted update run, started on'
+                     ' %s; not resuming it'
+                     % formatdate(run_journal.start, localtime=True))
+        run_journal.finish()
+        run_journal = journal.Journal(journal_file)
+    if run_journal.resumed:
+        logging.info('resume interrupted update run, started on %s'
+                     % formatdate(run_journal.start, localtime=True))
+    else:
+        run_journal.set_mirror(state)
+    return run_journal
+
+
 def update(conf, session, stages=UPDATE_STAGES):
     """do a full update run
+
+    if journaling is enabled (conf['journal']), the run is resumable: work is
+    committed at regular checkpoints and recorded in a journal, which is
+    disposed of only at the end of the run. If a previous run has been
+    interrupted (e.g. by a crash, or by exhausting its time budget), the new
+    run resumes it, skipping already completed stages and packages, unless
+    the mirror has changed in between
+
+    if conf['commit_every'] is set to a pair <packages, seconds>, a single
+    transaction run is split into medium-sized transactions, committed at the
+    end of each stage and every that many added packages or seconds (whichever
+    comes first); each package is still added within its own savepoint
+
+    if conf['time_budget'] is set, the run stops (gracefully, at the next
+    package or stage boundary) after that many minutes
+
     """
     logging.info('start')
     logging.info('list mirror packages...')
-    mirror = SourceMirror(conf['mirror_dir'])
-    status = UpdateStatus()
-
-    if STAGE_EXTRACT in stages:
-        extract_new(status, conf, session, mirror)      # stage 1
-    if STAGE_SUITES in stages:
-        update_suites(status, conf, session, mirror)    # stage 2
-    if STAGE_GC in stages:
-        garbage_collect(status, conf, session, mirror)  # stage 3
-    if STAGE_STATS in stages:
-        update_statistics(status, conf, session)        # stage 4
-    if STAGE_CACHE in stages:
-        update_metadata(status, conf, session)          # stage 5
-    if STAGE_CHARTS in stages:
-        update_charts(status, conf, session)            # stage 6
-
+    mirror = SourceMirror(conf['mirror_dir'],
+                          cache_dir=os.path.join(conf['cache_dir'], 'mirror'))
+    run_journal = None
+    if conf.get('journal'):
+        run_journal = _open_journal(conf, mirror)
+    deadline = None
+    if conf.get('time_budget'):
+        deadline = time.time() + conf['time_budget'] * 60
+    status = UpdateStatus(run_journal, deadline)
+    timings = instrumentation.reset()
+
+    def run_stage(stage, fn, *args):
+        if stage not in stages or status.out_of_time():
+            return
+        name = pp_stage(stage)
+        if run_journal is not None and name in run_journal.stages:
+            # the suites stage needs the mirror listing done while extracting;
+            # in that case, redo extraction, which will be cheap anyhow
+            if not (stage == STAGE_EXTRACT and STAGE_SUITES in stages and
+                    pp_stage(STAGE_SUITES) not in run_journal.stages):
+                logging.info('skip stage %s, already done' % name)
+                return
+        with timings.measure('stage', name):
+            fn(status, conf, session, *args)
+        if not status.interrupted:
+            if run_journal is not None:
+                run_journal.stage_done(name)
+            checkpoint(status, conf, session)
+
+    with timings.watch_session(session):
+        run_stage(STAGE_EXTRACT, extract_new, mirror)        # stage 1
+        run_stage(STAGE_SUITES, update_suites, mirror)       # stage 2
+        run_stage(STAGE_GC, garbage_collect, mirror)         # stage 3
+        run_stage(STAGE_STATS, update_statistics)            # stage 4
+        run_stage(STAGE_CACHE, update_metadata)              # stage 5
+        run_stage(STAGE_CHARTS, update_charts)               # stage 6
+
+    if run_journal is not None:
+        if status.interrupted:
+            checkpoint(status, conf, session)
+            logging.info('update run interrupted, next run will resume it')
+        else:
+            run_journal.finish()
+
+    timings.log_summary()
+    rates = db_storage.bulk_inserter(session).rates()
+    for table in sorted(rates):
+        logging.info('bulk insertion rate into %s: %d rows/s'
+                     % (table, rates[table]))
+    if not conf['dry_run']:
+        ensure_cache_dir(conf)
+        timings.write_report(os.path.join(conf['cache_dir'],
+                                          TIMINGS_REPORT))
     logging.info('finish')